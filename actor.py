@@ -0,0 +1,67 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import Future
+from queue import SimpleQueue
+from threading import Lock, Thread, get_ident
+from stats import STATS
+from metrics import METRICS
+
+LATENCY_SMOOTHING = 0.05 # weight of the latest command in average queue latency
+
+class Actor:
+    """
+    Single thread owning the lobby state.
+    Connection threads submit commands instead of changing lobby directly,
+    commands are executed one by one in the order they were submitted
+    """
+    queue: SimpleQueue # (submission time, future, function, args, context of submitting thread)
+    thread: Thread
+    lock: Lock
+
+    def __init__(self) -> None:
+        self.queue = SimpleQueue()
+        self.thread = None
+        self.lock = Lock()
+
+    def start(self):
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function, *args) -> Future:
+        """
+        Queues command, result can be obtained from returned future
+        """
+        with self.lock:
+            if not self.thread:
+                self.start() # started lazily, so process can be forked before
+        future = Future()
+        self.queue.put((time.monotonic(), future, function, args, contextvars.copy_context()))
+        STATS["actor_queue"] = self.queue.qsize()
+        return future
+
+    def call(self, function, *args):
+        """
+        Queues command and waits for its result. Commands calling other commands run them immediately
+        """
+        if self.thread and self.thread.ident == get_ident():
+            return function(*args)
+        return self.submit(function, *args).result()
+
+    def run(self):
+        while True:
+            submitted, future, function, args, context = self.queue.get()
+            latency = (time.monotonic() - submitted) * 1000
+            STATS["actor_queue"] = self.queue.qsize()
+            STATS["actor_commands"] += 1
+            STATS["actor_latency"] += (latency - STATS["actor_latency"]) * LATENCY_SMOOTHING
+            STATS["actor_latency_max"] = max(STATS["actor_latency_max"], latency)
+
+            try:
+                # command sees context variables of its submitter, e.g. sender for logging
+                future.set_result(context.run(function, *args))
+            except Exception as e:
+                logging.error(f"[!] Lobby command failed: {e}")
+                METRICS.count("errors", "command")
+                future.set_exception(e)
@@ -0,0 +1,126 @@
+import logging
+import time
+from threading import Lock
+from stats import STATS
+from metrics import METRICS
+
+PRUNE_AFTER = 10000 # amount of tracked addresses after which idle ones are forgotten
+
+class Admission:
+    """
+    Limits amount of connections. Address limits are checked right after accepting,
+    before any thread or parsing work is spent on connection.
+    Lobby and pipe limits are checked once connection type is known from handshake.
+    Zero limit means unlimited
+    """
+    maxLobbies: int # concurrent lobby connections
+    maxPipes: int # concurrent game connections
+    maxPerAddress: int # concurrent connections from single address
+    rate: float # new connections per second from single address
+    burst: float # new connections from single address allowed at once
+    active: dict # address -> amount of connections
+    total: int # amount of admitted connections
+    buckets: dict # address -> [tokens, last update time]
+    lobbies: int
+    pipes: int
+    lock: Lock
+
+    def __init__(self) -> None:
+        self.maxLobbies = 0
+        self.maxPipes = 0
+        self.maxPerAddress = 0
+        self.rate = 0
+        self.burst = 0
+        self.active = {}
+        self.total = 0
+        self.buckets = {}
+        self.lobbies = 0
+        self.pipes = 0
+        self.lock = Lock()
+
+    def reject(self, reason: str, address: tuple) -> bool:
+        logging.info(f"[!] Connection from {address} is rejected: {reason}")
+        STATS["rejected"] += 1
+        METRICS.count("rejections", reason)
+        return False
+
+    def admit(self, address: tuple, limitRate: bool = True) -> bool:
+        """
+        Called for accepted socket. If False is returned, socket must be closed.
+        Rate isn't limited for connections passed by another process, since it was done by accepting process
+        """
+        ip = address[0]
+        with self.lock:
+            if self.maxLobbies and self.maxPipes and self.total >= self.maxLobbies + self.maxPipes:
+                return self.reject("capacity", address)
+
+            if self.maxPerAddress and self.active.get(ip, 0) >= self.maxPerAddress:
+                return self.reject("address", address)
+
+            if self.rate and limitRate and not self.take(ip):
+                return self.reject("rate", address)
+
+            self.active[ip] = self.active.get(ip, 0) + 1
+            self.total += 1
+            return True
+
+    def take(self, ip: str) -> bool:
+        # token bucket of the address, lock must be held
+        now = time.monotonic()
+        bucket = self.buckets.get(ip)
+        if not bucket:
+            if len(self.buckets) >= PRUNE_AFTER:
+                self.prune(now)
+            bucket = self.buckets[ip] = [self.burst, now]
+
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def prune(self, now: float):
+        # refilled bucket is the same as absent one
+        for ip, bucket in list(self.buckets.items()):
+            if bucket[0] + (now - bucket[1]) * self.rate >= self.burst:
+                del self.buckets[ip]
+
+    def classify(self, sender) -> bool:
+        """
+        Called after handshake. If False is returned, connection must be closed
+        """
+        if sender.admitted:
+            return True
+
+        with self.lock:
+            if sender.isLobby():
+                if self.maxLobbies and self.lobbies >= self.maxLobbies:
+                    return self.reject("lobby", sender.address)
+                self.lobbies += 1
+                sender.admitted = "lobby"
+
+            if sender.isPipe() and sender.client.auth:
+                if self.maxPipes and self.pipes >= self.maxPipes:
+                    return self.reject("pipe", sender.address)
+                self.pipes += 1
+                sender.admitted = "pipe"
+        return True
+
+    def release(self, sender):
+        with self.lock:
+            if sender.admitted == "lobby":
+                self.lobbies -= 1
+            if sender.admitted == "pipe":
+                self.pipes -= 1
+            sender.admitted = None
+            self.total -= 1
+
+            ip = sender.address[0]
+            count = self.active.get(ip, 0) - 1
+            if count > 0:
+                self.active[ip] = count
+            else:
+                self.active.pop(ip, None)
+
+ADMISSION = Admission()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import logs
+import socket
+import struct
+import time
+import tracing
+from sender import Sender, BUFFER_SIZE
+from lobby import Lobby, openPipe
+from buffers import MAX_FRAME_SIZE
+from metrics import METRICS
+from outbox import Outbox
+from admission import ADMISSION
+
+class StreamSocket:
+    """
+    Socket-like wrapper around asyncio streams.
+    Lobby and Session keep working with `send`/`sendall`/`close` as with plain sockets,
+    while actual writing is performed by event loop
+    """
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    def send(self, data, flags = 0) -> int:
+        self.writer.write(data)
+        return len(data)
+
+    def sendall(self, data, flags = 0):
+        self.writer.write(data)
+
+    def setsockopt(self, *args):
+        self.writer.get_extra_info('socket').setsockopt(*args)
+
+    def getsockopt(self, *args):
+        return self.writer.get_extra_info('socket').getsockopt(*args)
+
+    def fileno(self) -> int:
+        if self.writer.transport.is_closing():
+            return -1
+        return self.writer.get_extra_info('socket').fileno()
+
+    def close(self):
+        self.writer.close()
+
+    def shutdown(self, how):
+        self.writer.transport.abort()
+
+    async def drain(self):
+        await self.writer.drain()
+
+
+class StreamOutbox(Outbox):
+    """
+    Stream writer never blocks and keeps data in the transport buffer,
+    which is taken into account for high water mark
+    """
+    __slots__ = ()
+
+    def backlog(self) -> int:
+        return self.sock.writer.transport.get_write_buffer_size()
+
+
+class AsyncServer:
+    """
+    Event loop server: lobby handshake, lobby dispatching and pipes relaying
+    are performed in the single thread
+    """
+    lobby: Lobby
+
+    def __init__(self, lobby: Lobby) -> None:
+        self.lobby = lobby
+        self.lobby.outboxType = StreamOutbox
+
+    def run(self, listen_socket: socket):
+        asyncio.run(self.serve(listen_socket))
+
+    async def serve(self, listen_socket: socket):
+        # deadlines expire in scheduler thread, but lobby is owned by event loop instead of actor
+        loop = asyncio.get_running_loop()
+        self.lobby.scheduler.executor = loop.call_soon_threadsafe
+        server = await asyncio.start_server(self.listen_for_client, sock=listen_socket)
+        async with server:
+            await server.serve_forever()
+
+    async def receive_data(self, sender: Sender):
+        reader = sender.sock.reader
+        if sender.isPipe() and sender.client.auth:
+            return await reader.read(BUFFER_SIZE)
+
+        try:
+            # Read message length and unpack it into an integer
+            raw_msglen = await reader.readexactly(4)
+            msglen = struct.unpack('<I', raw_msglen)[0]
+            if msglen > MAX_FRAME_SIZE:
+                return None
+            # Read the message data
+            return await reader.readexactly(msglen)
+        except asyncio.IncompleteReadError:
+            return None
+
+    async def listen_for_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client_address = writer.get_extra_info('peername')
+        if not ADMISSION.admit(client_address):
+            writer.transport.abort()
+            return
+
+        logging.info(f"[+] {client_address} connected.")
+        sender = Sender(StreamSocket(reader, writer))
+        sender.address = client_address
+        logs.CONTEXT.set(sender) # every connection is served by its own task with its own context
+        self.lobby.connect(sender)
+
+        try:
+            while True:
+                msg = await self.receive_data(sender)
+                received = time.perf_counter() if tracing.ENABLED else None
+
+                if msg == None or msg == b'':
+                    break # receiving empty message means that TCP connection is stopped
+
+                if not sender.client or not sender.client.auth:
+                    # client isn't identified yet
+                    if sender.handshake(msg) == False:
+                        METRICS.count("errors", "handshake")
+                        if sender.client: # partially authorized client - we can send an error message
+                            logging.error(f"[!] {sender.client.status}")
+                            if sender.isLobby():
+                                self.lobby.send(sender, f":>>ERROR:{sender.client.status}")
+                        break # handle disconnection if handshakign is unsuccessfull
+
+                    if not ADMISSION.classify(sender):
+                        if sender.isLobby():
+                            self.lobby.send(sender, f":>>ERROR:Server is full, try again later")
+                        break
+
+                    if sender.isPipe() and sender.client.auth:
+                        #read missing byte
+                        sender.client.prevmessages.append(await reader.readexactly(1))
+                        msg = b'' #reset message to prevent its duplicating
+
+                        openPipe(sender, self.lobby.attachPipe(sender))
+
+                if sender.isPipe():
+                    if not sender.client.auth:
+                        continue #continue handshaking
+
+                    if not sender.client.session:
+                        break #cannot connect player - break connection
+
+                    if not sender.client.session.validPipe(sender.sock):
+                        # opposite client still not connected - wait for them and store all pending messages
+                        if msg != b'':
+                            sender.client.session.pipeMessages(sender.sock).append(msg)
+                        continue
+
+                    # connection established - just forward data and apply backpressure of opposite client
+                    opposite = sender.client.session.getPipe(sender.sock)
+                    sender.client.session.forward_data(sender.sock, msg, received)
+                    await opposite.drain()
+
+                if sender.isLobby():
+                    sender.lastSeen = time.monotonic()
+                    self.lobby.dispatch(sender, msg)
+
+        except Exception as e:
+            # client no longer connected
+            logging.error(f"[!] Error: {e}")
+            METRICS.count("errors", "connection")
+
+        finally:
+            self.lobby.closeConnection(sender)
@@ -0,0 +1,90 @@
+"""
+Microbenchmark of lobby command dispatching: cost per command for typical client messages.
+Parsing is compared with legacy recursive parser, which re-encoded the rest of message after every tag.
+Users list update is measured for growing lobby, its cost must grow linearly with amount of users.
+Lobby is created in-process, messages are written to outboxes which drop them.
+
+    python3 benchmarks/bench_dispatch.py [count]
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from lobby import Lobby, tokenize
+from sender import Sender
+
+USERS = 20
+BROADCAST_USERS = [500, 1000, 2000] # lobby sizes for users list update
+
+MESSAGES = {
+    "ALIVE": b"<ALIVE>",
+    "VER": b"<VER>1.5.0",
+    "MSG": b"<MSG>hello everybody, anyone wants to play?",
+    "HERE": b"<HERE>",
+    "unknown": b"<UNKNOWN>value",
+    "chatty frame": b"<VER>1.5.0" + b"<ALIVE>" * 30 + b"<MSG>done",
+}
+
+class NullOutbox:
+    def __init__(self, sock, flusher) -> None:
+        pass
+
+    def put(self, data: bytes) -> bool:
+        return True
+
+def tokenize_legacy(arr: bytes, encoding: str) -> list:
+    # parser of previous dispatcher, without handlers
+    result = []
+    msg = str(arr, encoding=encoding, errors='replace')
+    _open = msg.partition('<')
+    _close = _open[2].partition('>')
+    if _open[1] == '' or _open[2] == '' or _close[0] == '' or _close[1] == '':
+        return result
+
+    _nextTag = _close[2].partition('<')
+    result.append((_close[0], _nextTag[0]))
+    arr = (_nextTag[1] + _nextTag[2]).encode()
+    if arr:
+        result += tokenize_legacy(arr, encoding)
+    return result
+
+def make_lobby(users: int = USERS) -> tuple:
+    lobby = Lobby()
+    lobby.outboxType = NullOutbox
+    senders = []
+    for i in range(users):
+        sender = Sender(None)
+        sender.address = ("127.0.0.1", 10000 + i)
+        sender.handshake(bytes([6, 0]) + b"<GREETINGS>")
+        lobby.connect(sender)
+        lobby.dispatch(sender, f"<GREETINGS>user{i}".encode())
+        senders.append(sender)
+    return lobby, senders
+
+def measure(fn, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lobby, senders = make_lobby()
+    sender = senders[0]
+
+    print(f"{'message':14} {'tags':>5} {'legacy parse':>14} {'parse':>10} {'dispatch':>10} {'per tag':>10}")
+    for name, message in MESSAGES.items():
+        tags = len(tokenize(message.decode()))
+        legacy = measure(lambda: tokenize_legacy(message, "utf8"), count)
+        parse = measure(lambda: tokenize(str(message, encoding="utf8", errors='replace')), count)
+        dispatch = measure(lambda: lobby.dispatch(sender, message), count)
+        print(f"{name:14} {tags:5} {legacy * 1e6:12.2f}us {parse * 1e6:8.2f}us {dispatch * 1e6:8.2f}us {dispatch / tags * 1e6:8.2f}us")
+
+    print()
+    print(f"{'users':>6} {'users update':>14}")
+    for users in BROADCAST_USERS:
+        lobby, _ = make_lobby(users)
+        print(f"{users:6} {measure(lobby.updateUsers, 20) * 1e3:12.2f}ms")
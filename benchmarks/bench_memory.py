@@ -0,0 +1,68 @@
+"""
+Memory taken by objects of single lobby connection, game connection, room and session.
+Objects are created as the server does it, allocated memory is measured by tracemalloc.
+Sockets and kernel buffers are not included, they don't depend on server code.
+
+    python3 benchmarks/bench_memory.py [count]
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from sender import Sender
+from buffers import FrameReader
+from room import Room
+from session import Session
+
+def lobby_connection(index: int) -> Sender:
+    sender = Sender(None)
+    sender.address = ("127.0.0.1", 10000 + index)
+    sender.handshake(bytes([6, 0]) + b"<GREETINGS>")
+    sender.client.username = f"user{index}"
+    sender.client.auth = True
+    return sender
+
+def lobby_connection_buffered(index: int) -> Sender:
+    # connection which has received at least one message
+    sender = lobby_connection(index)
+    sender.frames = FrameReader()
+    return sender
+
+def pipe_connection(index: int) -> Sender:
+    sender = Sender(None)
+    sender.address = ("127.0.0.1", 20000 + index)
+    sender.handshake(b"Aiya!")
+    sender.handshake(b"(client)")
+    sender.handshake(b"01234567-89ab-cdef-0123-456789abcdef")
+    return sender
+
+def room(index: int) -> Room:
+    return Room(lobby_connection(index), f"room{index}")
+
+def session(index: int) -> Session:
+    # started session with one vcmiserver and one vcmiclient pipe
+    s = Session()
+    s.name = f"room{index}"
+    s.host_uuid = "01234567-89ab-cdef-0123-456789abcdef"
+    s.clients_uuid = ["01234567-89ab-cdef-0123-456789abcdef"] * 2
+    server, client = object(), object()
+    s.addConnection(server, True, [b"handshake"])
+    s.addConnection(client, False, [b"handshake"])
+    s.pipes[server] = client
+    s.pipes[client] = server
+    return s
+
+def measure(factory, count: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for factory in (lobby_connection, lobby_connection_buffered, pipe_connection, room, session):
+        print(f"{factory.__name__:26} {measure(factory, count):8.0f} bytes per object")
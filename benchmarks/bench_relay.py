@@ -0,0 +1,92 @@
+"""
+Microbenchmark of pipe relay loop: fixed size `recv` versus pooled `recv_into` with adaptive chunk size.
+Data is pumped through socketpair, relayed to another socketpair and consumed by sink thread.
+
+    python3 benchmarks/bench_relay.py [megabytes] [pattern]
+
+pattern is `bulk` (large writes, like map or save transfer) or `interactive` (small messages)
+"""
+import os
+import socket
+import sys
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import buffers
+from buffers import PipeReader
+
+BUFFER_SIZE = 4096 # legacy relay chunk size
+
+def pump(sock: socket, total: int, pattern: str):
+    chunk = os.urandom(64 * 1024 if pattern == "bulk" else 200)
+    sent = 0
+    while sent < total:
+        sock.sendall(chunk)
+        sent += len(chunk)
+    sock.shutdown(socket.SHUT_WR)
+
+def sink(sock: socket):
+    while sock.recv(1024 * 1024):
+        pass
+
+def relay_legacy(src: socket, dst: socket):
+    calls = 0
+    while True:
+        data = src.recv(BUFFER_SIZE)
+        calls += 1
+        if not data:
+            return calls, calls # every recv allocates new bytes object
+        dst.sendall(data)
+
+def relay_pooled(src: socket, dst: socket):
+    calls = 0
+    allocations = 0
+    acquire = buffers.POOL.acquire
+    def counted(size):
+        nonlocal allocations
+        allocations += 1
+        return acquire(size)
+    buffers.POOL.acquire = counted
+
+    reader = PipeReader()
+    while True:
+        data = reader.receive(src)
+        calls += 1
+        if not data:
+            reader.release()
+            buffers.POOL.acquire = acquire
+            return calls, allocations
+        dst.sendall(data)
+
+def run(relay, total: int, pattern: str):
+    src_in, src_out = socket.socketpair()
+    dst_in, dst_out = socket.socketpair()
+    for s in (src_in, src_out, dst_in, dst_out):
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+
+    producer = Thread(target=pump, args=(src_in, total, pattern))
+    consumer = Thread(target=sink, args=(dst_out,))
+    producer.start()
+    consumer.start()
+
+    start = time.perf_counter()
+    calls, allocations = relay(src_out, dst_in)
+    elapsed = time.perf_counter() - start
+
+    dst_in.shutdown(socket.SHUT_WR)
+    producer.join()
+    consumer.join()
+    for s in (src_in, src_out, dst_in, dst_out):
+        s.close()
+
+    print(f"{relay.__name__:14} {pattern:12} {total / elapsed / 1024 / 1024:8.1f} MB/s  recv calls {calls:8}  bytes per call {total // calls:7}  buffer acquisitions {allocations:8}")
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    patterns = [sys.argv[2]] if len(sys.argv) > 2 else ["bulk", "interactive"]
+    for pattern in patterns:
+        total = megabytes * 1024 * 1024 if pattern == "bulk" else megabytes * 1024 * 16
+        for relay in (relay_legacy, relay_pooled):
+            run(relay, total, pattern)
@@ -0,0 +1,66 @@
+"""
+Bandwidth shaper under saturation: bulk sessions with different chunk sizes compete for the egress cap
+while interactive session sends small chunks. Shows bandwidth share of every session
+and delay of interactive chunks. Nothing is sent, relay threads only ask the shaper for permission.
+
+    python3 benchmarks/bench_shaping.py [egress kilobytes per second] [seconds]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from shaping import SHAPER
+from session import Session
+import tracing
+
+BULK_CHUNKS = [4 * 1024, 64 * 1024, 1024 * 1024] # chunk size of every bulk session
+INTERACTIVE_CHUNK = 200
+INTERACTIVE_PERIOD = 0.01 # seconds between interactive chunks
+
+def bulk(session: Session, size: int, deadline: float):
+    while time.monotonic() < deadline:
+        SHAPER.acquire(session, "from_server", size)
+
+def interactive(session: Session, deadline: float, delays: list):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        SHAPER.acquire(session, "from_client", INTERACTIVE_CHUNK)
+        delays.append(time.perf_counter() - started)
+        time.sleep(INTERACTIVE_PERIOD)
+
+def run(egress: float, seconds: float):
+    SHAPER.rate = egress * 1024
+    SHAPER.interactive = 1024
+    sessions = []
+    for size in BULK_CHUNKS:
+        session = Session()
+        session.name = f"bulk {size // 1024} KB chunks"
+        session.flows = {}
+        sessions.append((session, size))
+    game = Session()
+    game.name = "interactive"
+    game.flows = {}
+
+    delays = []
+    deadline = time.monotonic() + seconds
+    threads = [threading.Thread(target=bulk, args=(session, size, deadline)) for session, size in sessions]
+    threads.append(threading.Thread(target=interactive, args=(game, deadline, delays)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"egress cap {egress:.0f} KB/s, {seconds:.0f} s")
+    for session, size in sessions:
+        flow = session.flows["from_server"]
+        print(f"  {session.name:<24} {flow.bytes / 1024 / seconds:10.0f} KB/s")
+    delays.sort()
+    print(f"  {game.name:<24} {len(delays)} chunks, delay p50 {delays[len(delays) // 2] * 1000:.3f} ms, max {delays[-1] * 1000:.3f} ms")
+
+if __name__ == "__main__":
+    tracing.ENABLED = False
+    egress = float(sys.argv[1]) if len(sys.argv) > 1 else 30 * 1024
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    run(egress, seconds)
@@ -0,0 +1,363 @@
+"""
+End-to-end load generator. Simulated users log into the lobby, probe lobby dispatching,
+start sessions in rooms and pump traffic through game connections of these sessions.
+
+    python3 benchmarks/loadgen.py [option=value ...]
+
+Options and their defaults:
+- `spawn=0` if `1`, server from this repository is started with `server` arguments, otherwise it must be running already
+- `server=""` arguments of spawned server, for example `server="mode=asyncio relay=splice"`
+- `host=127.0.0.1` `port=5002` address of the server
+- `pid=0` process of already running server, to report its memory and threads
+- `users=200` amount of simulated lobby users, `players=2` users per room
+- `protocol=6` lobby protocol version of users
+- `concurrency=50` users connecting at the same time
+- `probes=20` lobby round trips of every user, used to measure dispatch latency
+- `pattern=mixed` traffic of game connections: `bulk` (throughput), `interactive` (round trips of small messages) or `mixed`
+- `megabytes=4` bulk data sent in each direction of every game connection
+- `pings=200` round trips of every game connection
+"""
+import asyncio
+import os
+import re
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+OPTIONS = {
+    "spawn": "0",
+    "server": "",
+    "host": "127.0.0.1",
+    "port": "5002",
+    "pid": "0",
+    "users": "200",
+    "players": "2",
+    "protocol": "6",
+    "concurrency": "50",
+    "probes": "20",
+    "pattern": "mixed",
+    "megabytes": "4",
+    "pings": "200",
+}
+
+TIMEOUT = 30 # seconds to wait for any expected server response
+BULK_CHUNK = 64 * 1024
+PING_SIZE = 200 # size of interactive message, like a typical game command
+SERVER_PATH = os.path.join(os.path.dirname(__file__), "..", "server.py")
+
+def frame(data: bytes) -> bytes:
+    return struct.pack('<I', len(data)) + data
+
+def percentiles(values: list) -> str:
+    if not values:
+        return "-/-"
+    values = sorted(values)
+    return f"{values[len(values) // 2] * 1000:.2f}/{values[int(0.99 * (len(values) - 1))] * 1000:.2f}"
+
+def process_usage(pid: int) -> tuple:
+    """
+    Resident memory in bytes and amount of threads of the process and its children (worker processes)
+    """
+    rss = 0
+    threads = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+                    if line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return rss, threads
+
+
+class LobbyUser:
+    """
+    Lobby connection of simulated user. Incoming data is read all the time,
+    so server never treats the user as slow client
+    """
+    name: str
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    buffer: bytes # received data not matched by any expectation
+    waiters: list # (compiled pattern, future)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.buffer = b""
+        self.waiters = []
+
+    async def connect(self, host: str, port: int, protocol: int):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.task = asyncio.create_task(self.read())
+        greetings = bytes([protocol, 0]) + f"<GREETINGS>{self.name}".encode()
+        await self.request(greetings, rb":>>MSG:System:Here available")
+
+    async def read(self):
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                break
+            self.buffer += data
+            self.match()
+
+        for _pattern, future in self.waiters:
+            if not future.done():
+                future.set_exception(ConnectionError(f"{self.name} is disconnected"))
+
+    def match(self):
+        for waiter in list(self.waiters):
+            found = waiter[0].search(self.buffer)
+            if found:
+                self.waiters.remove(waiter)
+                self.buffer = self.buffer[found.end():]
+                if not waiter[1].done():
+                    waiter[1].set_result(found)
+        if not self.waiters and len(self.buffer) > 65536:
+            self.buffer = self.buffer[-65536:] # keep memory bounded, nobody waits for this data
+
+    def expect(self, pattern: bytes) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((re.compile(pattern), future))
+        self.match()
+        return future
+
+    def send(self, data: bytes):
+        self.writer.write(frame(data))
+
+    async def request(self, data: bytes, pattern: bytes):
+        future = self.expect(pattern)
+        self.send(data)
+        return await asyncio.wait_for(future, TIMEOUT)
+
+    def close(self):
+        self.writer.close()
+
+
+class Pipe:
+    """
+    Game connection of simulated vcmiserver or vcmiclient
+    """
+    async def connect(self, host: str, port: int, kind: str, uuid: str):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.handshake = frame(b"Aiya!") + frame(f"({kind})".encode()) + frame(uuid.encode()) + b"\x01"
+        self.writer.write(self.handshake)
+
+    async def established(self):
+        # server sends handshake back when opposite pipe is connected
+        await asyncio.wait_for(self.reader.readexactly(len(self.handshake)), TIMEOUT)
+
+    def close(self):
+        self.writer.close()
+
+
+async def login(users: list, host: str, port: int, protocol: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def login_one(user: LobbyUser):
+        async with semaphore:
+            start = time.perf_counter()
+            await user.connect(host, port, protocol)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(login_one(user) for user in users))
+    return latencies
+
+
+async def probe(users: list, probes: int) -> list:
+    # switching chat channel is answered to the sender only, without broadcasting
+    latencies = []
+
+    async def probe_one(user: LobbyUser):
+        for i in range(probes):
+            channel = "room" if i % 2 == 0 else "global"
+            start = time.perf_counter()
+            await user.request(f"<CHANNEL>{channel}".encode(), f":>>CHANNEL:{channel}".encode())
+            latencies.append(time.perf_counter() - start)
+        if probes % 2:
+            await user.request(b"<CHANNEL>global", b":>>CHANNEL:global")
+
+    await asyncio.gather(*(probe_one(user) for user in users))
+    return latencies
+
+
+async def start_room(index: int, players: list, host: str, port: int) -> list:
+    """
+    Creates room, starts session and connects pipes. Returns (vcmiserver pipe, vcmiclient pipe) pairs
+    """
+    name = f"load{index}"
+    owner = players[0]
+    owner.send(f"<NEW>{name}".encode())
+    await owner.request(f"<COUNT>{len(players)}".encode(), f":>>CREATED:{name}".encode())
+    for player in players[1:]:
+        await player.request(f"<JOIN>{name}<PSWD>".encode(), f":>>JOIN:{name}:{player.name}".encode())
+
+    hosting = owner.expect(rb":>>HOST:([0-9a-f-]{36}):")
+    starting = [player.expect(rb":>>START:([0-9a-f-]{36})") for player in players[1:]]
+    for player in players:
+        player.send(f"<READY>{name}".encode())
+    host_uuid = (await asyncio.wait_for(hosting, TIMEOUT)).group(1).decode()
+    client_uuids = [(await asyncio.wait_for(s, TIMEOUT)).group(1).decode() for s in starting]
+
+    # connected one by one, so every vcmiclient pipe is paired with vcmiserver pipe opened right before
+    pairs = []
+    for client_uuid in client_uuids:
+        server_pipe = Pipe()
+        await server_pipe.connect(host, port, "server", host_uuid)
+        client_pipe = Pipe()
+        await client_pipe.connect(host, port, "client", client_uuid)
+        await server_pipe.established()
+        await client_pipe.established()
+        pairs.append((server_pipe, client_pipe))
+    return pairs
+
+
+async def bulk(pairs: list, megabytes: int) -> int:
+    total = megabytes * 1024 * 1024
+    chunk = os.urandom(BULK_CHUNK)
+
+    async def pump(pipe: Pipe):
+        sent = 0
+        while sent < total:
+            pipe.writer.write(chunk)
+            await pipe.writer.drain()
+            sent += len(chunk)
+
+    async def sink(pipe: Pipe):
+        received = 0
+        while received < total:
+            data = await asyncio.wait_for(pipe.reader.read(1024 * 1024), TIMEOUT)
+            if not data:
+                raise ConnectionError("pipe is closed during bulk transfer")
+            received += len(data)
+
+    tasks = []
+    for server_pipe, client_pipe in pairs:
+        tasks += [pump(server_pipe), sink(client_pipe), pump(client_pipe), sink(server_pipe)]
+    await asyncio.gather(*tasks)
+    return 2 * len(pairs) * ((total + BULK_CHUNK - 1) // BULK_CHUNK) * BULK_CHUNK
+
+
+async def interactive(pairs: list, pings: int) -> list:
+    latencies = []
+    message = os.urandom(PING_SIZE)
+
+    async def echo(pipe: Pipe):
+        for _ in range(pings):
+            pipe.writer.write(await asyncio.wait_for(pipe.reader.readexactly(PING_SIZE), TIMEOUT))
+
+    async def ping(pipe: Pipe):
+        for _ in range(pings):
+            start = time.perf_counter()
+            pipe.writer.write(message)
+            await asyncio.wait_for(pipe.reader.readexactly(PING_SIZE), TIMEOUT)
+            latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for server_pipe, client_pipe in pairs:
+        tasks += [echo(server_pipe), ping(client_pipe)]
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report_usage(pid: int, stage: str):
+    if pid:
+        rss, threads = process_usage(pid)
+        print(f"server     {stage:14} rss {rss / 1024 / 1024:8.1f} MB  threads {threads}")
+
+
+async def run(options: dict, pid: int):
+    host = options["host"]
+    port = int(options["port"])
+    players = int(options["players"])
+    users = [LobbyUser(f"load{i}") for i in range(int(options["users"]))]
+
+    start = time.perf_counter()
+    latencies = await login(users, host, port, int(options["protocol"]), int(options["concurrency"]))
+    elapsed = time.perf_counter() - start
+    print(f"lobby      {len(users)} users connected in {elapsed:.2f} s, {len(users) / elapsed:.1f} users/s, login p50/p99 {percentiles(latencies)} ms")
+    report_usage(pid, "after login")
+
+    latencies = await probe(users, int(options["probes"]))
+    print(f"dispatch   {len(latencies)} round trips, p50/p99 {percentiles(latencies)} ms")
+
+    start = time.perf_counter()
+    rooms = len(users) // players
+    results = await asyncio.gather(*(start_room(i, users[i * players:(i + 1) * players], host, port) for i in range(rooms)))
+    pairs = [pair for pairs in results for pair in pairs]
+    elapsed = time.perf_counter() - start
+    print(f"sessions   {rooms} sessions with {len(pairs)} game connections started in {elapsed:.2f} s")
+    report_usage(pid, "pipes connected")
+
+    if options["pattern"] in ["bulk", "mixed"]:
+        start = time.perf_counter()
+        total = await bulk(pairs, int(options["megabytes"]))
+        elapsed = time.perf_counter() - start
+        print(f"relay      bulk {total / 1024 / 1024:.0f} MB in {elapsed:.2f} s, {total / elapsed / 1024 / 1024:.1f} MB/s")
+        report_usage(pid, "after bulk")
+
+    if options["pattern"] in ["interactive", "mixed"]:
+        latencies = await interactive(pairs, int(options["pings"]))
+        print(f"relay      interactive {len(latencies)} round trips, p50/p99 {percentiles(latencies)} ms")
+
+    for user in users:
+        user.close()
+    for server_pipe, client_pipe in pairs:
+        server_pipe.close()
+        client_pipe.close()
+
+
+def spawn_server(options: dict) -> subprocess.Popen:
+    # server writes log files into working directory, keep them out of repository
+    workdir = tempfile.mkdtemp(prefix="vcmiproxy-load")
+    args = [sys.executable, os.path.abspath(SERVER_PATH), f"port={options['port']}"] + options["server"].split()
+    proc = subprocess.Popen(args, cwd=workdir, start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection((options["host"], int(options["port"])), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Server didn't start")
+
+
+if __name__ == "__main__":
+    options = dict(OPTIONS)
+    for arg in sys.argv[1:]:
+        key, _, value = arg.partition("=")
+        if key not in options:
+            print(f"Unknown option: {key}")
+            sys.exit(1)
+        options[key] = value
+
+    # every simulated user and pipe needs its own descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    proc = None
+    pid = int(options["pid"])
+    if options["spawn"] == "1":
+        proc = spawn_server(options)
+        pid = proc.pid
+        print(f"server     spawned with arguments: {options['server'] or 'defaults'}")
+
+    try:
+        asyncio.run(run(options, pid))
+    finally:
+        if proc:
+            os.killpg(proc.pid, 15)
+            proc.wait()
@@ -0,0 +1,141 @@
+"""
+Replays pipe traffic captured by the server (`capture` argument) against local proxy.
+Every replayed session logs into the lobby, starts the session and sends captured chunks
+through the same amount of game connections, in the same directions.
+
+    python3 benchmarks/replay.py file.vcap [option=value ...]
+
+Options and their defaults:
+- `pacing=recorded` chunks are sent at recorded time, `fast` sends them as fast as possible
+- `sessions=1` amount of sessions replaying the capture at the same time
+- `spawn=0` `server=""` `host=127.0.0.1` `port=5002` `pid=0` server to replay against, see loadgen.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from capture import read_capture
+from loadgen import LobbyUser, TIMEOUT, login, start_room, spawn_server, report_usage
+
+OPTIONS = {
+    "pacing": "recorded",
+    "sessions": "1",
+    "spawn": "0",
+    "server": "",
+    "host": "127.0.0.1",
+    "port": "5002",
+    "pid": "0",
+}
+
+MAX_PLAYERS = 8 # lobby doesn't allow bigger rooms
+
+async def replay_stream(records: list, source, target, fast: bool) -> float:
+    """
+    Sends chunks of one direction and waits until opposite pipe receives all of them.
+    Returns the worst delay of sending behind the recorded time
+    """
+    total = sum(len(data) for _timestamp, data in records)
+    lag = 0.0
+
+    async def send():
+        nonlocal lag
+        start = time.perf_counter()
+        for timestamp, data in records:
+            if not fast:
+                delay = start + timestamp - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lag = max(lag, -delay)
+            source.writer.write(data)
+            await source.writer.drain()
+
+    async def receive():
+        received = 0
+        while received < total:
+            data = await asyncio.wait_for(target.reader.read(1024 * 1024), TIMEOUT)
+            if not data:
+                raise ConnectionError("pipe is closed during replay")
+            received += len(data)
+
+    await asyncio.gather(send(), receive())
+    return lag
+
+
+async def replay_session(index: int, streams: dict, connections: int, options: dict) -> float:
+    host = options["host"]
+    port = int(options["port"])
+    users = [LobbyUser(f"replay{index}x{i}") for i in range(connections + 1)]
+    await login(users, host, port, 6, len(users))
+    pairs = await start_room(index, users, host, port)
+
+    tasks = []
+    for stream, records in streams.items():
+        server_pipe, client_pipe = pairs[stream // 2]
+        fromServer = stream % 2 == 1
+        source, target = (server_pipe, client_pipe) if fromServer else (client_pipe, server_pipe)
+        tasks.append(replay_stream(records, source, target, options["pacing"] == "fast"))
+    lags = await asyncio.gather(*tasks)
+
+    for user in users:
+        user.close()
+    for server_pipe, client_pipe in pairs:
+        server_pipe.close()
+        client_pipe.close()
+    return max(lags, default=0.0)
+
+
+async def run(path: str, options: dict, pid: int):
+    streams = {}
+    for timestamp, stream, data in read_capture(path):
+        streams.setdefault(stream, []).append((timestamp, data))
+    if not streams:
+        print(f"{path} has no captured data")
+        return
+
+    connections = max(streams.keys()) // 2 + 1
+    if connections + 1 > MAX_PLAYERS:
+        print(f"{path} has {connections} game connections, only {MAX_PLAYERS - 1} can be replayed")
+        return
+
+    chunks = sum(len(records) for records in streams.values())
+    size = sum(len(data) for records in streams.values() for _timestamp, data in records)
+    duration = max(records[-1][0] for records in streams.values())
+    print(f"capture    {chunks} chunks, {size} bytes, {connections} game connections, recorded {duration:.2f} s")
+
+    sessions = int(options["sessions"])
+    start = time.perf_counter()
+    lags = await asyncio.gather(*(replay_session(i, streams, connections, options) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    total = size * sessions
+    print(f"replay     {sessions} sessions, {options['pacing']} pacing, {elapsed:.2f} s including login, "
+          f"{total / elapsed / 1024 / 1024:.1f} MB/s, worst sending lag {max(lags) * 1000:.1f} ms")
+    report_usage(pid, "after replay")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    options = dict(OPTIONS)
+    for arg in sys.argv[2:]:
+        key, _, value = arg.partition("=")
+        if key not in options:
+            print(f"Unknown option: {key}")
+            sys.exit(1)
+        options[key] = value
+
+    proc = None
+    pid = int(options["pid"])
+    if options["spawn"] == "1":
+        proc = spawn_server(options)
+        pid = proc.pid
+
+    try:
+        asyncio.run(run(sys.argv[1], options, pid))
+    finally:
+        if proc:
+            os.killpg(proc.pid, 15)
+            proc.wait()
@@ -0,0 +1,176 @@
+import socket
+import struct
+from threading import Lock
+
+MIN_CHUNK_SIZE = 4096 # interactive traffic: small messages, small buffer
+MAX_CHUNK_SIZE = 256 * 1024 # bulk transfer: maps and saves
+SHRINK_AFTER = 8 # amount of small reads in a row before chunk size is decreased
+POOL_LIMIT = 8 * 1024 * 1024 # bytes of free buffers kept for every size, extra released buffers are dropped
+
+FRAME_BUFFER_SIZE = 1024 # initial size of frames buffer, grows for bigger frames. Kept small, since every lobby connection has one
+MAX_FRAME_SIZE = 16 * 1024 * 1024 # frames above this size are treated as protocol violation
+
+class BufferPool:
+    """
+    Preallocated buffers shared by all pipes, grouped by size.
+    Every size keeps at most `limit` bytes, so peak of connections doesn't hold memory forever
+    """
+    free: dict # size -> list of free buffers
+    limit: int # bytes of free buffers kept for every size
+    lock: Lock
+
+    def __init__(self, limit: int = POOL_LIMIT) -> None:
+        self.free = {}
+        self.limit = limit
+        self.lock = Lock()
+
+    def acquire(self, size: int) -> bytearray:
+        with self.lock:
+            buffers = self.free.get(size)
+            if buffers:
+                return buffers.pop()
+        return bytearray(size)
+
+    def release(self, buffer: bytearray):
+        with self.lock:
+            buffers = self.free.setdefault(len(buffer), [])
+            if (len(buffers) + 1) * len(buffer) <= self.limit:
+                buffers.append(buffer)
+
+POOL = BufferPool()
+
+
+class PipeReader:
+    """
+    Receives pipe data into reusable buffer without allocating new objects.
+    Chunk size grows while pipe streams bulk data and shrinks back for interactive traffic.
+    Returned memoryview is valid only until next `receive` call
+    """
+    __slots__ = ("buffer", "view", "nextSize", "smallReads")
+    buffer: bytearray
+    view: memoryview
+    nextSize: int # chunk size for the next read
+    smallReads: int # amount of small reads in a row
+
+    def __init__(self) -> None:
+        self.buffer = POOL.acquire(MIN_CHUNK_SIZE)
+        self.view = memoryview(self.buffer)
+        self.nextSize = MIN_CHUNK_SIZE
+        self.smallReads = 0
+
+    def receive(self, sock: socket) -> memoryview:
+        # previous chunk is already forwarded, so buffer can be replaced safely
+        if self.nextSize != len(self.buffer):
+            self.resize(self.nextSize)
+
+        size = sock.recv_into(self.view)
+        self.adapt(size)
+        return self.view[:size]
+
+    def adapt(self, size: int):
+        chunk = len(self.buffer)
+        if size == chunk and chunk < MAX_CHUNK_SIZE:
+            self.nextSize = chunk * 2
+            self.smallReads = 0
+            return
+
+        if size <= chunk // 8 and chunk > MIN_CHUNK_SIZE:
+            self.smallReads += 1
+            if self.smallReads >= SHRINK_AFTER:
+                self.nextSize = chunk // 2
+                self.smallReads = 0
+            return
+
+        self.smallReads = 0
+
+    def resize(self, size: int):
+        POOL.release(self.buffer)
+        self.buffer = POOL.acquire(size)
+        self.view = memoryview(self.buffer)
+
+    def release(self):
+        POOL.release(self.buffer)
+        self.buffer = None
+        self.view = None
+
+
+class FrameReader:
+    """
+    Reads length-prefixed frames. Socket is read by big portions into the buffer,
+    so many small frames are obtained by single syscall.
+    Consumed space is reclaimed by moving incomplete tail to the beginning of the buffer.
+    Returned memoryview is valid only until next call
+    """
+    __slots__ = ("buffer", "view", "start", "end")
+    buffer: bytearray
+    view: memoryview
+    start: int # first unconsumed byte
+    end: int # end of received data
+
+    def __init__(self) -> None:
+        self.buffer = bytearray(FRAME_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def pending(self) -> int:
+        return self.end - self.start
+
+    def reserve(self, size: int):
+        # makes sure that `size` bytes starting from `start` fit into the buffer
+        if self.start + size <= len(self.buffer):
+            return
+
+        pending = self.pending()
+        if size > len(self.buffer):
+            buffer = bytearray(max(size, len(self.buffer) * 2))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+        else:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def fill(self, sock: socket, size: int) -> bool:
+        # receives data until `size` bytes are available, returns False on EOF
+        if self.pending() < size:
+            self.reserve(size)
+        while self.pending() < size:
+            received = sock.recv_into(self.view[self.end:])
+            if received == 0:
+                return False
+            self.end += received
+        return True
+
+    def consume(self, size: int) -> memoryview:
+        data = self.view[self.start:(self.start + size)]
+        self.start += size
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+        return data
+
+    def next(self, sock: socket) -> memoryview:
+        # Read message length and unpack it into an integer
+        if not self.fill(sock, 4):
+            return None
+        msglen = struct.unpack_from('<I', self.buffer, self.start)[0]
+        if msglen > MAX_FRAME_SIZE or not self.fill(sock, 4 + msglen):
+            return None
+        # Read the message data
+        return self.consume(4 + msglen)[4:]
+
+    def read(self, sock: socket, size: int) -> bytes:
+        if not self.fill(sock, size):
+            return None
+        return bytes(self.consume(size))
+
+    def feed(self, data: bytes):
+        self.reserve(self.pending() + len(data))
+        self.view[self.end:(self.end + len(data))] = data
+        self.end += len(data)
+
+    def leftover(self) -> bytes:
+        # data received after the last frame
+        return bytes(self.consume(self.pending()))
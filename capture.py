@@ -0,0 +1,94 @@
+import logging
+import os
+import re
+import struct
+import time
+from threading import Lock
+
+DIRECTORY = None # set by server arguments, sessions created afterwards are captured
+MAGIC = b"VCMICAP1"
+RECORD = struct.Struct('<dHI') # seconds since capture start, stream, size of data following the record
+
+def stream_id(connection: int, fromServer: bool) -> int:
+    # both directions of game connection have neighbour ids
+    return connection * 2 + (1 if fromServer else 0)
+
+def read_capture(path: str) -> list:
+    """
+    Returns list of (time, stream, data) records of capture file
+    """
+    records = []
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            timestamp, stream, size = RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                break # capture was interrupted in the middle of record
+            records.append((timestamp, stream, data))
+    return records
+
+
+class Capture:
+    """
+    Writes relayed chunks of one session into binary file:
+    magic followed by records, every record is header and chunk data.
+    File is created with the first chunk, so sessions relayed by other process don't leave empty files
+    """
+    name: str
+    path: str
+    file: object
+    started: float
+    connections: dict # GameConnection of the session -> its number in the capture
+    numbers: int # amount of numbers given to connections, numbers of removed connections aren't reused
+    lock: Lock # both directions are written by different threads
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.path = None
+        self.file = None
+        self.started = None
+        self.connections = {}
+        self.numbers = 0
+        self.lock = Lock()
+
+    def open(self):
+        safe_name = re.sub(r"[^\w.-]", "_", self.name)
+        self.path = os.path.join(DIRECTORY, f"{safe_name}-{int(time.time())}-{os.getpid()}.vcap")
+        self.file = open(self.path, "wb")
+        self.file.write(MAGIC)
+        self.started = time.monotonic()
+        logging.info(f"[*] Capturing session {self.name} into {self.path}")
+
+    def write(self, connection, fromServer: bool, data):
+        with self.lock:
+            if self.file == None:
+                if self.path != None:
+                    return # already closed
+                self.open()
+            number = self.connections.get(connection)
+            if number == None:
+                number = self.connections[connection] = self.numbers
+                self.numbers += 1
+            self.file.write(RECORD.pack(time.monotonic() - self.started, stream_id(number, fromServer), len(data)))
+            self.file.write(data)
+
+    def forget(self, connection):
+        # game connection is removed from the session
+        with self.lock:
+            self.connections.pop(connection, None)
+
+    def flush(self):
+        with self.lock:
+            if self.file:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
@@ -6,6 +6,7 @@ class Client:
     """
     Abstract client class with handshaking interface
     """
+    __slots__ = ("auth", "status")
     auth: bool
     status: str # Information field to store error message which can be transferred to client
 
@@ -17,12 +18,13 @@ class Client:
         return True
 
 PROTOCOL_VERSION_MIN = 1
-PROTOCOL_VERSION_MAX = 5
+PROTOCOL_VERSION_MAX = 6
 
 class ClientLobby(Client):
     """
     Lobby client type
     """
+    __slots__ = ("joined", "username", "room_name", "protocolVersion", "encoding", "ready", "vcmiversion", "channel")
     joined: bool #is joined to some room
     username: str #usename specified in lobby prior connection
     room_name: str #if joined to the room, name of this room is stored here
@@ -34,7 +36,7 @@ class ClientLobby(Client):
 
     def __init__(self) -> None:
         super().__init__()
-        self.room = ""
+        self.room_name = ""
         self.joined = False
         self.username = ""
         self.protocolVersion = 0
@@ -67,13 +69,17 @@ class ClientLobby(Client):
                 #self.send(sender, ":>>ERROR:Protocol error")
                 return False
             # read encoding string
-            self.encoding = data[2:(data[1] + 2)].decode(errors='ignore')
+            self.encoding = bytes(data[2:(data[1] + 2)]).decode(errors='ignore')
             data = data[(data[1] + 2):]
         
         return True
 
 
+APPTYPE_PATTERN = re.compile(rb"\((\w+)\)") # application type, (client) or (server)
+UUID_PATTERN = re.compile(rb"\w{8}-\w{4}-\w{4}-\w{4}-\w{12}")
+
 class ClientPipe(Client):
+    __slots__ = ("apptype", "uuid", "prevmessages", "session")
     apptype: str #client/server
     uuid: str
     prevmessages: list #message queue to be send to opposite client
@@ -86,13 +92,6 @@ class ClientPipe(Client):
         self.apptype = ""
         self.uuid = ""
 
-    def testForSession(self, ses):
-        if self.apptype == "server" and ses.host_uuid == self.uuid:
-            return True
-        if self.apptype == "client" and self.uuid in ses.clients_uuid:
-            return True
-        return False
-
     def isServer(self):
         if self.apptype == "server":
             return True
@@ -105,17 +104,16 @@ class ClientPipe(Client):
         self.prevmessages.append(struct.pack('<I', len(data)) + data) #pack message
 
         #search fo application type in the message
-        match = re.search(r"\((\w+)\)", str(data))
+        match = APPTYPE_PATTERN.search(data)
         if match:
-            self.apptype = match.group(1)
+            self.apptype = match.group(1).decode()
             self.status = f"Client type {self.apptype}, continue..."
         
         #extract uuid from message
-        _uuid = data.decode()
-        match = re.search(r"\w{8}-\w{4}-\w{4}-\w{4}-\w{12}", _uuid)
-        if match and not _uuid == '' and not self.apptype == '':
+        match = UUID_PATTERN.search(data)
+        if match and not self.apptype == '':
             #search for uuid
-            self.uuid = _uuid
+            self.uuid = match.group(0).decode()
             self.auth = True
             self.status = f"Success! Client type {self.apptype}, uuid {self.uuid}"
         
@@ -0,0 +1,500 @@
+import json
+import logging
+import queue
+import socket
+import time
+from concurrent.futures import Future
+from threading import Event, Lock, RLock, Thread
+from metrics import METRICS
+from scheduler import Scheduler
+
+REQUEST_TIMEOUT = 5 # seconds to wait for the hub answer
+RECONNECT_DELAY = 1 # seconds before the first attempt to restore lost hub connection, doubled after every failure
+RECONNECT_DELAY_MAX = 30
+HUB_KEEPALIVE = 10 # seconds of silence before lost hub connection is probed, it's considered lost after 3 missing probes
+FORWARD_CHUNK_SIZE = 64 * 1024 # bytes relayed by single call while forwarding pipe to another node
+
+class Backend:
+    """
+    Abstract shared state of cluster nodes: tables of json values and published messages.
+    Every change is delivered to subscribers of all nodes as event:
+    {"op": "set", "table", "key", "value"}, {"op": "delete", "table", "key", "value"} or {"op": "publish", "message"}
+    """
+    def claim(self, table: str, key: str, value) -> Future:
+        """
+        Sets value only if key is absent. Returned future tells if it was set,
+        it fails if the answer can't be obtained
+        """
+        raise NotImplementedError()
+
+    def set(self, table: str, key: str, value):
+        raise NotImplementedError()
+
+    def delete(self, table: str, key: str):
+        raise NotImplementedError()
+
+    def get(self, table: str, key: str):
+        raise NotImplementedError()
+
+    def items(self, table: str) -> dict:
+        raise NotImplementedError()
+
+    def publish(self, message: dict):
+        raise NotImplementedError()
+
+    def subscribe(self, callback):
+        raise NotImplementedError()
+
+
+class LocalBackend(Backend):
+    """
+    Backend living in the process. Shared by nodes started in the same process,
+    served to other processes by `HubServer`
+    """
+    tables: dict # table -> key -> value
+    callbacks: list
+    lock: RLock # changes and their events are serialized, so every subscriber sees the same order. Hub extends it to own bookkeeping
+
+    def __init__(self) -> None:
+        self.tables = {}
+        self.callbacks = []
+        self.lock = RLock()
+
+    def notify(self, event: dict):
+        for callback in self.callbacks:
+            callback(event)
+
+    def claim(self, table: str, key: str, value) -> Future:
+        with self.lock:
+            entries = self.tables.setdefault(table, {})
+            if key in entries:
+                return resolved(False)
+            entries[key] = value
+            self.notify({"op": "set", "table": table, "key": key, "value": value})
+            return resolved(True)
+
+    def set(self, table: str, key: str, value):
+        with self.lock:
+            self.tables.setdefault(table, {})[key] = value
+            self.notify({"op": "set", "table": table, "key": key, "value": value})
+
+    def delete(self, table: str, key: str):
+        with self.lock:
+            value = self.tables.get(table, {}).pop(key, None)
+            if value != None:
+                self.notify({"op": "delete", "table": table, "key": key, "value": value})
+
+    def get(self, table: str, key: str):
+        return self.tables.get(table, {}).get(key)
+
+    def items(self, table: str) -> dict:
+        with self.lock:
+            return dict(self.tables.get(table, {}))
+
+    def publish(self, message: dict):
+        with self.lock:
+            self.notify({"op": "publish", "message": message})
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.callbacks.append(callback)
+
+    def snapshot(self) -> dict:
+        # executed under lock by hub
+        return {table: dict(entries) for table, entries in self.tables.items()}
+
+
+class HubServer:
+    """
+    Serves local backend to nodes in other processes or hosts, one json message per line.
+    Node receives snapshot of tables after connecting and then every event.
+    Entries written by node are deleted when its connection is lost.
+    Every node has its own writer thread, so slow node doesn't stall changes made by others
+    """
+    backend: LocalBackend
+    connections: dict # socket -> queue of messages for the node, changed under backend lock
+    owners: dict # (table, key) -> socket of node which wrote the entry, changed under backend lock
+
+    def __init__(self, backend: LocalBackend) -> None:
+        self.backend = backend
+        self.connections = {}
+        self.owners = {}
+        backend.subscribe(self.broadcast)
+
+    def start(self, host: str, port: int):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen()
+        t = Thread(target=self.serve, args=(listener,))
+        t.daemon = True
+        t.start()
+
+    def serve(self, listener: socket):
+        while True:
+            conn, address = listener.accept()
+            logging.info(f"[+] Cluster node {address} connected")
+            t = Thread(target=self.handle, args=(conn, address))
+            t.daemon = True
+            t.start()
+
+    def send(self, conn: socket, message: dict):
+        outgoing = self.connections.get(conn)
+        if outgoing:
+            outgoing.put(message)
+
+    def broadcast(self, event: dict):
+        # executed under backend lock
+        for conn in list(self.connections):
+            self.send(conn, {"event": event})
+
+    def write(self, conn: socket, outgoing: queue.SimpleQueue):
+        # writer thread of node connection, stops on None
+        try:
+            while True:
+                message = outgoing.get()
+                if message == None:
+                    return
+                conn.sendall((json.dumps(message) + "\n").encode())
+        except OSError as e:
+            logging.warning(f"[!] Can't send cluster event to node: {e}")
+            try:
+                conn.shutdown(socket.SHUT_RDWR) # node is served no more
+            except OSError:
+                pass
+
+    def handle(self, conn: socket, address: tuple):
+        outgoing = queue.SimpleQueue()
+        writer = Thread(target=self.write, args=(conn, outgoing))
+        writer.daemon = True
+        writer.start()
+        try:
+            with self.backend.lock:
+                self.connections[conn] = outgoing
+                self.send(conn, {"event": {"op": "snapshot", "tables": self.backend.snapshot()}})
+
+            for line in conn.makefile("r", encoding="utf8"):
+                request = json.loads(line)
+                result = self.execute(conn, request)
+                self.send(conn, {"id": request["id"], "result": result})
+
+        except Exception as e:
+            logging.error(f"[!] Cluster node {address} error: {e}")
+
+        finally:
+            logging.info(f"[-] Cluster node {address} disconnected")
+            with self.backend.lock:
+                self.connections.pop(conn, None)
+                for (table, key), owner in list(self.owners.items()):
+                    if owner == conn:
+                        self.owners.pop((table, key), None)
+                        self.backend.delete(table, key)
+            outgoing.put(None)
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            writer.join()
+            conn.close()
+
+    def execute(self, conn: socket, request: dict):
+        op = request["op"]
+        entry = (request.get("table"), request.get("key"))
+        with self.backend.lock:
+            if op == "claim":
+                if not self.backend.claim(entry[0], entry[1], request["value"]).result():
+                    return False
+                self.owners[entry] = conn
+            if op == "set":
+                self.backend.set(entry[0], entry[1], request["value"])
+                self.owners[entry] = conn
+            if op == "delete":
+                self.backend.delete(entry[0], entry[1])
+                self.owners.pop(entry, None)
+            if op == "publish":
+                self.backend.publish(request["message"])
+        return True
+
+
+class RemoteBackend(Backend):
+    """
+    Backend served by hub. Tables are replicated into the process, so reading doesn't leave it.
+    Own changes are applied to replica immediately, the hub confirms them with event.
+    Lost hub connection fails unanswered requests and is restored with growing delay,
+    then replica is replaced by the new snapshot. Request not answered in `REQUEST_TIMEOUT` fails as well
+    """
+    address: tuple # host and port of the hub
+    sock: socket # None while hub is not connected
+    tables: dict # replica of hub tables
+    callbacks: list
+    pending: dict # request id -> Future
+    nextId: int
+    lock: Lock
+    ready: Event # snapshot is received
+    scheduler: Scheduler # expires unanswered requests
+
+    def __init__(self, address: str, scheduler: Scheduler = None) -> None:
+        host, _, port = address.rpartition(":")
+        self.address = (host, int(port))
+        self.sock = None
+        self.tables = {}
+        self.callbacks = []
+        self.pending = {}
+        self.nextId = 0
+        self.lock = Lock()
+        self.ready = Event()
+        if scheduler == None:
+            scheduler = Scheduler()
+            scheduler.start()
+        self.scheduler = scheduler
+        self.connect()
+        t = Thread(target=self.receive)
+        t.daemon = True
+        t.start()
+        if not self.ready.wait(REQUEST_TIMEOUT):
+            raise TimeoutError(f"Cluster hub {address} didn't send its state")
+
+    def connect(self):
+        sock = socket.create_connection(self.address, REQUEST_TIMEOUT)
+        sock.settimeout(None)
+        # hub which disappeared without closing connection is detected by the kernel
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, HUB_KEEPALIVE)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, HUB_KEEPALIVE // 3))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+        if hasattr(socket, "TCP_USER_TIMEOUT"):
+            # unacknowledged requests don't wait for retransmissions for many minutes
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, HUB_KEEPALIVE * 2 * 1000)
+        with self.lock:
+            self.sock = sock
+
+    def disconnect(self):
+        with self.lock:
+            self.sock.close()
+            self.sock = None
+            pending, self.pending = self.pending, {}
+        for requestId, future in pending.items():
+            self.scheduler.cancel(("hub request", requestId))
+            future.set_exception(ConnectionError("Cluster hub connection is lost"))
+
+    def request(self, message: dict) -> Future:
+        future = Future()
+        with self.lock:
+            if not self.sock:
+                future.set_exception(ConnectionError("Cluster hub is not connected"))
+                return future
+            self.nextId += 1
+            message["id"] = self.nextId
+            self.pending[self.nextId] = future
+            self.scheduler.schedule(("hub request", self.nextId), REQUEST_TIMEOUT, self.expire, self.nextId)
+            try:
+                self.sock.sendall((json.dumps(message) + "\n").encode())
+            except OSError as e:
+                self.pending.pop(message["id"], None)
+                self.scheduler.cancel(("hub request", message["id"]))
+                future.set_exception(e)
+        return future
+
+    def expire(self, requestId: int):
+        with self.lock:
+            future = self.pending.pop(requestId, None)
+        if future:
+            logging.warning(f"[!] Cluster hub didn't answer request {requestId} in {REQUEST_TIMEOUT} seconds")
+            future.set_exception(TimeoutError("Cluster hub didn't answer in time"))
+
+    def receive(self):
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                for line in self.sock.makefile("r", encoding="utf8"):
+                    message = json.loads(line)
+                    if "event" in message:
+                        self.apply(message["event"])
+                        for callback in self.callbacks:
+                            callback(message["event"])
+                        delay = RECONNECT_DELAY
+                    else:
+                        future = self.pending.pop(message["id"], None)
+                        self.scheduler.cancel(("hub request", message["id"]))
+                        if future:
+                            future.set_result(message["result"])
+            except Exception as e:
+                logging.error(f"[!] Cluster hub connection error: {e}")
+            logging.critical(f"[!] Cluster hub connection is lost")
+            self.disconnect()
+
+            while True:
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+                try:
+                    self.connect()
+                    break
+                except OSError as e:
+                    logging.warning(f"[!] Can't reconnect to cluster hub: {e}")
+            logging.info(f"[*] Cluster hub connection is restored")
+
+    def apply(self, event: dict):
+        if event["op"] == "snapshot":
+            self.tables = event["tables"]
+            self.ready.set()
+        if event["op"] == "set":
+            self.tables.setdefault(event["table"], {})[event["key"]] = event["value"]
+        if event["op"] == "delete":
+            self.tables.get(event["table"], {}).pop(event["key"], None)
+
+    def claim(self, table: str, key: str, value) -> Future:
+        if key in self.tables.get(table, {}):
+            return resolved(False)
+        return self.request({"op": "claim", "table": table, "key": key, "value": value})
+
+    def set(self, table: str, key: str, value):
+        self.apply({"op": "set", "table": table, "key": key, "value": value})
+        self.request({"op": "set", "table": table, "key": key, "value": value})
+
+    def delete(self, table: str, key: str):
+        self.apply({"op": "delete", "table": table, "key": key})
+        self.request({"op": "delete", "table": table, "key": key})
+
+    def get(self, table: str, key: str):
+        return self.tables.get(table, {}).get(key)
+
+    def items(self, table: str) -> dict:
+        return dict(self.tables.get(table, {}))
+
+    def publish(self, message: dict):
+        self.request({"op": "publish", "message": message})
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+
+class Cluster:
+    """
+    Lobby state shared with other nodes: users, rooms and owners of sessions.
+    Every value is stored with the node which owns it
+    """
+    node: str # address of this node for game connections, host:port
+    backend: Backend
+    published: dict # room name -> state published by this node, None if room is claimed only
+
+    def __init__(self, node: str, backend: Backend) -> None:
+        self.node = node
+        self.backend = backend
+        self.published = {}
+
+    def origin(self, event: dict) -> str:
+        # node which caused the event
+        value = event.get("value") or event.get("message") or {}
+        return value.get("node")
+
+    def claimUser(self, username: str) -> Future:
+        return self.backend.claim("users", username, {"node": self.node})
+
+    def releaseUser(self, username: str):
+        entry = self.backend.get("users", username)
+        if entry and entry["node"] == self.node:
+            self.backend.delete("users", username)
+
+    def users(self) -> list:
+        return list(self.backend.items("users").keys())
+
+    def broadcast(self, message: str):
+        self.backend.publish({"node": self.node, "text": message})
+
+    def claimRoom(self, name: str) -> Future:
+        # `roomCreated` must be called when the claim succeeds
+        return self.backend.claim("rooms", name, {"node": self.node, "state": None})
+
+    def roomCreated(self, name: str):
+        # room is claimed, it's removed from the cluster by the next `syncRooms` if it isn't in the lobby anymore
+        self.published[name] = None
+
+    def roomOwner(self, name: str) -> str:
+        # node hosting the room, None if room isn't known
+        entry = self.backend.get("rooms", name)
+        return entry["node"] if entry else None
+
+    def syncRooms(self, rooms: dict) -> dict:
+        """
+        Publishes changes of local rooms, returns rooms of the whole cluster as name -> state
+        """
+        for name, state in rooms.items():
+            if self.published.get(name) != state:
+                self.backend.set("rooms", name, {"node": self.node, "state": state})
+                self.published[name] = state
+        for name in list(self.published.keys()):
+            if name not in rooms:
+                self.backend.delete("rooms", name)
+                self.published.pop(name)
+
+        return {name: entry["state"] for name, entry in self.backend.items("rooms").items() if entry["state"] != None}
+
+    def addSession(self, session):
+        for _uuid in [session.host_uuid] + session.clients_uuid:
+            self.backend.set("sessions", _uuid, {"node": self.node})
+
+    def removeSession(self, session):
+        for _uuid in [session.host_uuid] + session.clients_uuid:
+            entry = self.backend.get("sessions", _uuid)
+            if entry and entry["node"] == self.node:
+                self.backend.delete("sessions", _uuid)
+
+    def restore(self, usernames: list, sessions: list):
+        """
+        Writes entries of this node again, after hub has forgotten them because of lost connection.
+        Rooms are published again by the next `syncRooms`
+        """
+        for username in usernames:
+            self.backend.set("users", username, {"node": self.node})
+        for session in sessions:
+            self.addSession(session)
+        self.published.clear()
+
+    def sessionOwner(self, _uuid: str) -> str:
+        # another node which owns session with this uuid, None if it's this node or session isn't known
+        entry = self.backend.get("sessions", _uuid)
+        if entry and entry["node"] != self.node:
+            return entry["node"]
+        return None
+
+
+def resolved(value) -> Future:
+    # future which is already done, for answers known without asking
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def forward_pipe(sender, node: str):
+    """
+    Relays game connection to the node owning its session. Returns when connection is closed
+    """
+    host, _, port = node.rpartition(":")
+    upstream = socket.create_connection((host, int(port)), REQUEST_TIMEOUT)
+    upstream.settimeout(None)
+    try:
+        # owner receives the same handshake as this node did
+        upstream.sendall(b"".join(sender.client.prevmessages) + sender.takeLeftover())
+        t = Thread(target=pump, args=(upstream, sender.sock))
+        t.daemon = True
+        t.start()
+        pump(sender.sock, upstream)
+        t.join()
+    finally:
+        upstream.close()
+
+def pump(src: socket, dst: socket):
+    try:
+        while True:
+            data = src.recv(FORWARD_CHUNK_SIZE)
+            if not data:
+                break
+            dst.sendall(data)
+            METRICS.count("relay_bytes", "forwarded", len(data))
+    except OSError:
+        pass
+    try:
+        dst.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
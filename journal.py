@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+from session import Session
+
+COMPACT_MIN = 256 # records in the file before compaction is considered
+COMPACT_RATIO = 4 # file is compacted when it has this many records per live session
+
+class Journal:
+    """
+    Append-only file of started and removed sessions, one json record per line.
+    Reloaded at startup, so pipes reconnecting after restart find their sessions.
+    When removed sessions take most of the file, it's rewritten with live sessions only
+    """
+    path: str
+    file: object
+    records: int # amount of records in the file
+    live: dict # host uuid -> record of live session
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+        self.records = 0
+        self.live = {}
+
+    def load(self) -> list:
+        """
+        Reads sessions left by previous run and opens journal for writing.
+        Returns list of restored sessions
+        """
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # last record may be interrupted by crash
+                    if record["op"] == "add":
+                        self.live[record["host_uuid"]] = record
+                    if record["op"] == "remove":
+                        self.live.pop(record["host_uuid"], None)
+
+        self.compact()
+        sessions = []
+        for record in self.live.values():
+            session = Session()
+            session.name = record["name"]
+            session.host_uuid = record["host_uuid"]
+            session.clients_uuid = record["clients_uuid"]
+            sessions.append(session)
+        return sessions
+
+    def add(self, session: Session):
+        record = {"op": "add", "name": session.name, "host_uuid": session.host_uuid, "clients_uuid": session.clients_uuid}
+        self.live[session.host_uuid] = record
+        self.write(record)
+
+    def remove(self, session: Session):
+        if self.live.pop(session.host_uuid, None):
+            self.write({"op": "remove", "host_uuid": session.host_uuid})
+
+    def write(self, record: dict):
+        try:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            self.records += 1
+            if self.records > COMPACT_MIN and self.records > len(self.live) * COMPACT_RATIO:
+                self.compact()
+        except OSError as e:
+            logging.error(f"[!] Cannot write sessions journal {self.path}: {e}")
+
+    def compact(self):
+        # new file is written aside and replaces old one, so crash keeps one of them complete
+        if self.file:
+            self.file.close()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            for record in self.live.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(temporary, self.path)
+        self.file = open(self.path, "a")
+        self.records = len(self.live)
@@ -1,42 +1,383 @@
 import re, struct
+import socket
+import time
+import tracing
+import capture
 import uuid
+from concurrent.futures import Future
 from sender import Sender
 import logging
 from room import Room
 from session import Session
+from pending import PendingBuffer
+from stats import STATS
+from scheduler import Scheduler
+from outbox import Outbox, Flusher
+from actor import Actor
+from metrics import METRICS
+from memory import memory_report, resident_memory
+from journal import Journal
+from cluster import Cluster
+from shaping import SHAPER
+from admission import ADMISSION
 
 SYSUSER = "System" #username from whom system messages will be sent
 RESERVED_USERNAMES = [SYSUSER, "all", "room"]
 CHANNELS = ["global", "room"]
-
-STATS = {
-    "uniques" : set(), #address
-    "users" : set(), #usernames
-    "logins" : 0, #sockets
-    "clients" : 0, #vcmi clients
-    "rooms" : 0, #created rooms
-    "sessions" : 0, #started sessions
-    "connections" : 0 #successful connections
+SESSION_EXPIRE = 1800 #seconds session is kept without any connected pipe
+ROOMS_DEBOUNCE = 0.2 #seconds room list changes are collected before being sent
+PROTOCOL_ROOM_DELTAS = 6 #starting from this protocol clients receive room list changes only
+PROTOCOL_HEALTH = 4 #starting from this protocol clients answer health requests
+PIPE_SOCKET_BUFFER = 1024 * 1024 #kernel buffers of established game connection
+USERNAME_PATTERN = re.compile(r"^[\w.%+-]+$")
+# tag -> (handler method, minimal protocol version, requires authorization)
+LOBBY_COMMANDS = {
+    "GREETINGS": ("commandGreetings", 1, False),
+    "VER": ("commandVer", 1, True),
+    "MSG": ("commandMsg", 1, True),
+    "CHANNEL": ("commandChannel", 5, True),
+    "NEW": ("commandNew", 1, True),
+    "PSWD": ("commandPswd", 1, True),
+    "COUNT": ("commandCount", 1, True),
+    "JOIN": ("commandJoin", 1, True),
+    "HOSTMODE": ("commandHostmode", 4, True),
+    "MODS": ("commandMods", 2, True),
+    "LEAVE": ("commandLeave", 1, True),
+    "KICK": ("commandKick", 3, True),
+    "READY": ("commandReady", 1, True),
+    "FORCESTART": ("commandForcestart", 3, True),
+    "ROOT": ("commandRoot", 1, True),
+    "HERE": ("commandHere", 1, True),
+    "ALIVE": ("commandAlive", PROTOCOL_HEALTH, True),
 }
 
+def tokenize(msg: str) -> list:
+    """
+    Splits lobby message `<TAG>value<TAG>value...` into list of (tag, value) in single pass.
+    Text before first tag is ignored. Malformed tail is returned as (None, tail)
+    """
+    parts = msg.split('<')
+    if len(parts) < 2:
+        return [(None, msg)]
+
+    result = []
+    for i in range(1, len(parts)):
+        tag, close, value = parts[i].partition('>')
+        if not tag or not close:
+            result.append((None, '<' + '<'.join(parts[i:])))
+            break
+        result.append((tag, value))
+    return result
+
+def openPipe(sender: Sender, drains: list):
+    """
+    Delivers data stored while opposite pipe wasn't connected and tunes socket for relaying.
+    Executed by the connection thread or task after `Lobby.attachPipe`
+    """
+    for pending, sock in drains:
+        pending.drain(sock)
+
+    sender.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, PIPE_SOCKET_BUFFER)
+    sender.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, PIPE_SOCKET_BUFFER)
+    sender.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class Postponed:
+    """
+    Command waiting for the cluster answer. Handler returns it instead of blocking the actor,
+    `continuation` is executed by the actor with the answer. Rest of the message and next messages
+    of the sender are dispatched after it
+    """
+    __slots__ = ("future", "continuation", "settled")
+    future: Future # answer of the cluster
+    continuation: object # receives the answer, returns False if command is refused
+    settled: Future # done when continuation is executed
+
+    def __init__(self, future: Future, continuation) -> None:
+        self.future = future
+        self.continuation = continuation
+        self.settled = Future()
+
 class Lobby:
     sessions: list
     rooms: dict
-    senders: list
+    senders: dict # connected sockets, keys are used as ordered set for constant time membership
     channels: dict
+    uuids: dict # uuid -> (session, isServer) for fast pipe matching
+    actor: Actor # serializes lobby changes made by connection threads
+    scheduler: Scheduler # owns all deadlines of sessions
+    flusher: Flusher # writes queued messages of slow lobby clients
+    outboxType: type # outbox implementation suitable for sockets in use
+    roomsSnapshot: dict # room name -> state string, as it was sent to clients last time
+    roomsMessage: str # full list of rooms for the snapshot
+    roomsDirty: bool # room list changes are waiting to be sent
+    usernames: dict # username -> Sender of authorized lobby clients
+    usersCache: str # serialized list of users, rebuilt once after change
+    healthInterval: int # seconds between health checks and handshake timeout, 0 disables them
+    commands: dict # tag -> (bound handler, minimal protocol version, requires authorization)
+    journal: Journal # persists sessions for crash recovery, None if disabled
+    cluster: Cluster # shares users, rooms and sessions with other nodes, None if disabled
+    master: object # WorkerRouter reporting game connections to the main process, None if it's not a worker
 
     def __init__(self) -> None:
         self.sessions = []
+        self.uuids = {}
+        self.actor = Actor()
+        self.scheduler = Scheduler()
+        self.scheduler.executor = self.actor.submit
+        self.scheduler.start()
+        self.flusher = Flusher()
+        self.outboxType = Outbox
+        self.roomsSnapshot = {}
+        self.roomsMessage = ":>>SESSIONS:0"
+        self.roomsDirty = False
+        self.usernames = {}
+        self.usersCache = None
+        self.healthInterval = 0
+        self.journal = None
+        self.cluster = None
+        self.master = None
+        self.commands = {tag: (getattr(self, name), protocol, auth) for tag, (name, protocol, auth) in LOBBY_COMMANDS.items()}
         self.rooms = {}
-        self.senders = []
+        self.senders = {}
         self.channels = {}
         for c in CHANNELS:
             self.channels[c] = []
 
+    def addSession(self, session: Session):
+        self.sessions.append(session)
+        self.uuids[session.host_uuid] = (session, True)
+        if capture.DIRECTORY:
+            session.capture = capture.Capture(session.name)
+        for _uuid in session.clients_uuid:
+            self.uuids[_uuid] = (session, False)
+        if self.journal:
+            self.journal.add(session)
+        if self.cluster:
+            self.cluster.addSession(session)
+        #session expires if nobody connects to it
+        self.scheduler.schedule(session, SESSION_EXPIRE, self.removeSession, session)
+
+    def removeSession(self, session: Session):
+        if len(session.connections) == 0 and session in self.sessions:
+            logging.info(f"[S {session.name}] Session expired")
+            self.sessions.remove(session)
+            if session.capture:
+                session.capture.close()
+            if self.journal:
+                self.journal.remove(session)
+            if self.cluster:
+                self.cluster.removeSession(session)
+            self.uuids.pop(session.host_uuid, None)
+            for _uuid in session.clients_uuid:
+                self.uuids.pop(_uuid, None)
+
+    def findSession(self, _uuid: str, isServer: bool) -> Session:
+        entry = self.uuids.get(_uuid)
+        if entry and entry[1] == isServer:
+            return entry[0]
+        return None
+
+    def attachPipe(self, sender: Sender) -> list:
+        """
+        Registers game connection in its session. Returns (PendingBuffer, socket) pairs which must be drained
+        by the connection thread before relaying, so the actor doesn't wait for slow clients
+        """
+        start = time.perf_counter()
+        drains = []
+        # search for session and register connection
+        session = self.findSession(sender.client.uuid, sender.client.isServer())
+        self.scheduler.cancel(("handshake", sender))
+        if session:
+            self.scheduler.cancel(session)
+            sender.client.session = session
+            session.addConnection(sender.sock, sender.client.isServer(), sender.client.prevmessages)
+            if self.master:
+                self.master.report(session)
+
+        if sender.client.session and sender.client.session.validPipe(sender.sock):
+            # session has been found, send all pending data to connected client
+            # and all received data to opposite client, after this step data exchange is finally started
+            session = sender.client.session
+            opposite = session.getPipe(sender.sock)
+            drains = [(session.pipeMessages(sender.sock), opposite), (session.pipeMessages(opposite), sender.sock)]
+
+        METRICS.observe("pipe_attach_seconds", time.perf_counter() - start)
+        return drains
+
+    def pendingBuffer(self, sender: Sender) -> PendingBuffer:
+        # buffer keeping data of the pipe until opposite pipe is connected and data stored before is delivered,
+        # None if data can be sent directly
+        session = sender.client.session
+        pending = session.pipeMessages(sender.sock)
+        if pending == None or (pending.closed and session.validPipe(sender.sock)):
+            return None
+        return pending
+
+    def restorePipe(self, sender: Sender, index: int):
+        # game connection passed by previous process on upgrade
+        session = self.findSession(sender.client.uuid, sender.client.isServer())
+        if session:
+            self.scheduler.cancel(session)
+            sender.client.session = session
+            session.restoreConnection(index, sender.sock, sender.client.isServer())
+
+    def restorePending(self, host_uuid: str, index: int, toServer: bool, data: bytes):
+        # data which previous process didn't deliver yet
+        session = self.findSession(host_uuid, True)
+        if session and index < len(session.connections):
+            gc = session.connections[index]
+            (gc.serverMessages if toServer else gc.clientMessages).append(data)
+
+    def remoteOwner(self, sender: Sender) -> str:
+        # cluster node owning session of the pipe, None if session is local or unknown
+        if not self.cluster or self.findSession(sender.client.uuid, sender.client.isServer()):
+            return None
+        return self.cluster.sessionOwner(sender.client.uuid)
+
+    def disconnectPipe(self, sender: Sender):
+        if not sender.client.session:
+            return
+
+        sender.client.session.removeConnection(sender.sock)
+        if self.master:
+            self.master.report(sender.client.session)
+        try:
+            if len(sender.client.session.connections) == 0:
+                self.scheduler.schedule(sender.client.session, SESSION_EXPIRE, self.removeSession, sender.client.session)
+                
+            self.senders.pop(sender)
+        except KeyError as e:
+            logging.warning(f"[*] Exception during disconnecion: {e}")
+
+    def closeConnection(self, sender: Sender):
+        """
+        Handles disconnnection of socket, executed by lobby actor.
+        Called in case of any socket method throws
+        """
+        guard = None
+        try:
+            if sender.isLobby():
+                self.disconnect(sender)
+            if sender.isPipe():
+                if sender.client.session:
+                    guard = sender.client.session.guards.get(sender.sock)
+                self.disconnectPipe(sender)
+
+        except Exception as e:
+            logging.critical(f"[!] Unhandled execption: {e}")
+
+        try:
+            ADMISSION.release(sender)
+            sender.release()
+            if guard:
+                # relay of opposite pipe may be moving data into the descriptor, shutdown interrupts it
+                try:
+                    sender.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                with guard:
+                    sender.sock.close()
+            else:
+                sender.sock.close()
+            self.senders.pop(sender, None)
+        except Exception as e:
+            logging.critical(f"[!] Cannot close socket: {e}")
+
+    def connect(self, sender: Sender):
+        STATS["uniques"].add(sender.address[0])
+        STATS["logins"] += 1
+        self.senders[sender] = None
+        if self.healthInterval:
+            # connection must be identified in time, otherwise it's closed
+            self.scheduler.schedule(("handshake", sender), self.healthInterval, self.expireHandshake, sender)
+            # peers which disappeared without closing connection are detected by the kernel
+            try:
+                sender.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                if hasattr(socket, "TCP_KEEPIDLE"):
+                    sender.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.healthInterval)
+                    sender.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, self.healthInterval // 3))
+                    sender.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+            except OSError as e:
+                logging.warning(f"[*] Can't enable keepalive for {sender.address}: {e}")
+
+    def expireHandshake(self, sender: Sender):
+        if sender in self.senders and not (sender.client and sender.client.auth):
+            logging.warning(f"[!] {sender.address} is not identified in {self.healthInterval} seconds, disconnecting")
+            self.kill(sender)
+
+    def kill(self, sender: Sender):
+        #connection thread wakes up and cleans everything
+        STATS["reaped"] += 1
+        try:
+            sender.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def joinCluster(self, cluster: Cluster):
+        self.cluster = cluster
+        cluster.backend.subscribe(lambda event: self.actor.submit(self.clusterEvent, event))
+
+    def clusterEvent(self, event: dict):
+        # change made by another node, executed by actor
+        if event["op"] == "snapshot":
+            # hub connection is restored, entries of this node were deleted while it was lost
+            self.cluster.restore(list(self.usernames.keys()), self.sessions)
+            self.usersCache = None
+            self.updateUsers()
+            self.updateRooms()
+            return
+
+        if self.cluster.origin(event) == self.cluster.node:
+            return
+
+        if event["op"] == "publish":
+            self.broadcast([i for i in self.senders if i.isLobby()], event["message"]["text"])
+        elif event["table"] == "users":
+            self.usersCache = None
+            self.updateUsers()
+        elif event["table"] == "rooms":
+            self.updateRooms()
+
+    def startHealthcheck(self, interval: int):
+        self.healthInterval = interval
+        if interval:
+            self.scheduler.schedule("healthcheck", interval, self.checkHealth)
+
+    def checkHealth(self):
+        """
+        Periodic liveness sweep of lobby clients.
+        Clients starting from protocol 4 must answer health request, for older ones socket state is checked
+        """
+        now = time.monotonic()
+        for sender in list(self.senders):
+            if sender.sock.fileno() == -1:
+                #socket is closed, but connection wasn't cleaned up
+                logging.warning(f"[!] Reaping closed connection {sender.address}")
+                STATS["reaped"] += 1
+                if sender.isLobby():
+                    self.disconnect(sender)
+                self.senders.pop(sender, None)
+                continue
+
+            if not sender.isLobby() or not sender.client.auth:
+                continue #pipes are alive while relaying, handshake has its own deadline
+
+            if sender.client.protocolVersion >= PROTOCOL_HEALTH:
+                idle = now - sender.lastSeen
+                if idle > 2 * self.healthInterval:
+                    logging.warning(f"[!] {sender.address} {sender.client.username} doesn't answer health requests, disconnecting")
+                    self.kill(sender)
+                elif idle > self.healthInterval:
+                    self.send(sender, ":>>HEALTH:")
+            elif sender.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                logging.warning(f"[!] {sender.address} {sender.client.username} has broken connection, disconnecting")
+                self.kill(sender)
+
+        self.scheduler.schedule("healthcheck", self.healthInterval, self.checkHealth)
+
     def disconnect(self, sender: Sender):
         
-        if sender in self.senders:
-            self.senders.remove(sender)
+        self.senders.pop(sender, None)
         
         for c in self.channels.keys():
             if sender in self.channels[c]:
@@ -53,67 +394,133 @@ class Lobby:
                     r.leave(sender)
                     sender.client.joined = False
                     message = f":>>KICK:{sender.client.room_name}:{sender.client.username}"
-                    self.broadcast(r.players, message.encode())
+                    self.broadcast(r.players, message)
                     self.updateStatus(r)
                 self.updateRooms()
         
         #updating list of users
-        for cl in self.senders:
-            if cl.isLobby() and cl.client.auth and cl.client.protocolVersion >= 4:
-                self.sendUsers(cl)
+        if self.forgetUser(sender):
+            self.updateUsers()
+
+    def forgetUser(self, sender: Sender) -> bool:
+        if sender.client.auth and self.usernames.get(sender.client.username) == sender:
+            self.usernames.pop(sender.client.username)
+            self.usersCache = None
+            if self.cluster:
+                self.cluster.releaseUser(sender.client.username)
+            return True
+        return False
 
     #sending message for lobby players
     def send(self, sender: Sender, message: str):
         if sender in self.senders:
-            sender.sock.send(message.encode(encoding=sender.client.encoding, errors='replace'))
+            self.deliver(sender, message.encode(encoding=sender.client.encoding, errors='replace'))
+
+
+    def deliver(self, sender: Sender, data: bytes):
+        #message is queued and written without blocking current thread
+        if not sender.outbox:
+            sender.outbox = self.outboxType(sender.sock, self.flusher)
+        if not sender.outbox.put(data):
+            logging.warning(f"[!] Client {sender.address} {sender.client.username} is too slow, disconnecting")
+            STATS["slow_clients"] += 1
+            sender.outbox.discard()
+            sender.sock.shutdown(socket.SHUT_RDWR)
+
+
+    def close(self, sender: Sender):
+        #closes connection when all queued messages are written
+        if sender.outbox:
+            sender.outbox.closeAfterFlush()
+        else:
+            sender.sock.close()
 
 
     def broadcast(self, senders: list, message: str):
+        encoded = {} #message is encoded once per encoding and shared by all recipients
         for sender in senders:
-            if sender.isLobby() and sender.client.auth:
+            if sender.isLobby() and sender.client.auth and sender in self.senders:
                 try:
-                    self.send(sender, message)
+                    data = encoded.get(sender.client.encoding)
+                    if data == None:
+                        data = message.encode(encoding=sender.client.encoding, errors='replace')
+                        encoded[sender.client.encoding] = data
+                    self.deliver(sender, data)
                 except Exception as e:
                     logging.warn(f"[*] Can't broadcast to {sender.client.username}: {e}")
 
 
     def sendRooms(self, sender: Sender):
-        msg2 = ""
-        counter = 0
-        for room in self.rooms.values():
-            if not room.started:
-                msg2 += f":{room.name}:{room.joined}:{room.total}:{room.protected}"
-                counter += 1
-        msg = f":>>SESSIONS:{counter}{msg2}"
+        #list is sent as it was pushed last time, further changes come with next update
+        self.send(sender, self.roomsMessage)
 
-        self.send(sender, msg)
+    def userNames(self) -> list:
+        #users of the whole cluster, if it's enabled
+        if self.cluster:
+            return self.cluster.users()
+        return list(self.usernames.keys())
+
+    def usersMessage(self) -> str:
+        if self.usersCache == None:
+            names = self.userNames()
+            self.usersCache = f":>>USERS:{len(names)}" + "".join(f":{name}" for name in names)
+        return self.usersCache
 
     def sendUsers(self, sender: Sender):
-        targetClients = [i for i in self.senders if i.isLobby()]
-        msg = f":>>USERS:{len(targetClients)}"
-            
-        for cl in targetClients:
-            msg += f":{cl.client.username}"
-        
-        self.send(sender, msg)
+        self.send(sender, self.usersMessage())
+
+    def updateUsers(self):
+        targetClients = [i for i in self.usernames.values() if i.client.protocolVersion >= 4]
+        self.broadcast(targetClients, self.usersMessage())
 
 
     def sendCommonInfo(self, sender: Sender):
         if sender.client.protocolVersion >= 4:
             self.sendUsers(sender)
 
-        lobby_users = [i for i in self.senders if i.isLobby() and i.client.auth]
         play_users = [i for i in self.senders if i.isPipe()]
-        msg = f":>>MSG:{SYSUSER}:Here available {len(lobby_users) - 1} users, currently playing {len(play_users)}"
+        msg = f":>>MSG:{SYSUSER}:Here available {len(self.userNames()) - 1} users, currently playing {len(play_users)}"
         if sender.client.protocolVersion < 4:
             msg += "\n Send <HERE> to see people names in the chat"
         self.send(sender, msg)
 
 
     def updateRooms(self):
-        for s in self.senders:
-            if s.isLobby():
-                self.sendRooms(s)
+        #changes are collected for a short time and sent at once
+        if not self.roomsDirty:
+            self.roomsDirty = True
+            self.scheduler.schedule("rooms", ROOMS_DEBOUNCE, self.flushRooms)
+
+
+    def flushRooms(self):
+        self.roomsDirty = False
+        rooms = {}
+        for room in list(self.rooms.values()):
+            if not room.started:
+                rooms[room.name] = f"{room.joined}:{room.total}:{room.protected}"
+        if self.cluster:
+            rooms = self.cluster.syncRooms(rooms)
+
+        deltas = ""
+        for name, state in rooms.items():
+            prev = self.roomsSnapshot.get(name)
+            if prev == None:
+                deltas += f":>>ROOMADD:{name}:{state}"
+            elif prev != state:
+                deltas += f":>>ROOMUPDATE:{name}:{state}"
+        for name in self.roomsSnapshot.keys():
+            if name not in rooms:
+                deltas += f":>>ROOMREMOVE:{name}"
+
+        if deltas == "":
+            return
+
+        self.roomsSnapshot = rooms
+        self.roomsMessage = f":>>SESSIONS:{len(rooms)}" + "".join(f":{name}:{state}" for name, state in rooms.items())
+        targetClients = [i for i in self.senders if i.isLobby()]
+        #[PROTOCOL 6] only changes are sent, older protocols receive full list
+        self.broadcast([i for i in targetClients if i.client.protocolVersion < PROTOCOL_ROOM_DELTAS], self.roomsMessage)
+        self.broadcast([i for i in targetClients if i.client.protocolVersion >= PROTOCOL_ROOM_DELTAS], deltas)
 
 
     def deleteRoom(self, room: Room):
@@ -142,18 +549,18 @@ class Lobby:
         room.started = True
         session = Session()
         session.name = room.name
-        self.sessions.append(session)
         logging.info(f"[S {session.name}] Starting for {room.joined} players")
         session.host_uuid = str(uuid.uuid4())
+        for player in room.players:
+            session.clients_uuid.append(str(uuid.uuid4()))
+        self.addSession(session)
         hostMessage = f":>>HOST:{session.host_uuid}:{room.joined - 1}" #one client will be connected locally
         logging.debug(f"---- host: {session.host_uuid} connections {room.joined - 1}")
         #host message must be before start message
         try:
             self.send(room.host, hostMessage)
 
-            for player in room.players:
-                _uuid = str(uuid.uuid4())
-                session.clients_uuid.append(_uuid)
+            for player, _uuid in zip(room.players, session.clients_uuid):
                 msg = f":>>START:{_uuid}"
                 try:
                     self.send(player, msg)
@@ -166,12 +573,13 @@ class Lobby:
         for player in room.players:
             #remove this connection
             try:
-                player.sock.close()
+                self.close(player)
             except Exception as e:
                 logging.error(f"[*] Can't close connection for session {session.name}: {e}")
 
-            if player in self.senders:
-                self.senders.remove(player)
+            self.senders.pop(player, None)
+            self.forgetUser(player)
+        self.updateUsers()
 
         #this room shall not exist anymore
         logging.info(f"[R {room.name}] Exit room as session {session.name} was started")
@@ -199,352 +607,514 @@ class Lobby:
         return (ttuple[0], ttuple[2])    
 
 
-    def dispatch(self, sender: Sender, arr: bytes):
-        
-        msg = arr.decode(encoding=sender.client.encoding, errors='replace')
-        _open = msg.partition('<')
-        _close = _open[2].partition('>')
-        if _open[1] == '' or _open[2] == '' or _close[0] == '' or _close[1] == '':
-            logging.error(f"[!] Incorrect message from {sender.address}: {msg}")
-            return
-
-        _nextTag = _close[2].partition('<')
-        tag = _close[0]
-        tag_value = _nextTag[0]
+    def dispatch(self, sender: Sender, arr: bytes) -> Future:
+        """
+        Executes commands of the message. Returns future which is done when postponed command is finished,
+        None if all commands are executed already
+        """
+        start = time.perf_counter()
+        try:
+            return self.dispatchMessage(sender, arr)
+        except Exception as e:
+            self.fail(sender, e)
+        finally:
+            METRICS.observe("dispatch_seconds", time.perf_counter() - start)
+
+    def fail(self, sender: Sender, e: Exception):
+        # failed command ends the connection, as it did when commands were executed by connection threads
+        logging.error(f"[!] Command of {sender.address} failed: {e}")
+        METRICS.count("errors", "command")
+        try:
+            sender.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
-        #greetings to the server
-        if tag == "GREETINGS":
-            if sender.client.auth:
-                logging.critical(f"[*] Greetings from authorized user {sender.client.username} {sender.address}")
-                self.send(sender, ":>>ERROR:User already authorized")
+    def dispatchMessage(self, sender: Sender, arr: bytes) -> Future:
+        if sender.postponed != None:
+            sender.postponed.append(arr) # previous command waits for the cluster
+            return None
+        msg = str(arr, encoding=sender.client.encoding, errors='replace')
+        return self.dispatchCommands(sender, iter(tokenize(msg)))
+
+    def dispatchCommands(self, sender: Sender, tags) -> Future:
+        for tag, tag_value in tags:
+            if tag is None:
+                logging.error(f"[!] Incorrect message from {sender.address}: {tag_value}")
+                METRICS.count("errors", "message")
                 return
 
-            if len(tag_value) < 3:
-                logging.warning(f"[!] Incorrect username from {sender.address}: {tag_value}")
-                self.send(sender, f":>>ERROR:Too short username {tag_value}")
-                return
+            command = self.commands.get(tag)
+            METRICS.count("lobby_messages", tag if command else "unknown")
+            if not command:
+                continue
 
-            if tag_value in RESERVED_USERNAMES:
-                logging.warning(f"[!] Incorrect username from {sender.address}: {tag_value}")
-                self.send(sender, f":>>ERROR:Username {tag_value} is reserved by system")
-                return
-            
-            match = re.search(r"^[\w.%+-]+$", tag_value)
-            if not match:
-                logging.warning(f"[!] Incorrect username from {sender.address}: {tag_value}")
-                self.send(sender, f":>>ERROR:Invalid username")
-                return
+            handler, protocol, auth = command
+            if sender.client.protocolVersion < protocol or (auth and not sender.client.auth):
+                continue
 
-            for user in self.senders:
-                if user.isLobby() and user.client.username == tag_value:
-                    logging.warning(f"[!] Client username already exist {sender.address}: {tag_value}")
-                    self.send(sender, f":>>ERROR:Can't connect with the name {tag_value}. This login is already occpupied")
-                    return
-            
-            logging.info(f"[*] {sender.address} autorized as {tag_value}")
-            STATS["users"].add(tag_value)
-            sender.client.username = tag_value
-            #sending info that someone here before authorizing - to not send it to itself
-            targetClientsOld = [i for i in self.senders if i.isLobby() and i.client.protocolVersion < 4]
-            message = f":>>MSG:{SYSUSER}:{sender.client.username} is here"
-            self.broadcast(targetClientsOld, message)
-            #updating list of users
-            for cl in self.senders:
-                if cl.isLobby() and cl.client.protocolVersion >= 4:
-                    self.sendUsers(cl)
-            logging.info(f"[*] Userlist updated and broadcasted")
-            #authorizing user
-            sender.client.auth = True
-            self.channels[sender.client.channel].append(sender)
-            self.sendRooms(sender)
-            self.sendCommonInfo(sender)
-
-        #VCMI version received
-        if tag == "VER" and sender.client.auth:
-            logging.info(f"[*] User {sender.client.username} has version {tag_value}")
-            sender.client.vcmiversion = tag_value
-
-        #message received
-        if tag == "MSG" and sender.client.auth:
-            targetClients = [i for i in self.channels[sender.client.channel] if i.isLobby()]
+            result = handler(sender, tag_value)
+            if result is False:
+                return None #command is refused, rest of the message is ignored
 
-            if sender.client.channel == "global": #send to all clients
-                targetClients = [i for i in self.senders if i.isLobby()]
-            
-            if sender.client.channel == "room" and sender.client.joined:
-                targetClients = self.rooms[sender.client.room_name].players #send message only to players in the room
+            if isinstance(result, Postponed):
+                sender.postponed = []
+                result.future.add_done_callback(lambda _: self.actor.submit(self.resume, sender, result, tags))
+                return result.settled
+        return None
 
-            message = f":>>MSGCH:{sender.client.username}:{sender.client.channel}:{tag_value}"
-            if sender.client.protocolVersion <= 4: #compatibility with older protocols
-                message = f":>>MSG:{sender.client.username}:{tag_value}"
+    def resume(self, sender: Sender, postponed: Postponed, tags):
+        # executed by actor when the cluster answered postponed command
+        queued, sender.postponed = sender.postponed, None
+        try:
+            try:
+                answer = postponed.future.result()
+            except Exception as e:
+                logging.error(f"[!] Cluster request for {sender.address} failed: {e}")
+                METRICS.count("errors", "cluster")
+                self.send(sender, ":>>ERROR:Server is temporarily unavailable, try again later")
+                result = False
+            else:
+                result = postponed.continuation(answer)
 
-            self.broadcast(targetClients, message)
+            if sender in self.senders:
+                if result is not False:
+                    self.dispatchCommands(sender, tags)
+                for arr in queued:
+                    self.dispatchMessage(sender, arr)
+        except Exception as e:
+            self.fail(sender, e)
+        finally:
+            postponed.settled.set_result(None)
+
+    #greetings to the server
+    def commandGreetings(self, sender: Sender, tag_value: str):
+        if sender.client.auth:
+            logging.critical(f"[*] Greetings from authorized user {sender.client.username} {sender.address}")
+            self.send(sender, ":>>ERROR:User already authorized")
+            return False
+
+        if len(tag_value) < 3:
+            logging.warning(f"[!] Incorrect username from {sender.address}: {tag_value}")
+            self.send(sender, f":>>ERROR:Too short username {tag_value}")
+            return False
+
+        if tag_value in RESERVED_USERNAMES:
+            logging.warning(f"[!] Incorrect username from {sender.address}: {tag_value}")
+            self.send(sender, f":>>ERROR:Username {tag_value} is reserved by system")
+            return False
+
+        match = USERNAME_PATTERN.search(tag_value)
+        if not match:
+            logging.warning(f"[!] Incorrect username from {sender.address}: {tag_value}")
+            self.send(sender, f":>>ERROR:Invalid username")
+            return False
+
+        if tag_value in self.usernames:
+            logging.warning(f"[!] Client username already exist {sender.address}: {tag_value}")
+            self.send(sender, f":>>ERROR:Can't connect with the name {tag_value}. This login is already occpupied")
+            return False
+
+        if self.cluster:
+            return Postponed(self.cluster.claimUser(tag_value), lambda claimed: self.claimedUser(sender, tag_value, claimed))
+
+        self.authorize(sender, tag_value)
+
+    def claimedUser(self, sender: Sender, username: str, claimed: bool):
+        if not claimed:
+            logging.warning(f"[!] Client username is used on another node {sender.address}: {username}")
+            self.send(sender, f":>>ERROR:Can't connect with the name {username}. This login is already occpupied")
+            return False
+
+        if sender not in self.senders or username in self.usernames:
+            # disconnected or authorized by another connection while waiting for the cluster
+            self.cluster.releaseUser(username)
+            self.send(sender, f":>>ERROR:Can't connect with the name {username}. This login is already occpupied")
+            return False
+
+        self.authorize(sender, username)
+
+    def authorize(self, sender: Sender, tag_value: str):
+        logging.info(f"[*] {sender.address} autorized as {tag_value}")
+        STATS["users"].add(tag_value)
+        sender.client.username = tag_value
+        #sending info that someone here before authorizing - to not send it to itself
+        targetClientsOld = [i for i in self.senders if i.isLobby() and i.client.protocolVersion < 4]
+        message = f":>>MSG:{SYSUSER}:{sender.client.username} is here"
+        self.broadcast(targetClientsOld, message)
+        #updating list of users
+        self.usernames[tag_value] = sender
+        self.usersCache = None
+        self.updateUsers()
+        logging.info(f"[*] Userlist updated and broadcasted")
+        #authorizing user
+        sender.client.auth = True
+        self.scheduler.cancel(("handshake", sender))
+        self.channels[sender.client.channel].append(sender)
+        self.sendRooms(sender)
+        self.sendCommonInfo(sender)
+
+    #VCMI version received
+    def commandVer(self, sender: Sender, tag_value: str):
+        logging.info(f"[*] User {sender.client.username} has version {tag_value}")
+        sender.client.vcmiversion = tag_value
+
+    #message received
+    def commandMsg(self, sender: Sender, tag_value: str):
+        targetClients = [i for i in self.channels[sender.client.channel] if i.isLobby()]
+
+        if sender.client.channel == "global": #send to all clients
+            targetClients = [i for i in self.senders if i.isLobby()]
+
+        if sender.client.channel == "room" and sender.client.joined:
+            targetClients = self.rooms[sender.client.room_name].players #send message only to players in the room
+
+        message = f":>>MSGCH:{sender.client.username}:{sender.client.channel}:{tag_value}"
+        if sender.client.protocolVersion <= 4: #compatibility with older protocols
+            message = f":>>MSG:{sender.client.username}:{tag_value}"
+
+        self.broadcast(targetClients, message)
+        if self.cluster and sender.client.channel == "global":
+            self.cluster.broadcast(message)
+
+    #[PROTOCOL 5] set channel
+    def commandChannel(self, sender: Sender, tag_value: str):
+        if tag_value not in self.channels.keys():
+            #channel doesn't exist
+            message = f":>>ERROR:Cannot create session with name {tag_value}, session with this name already exists"
+            self.send(sender, message)
+            return False
+
+        if sender.client.channel == tag_value:
+            #client is already in the channel
+            return False
+
+        #move client to the new channel
+        prevChannel = sender.client.channel
+        self.channels[prevChannel].remove(sender)
+        self.channels[tag_value].append(sender)
+        sender.client.channel = tag_value
+        message = f":>>CHANNEL:{tag_value}"
+        self.send(sender, message)
+
+    #new room
+    def commandNew(self, sender: Sender, tag_value: str):
+        if sender.client.joined:
+            return
 
-        #[PROTOCOL 5] set channel
-        if tag == "CHANNEL" and sender.client.auth:
-            if tag_value not in self.channels.keys():
-                #channel doesn't exist
-                message = f":>>ERROR:Cannot create session with name {tag_value}, session with this name already exists"
-                self.send(sender, message)
-                return
-            
-            if sender.client.channel == tag_value:
-                #client is already in the channel
-                return
-            
-            #move client to the new channel
-            prevChannel = sender.client.channel
-            self.channels[prevChannel].remove(sender)
-            self.channels[tag_value].append(sender)
-            sender.client.channel = tag_value
-            message = f":>>CHANNEL:{tag_value}"
+        if tag_value in self.rooms:
+            #refuse creating game
+            message = f":>>ERROR:Cannot create session with name {tag_value}, session with this name already exists"
             self.send(sender, message)
+            return False
 
-        #new room
-        if tag == "NEW" and sender.client.auth and not sender.client.joined:
-            if tag_value in self.rooms:
-                #refuse creating game
-                message = f":>>ERROR:Cannot create session with name {tag_value}, session with this name already exists"
-                self.send(sender, message)
-                return
+        if tag_value == "" or tag_value.startswith(" ") or len(tag_value) < 3:
+            #refuse creating game
+            message = f":>>ERROR:Cannot create session with invalid name {tag_value}"
+            self.send(sender, message)
+            return False
 
-            if tag_value == "" or tag_value.startswith(" ") or len(tag_value) < 3:
-                #refuse creating game
-                message = f":>>ERROR:Cannot create session with invalid name {tag_value}"
-                self.send(sender, message)
-                return
-            
-            self.rooms[tag_value] = Room(sender, tag_value)
-            sender.client.joined = True
-            sender.client.ready = False
-            sender.client.room_name = tag_value
-            logging.info(f"[R {tag_value}]: room created")
-            STATS["rooms"] += 1
-
-        #set password for the session
-        if tag == "PSWD" and sender.client.auth and sender.client.joined:
-            r = self.rooms[sender.client.room_name]
-            if r.host == sender:
-                r.password = tag_value
-                r.protected = bool(tag_value != "")
-            else:
-                if not r.protected or r.password == tag_value:
-                    r.join(sender)
-                    message = f":>>JOIN:{r.name}:{sender.client.username}"
-                    logging.info(f"[R {r.name}] {sender.client.username} joined")
-                    self.broadcast(r.players, message)
-                    self.updateStatus(r)
-                    self.updateRooms()
-                    #[PROTOCOL 4] send host mode to joined player
-                    if sender.client.protocolVersion >= 4:
-                        message = f":>>GAMEMODE:{r.gamemode}"
-                        self.send(sender, message)
-                    
-                    if sender.client.protocolVersion <= 4:
-                        #send instructions to player
-                        message = f":>>MSG:{SYSUSER}:You are in the room chat."
-                        self.send(sender, message)
-                        
-                    #verify version and send warning
-                    host_sender = r.host
-                    if sender.client.vcmiversion != host_sender.client.vcmiversion:
-                        message = f":>>MSG:{SYSUSER}:Your VCMI version {sender.client.vcmiversion} differs from host version {host_sender.client.vcmiversion}, which may cause problems"
-                        self.send(sender, message)
+        if self.cluster:
+            return Postponed(self.cluster.claimRoom(tag_value), lambda claimed: self.claimedRoom(sender, tag_value, claimed))
 
-                else:
-                    sender.client.joined = False
-                    message = f":>>ERROR:Incorrect password"
-                    self.send(sender, message)
-                    return
+        self.createRoom(sender, tag_value)
 
-        #set amount of players to the new room
-        if tag == "COUNT" and sender.client.auth and sender.client.joined:
-            r = self.rooms[sender.client.room_name]
-            if r.host == sender:
-                if r.total != 1:
-                    #refuse changing amount of players
-                    message = f":>>ERROR:Changing amount of players is not possible for existing session"
-                    self.send(sender, message)
-                    return
-
-                if int(tag_value) < 2 or int(tag_value) > 8:
-                    #refuse and cleanup room
-                    self.deleteRoom(r)
-                    message = f":>>ERROR:Cannot create room with invalid amount of players"
-                    self.send(sender, message)
-                    return
-
-                r.total = int(tag_value)
-                message = f":>>CREATED:{r.name}"
-                self.send(sender, message)
-                #now room is ready to be broadcasted
-                message = f":>>JOIN:{r.name}:{sender.client.username}"
-                self.send(sender, message)
-                self.updateStatus(r)
-                self.updateRooms()
-                #send instructions to player
-                message = f":>>MSG:{SYSUSER}:You are in the room chat."
-                self.send(sender, message)
-
-        #join session
-        if tag == "JOIN" and sender.client.auth and not sender.client.joined:
-            if tag_value not in self.rooms:
-                message = f":>>ERROR:Room with name {tag_value} doesn't exist"
-                self.send(sender, message)
-                return
-            
-            if self.rooms[tag_value].joined >= self.rooms[tag_value].total:
-                message = f":>>ERROR:Room {tag_value} is full"
-                self.send(sender, message)
-                return
+    def claimedRoom(self, sender: Sender, name: str, claimed: bool):
+        if claimed:
+            self.cluster.roomCreated(name)
+        if not claimed or name in self.rooms:
+            message = f":>>ERROR:Cannot create session with name {name}, session with this name already exists"
+            self.send(sender, message)
+            return False
 
-            if self.rooms[tag_value].started:
-                message = f":>>ERROR:Session {tag_value} is started"
-                self.send(sender, message)
-                return
+        if sender not in self.senders or sender.client.joined:
+            self.updateRooms() # claimed name is released by synchronization of rooms
+            return False
 
-            sender.client.joined = True
-            sender.client.ready = False
-            sender.client.room_name = tag_value
+        self.createRoom(sender, name)
 
-        if tag == "PSWD" and sender.client.auth and sender.client.joined:
-            r = self.rooms[sender.client.room_name]
+    def createRoom(self, sender: Sender, tag_value: str):
+        self.rooms[tag_value] = Room(sender, tag_value)
+        sender.client.joined = True
+        sender.client.ready = False
+        sender.client.room_name = tag_value
+        logging.info(f"[R {tag_value}]: room created")
+        STATS["rooms"] += 1
 
+    #set password for the session
+    def commandPswd(self, sender: Sender, tag_value: str):
+        if not sender.client.joined:
+            return
 
-        #[PROTOCOL 4] set game mode
-        if tag == "HOSTMODE" and sender.client.auth and sender.client.joined:
-            r = self.rooms[sender.client.room_name]
-            #checks for permissions
-            if r.host != sender:
-                message = ":>>ERROR:Insuficcient permissions"
-                self.send(sender, message)
-                return
+        r = self.rooms[sender.client.room_name]
+        if r.host == sender:
+            r.password = tag_value
+            r.protected = bool(tag_value != "")
+            return
 
-            #update game mode for everybody
-            r.gamemode = int(tag_value)
+        if r.protected and r.password != tag_value:
+            sender.client.joined = False
+            message = f":>>ERROR:Incorrect password"
+            self.send(sender, message)
+            return False
+
+        r.join(sender)
+        message = f":>>JOIN:{r.name}:{sender.client.username}"
+        logging.info(f"[R {r.name}] {sender.client.username} joined")
+        self.broadcast(r.players, message)
+        self.updateStatus(r)
+        self.updateRooms()
+        #[PROTOCOL 4] send host mode to joined player
+        if sender.client.protocolVersion >= 4:
             message = f":>>GAMEMODE:{r.gamemode}"
-            self.broadcast(r.players, message)
+            self.send(sender, message)
 
+        if sender.client.protocolVersion <= 4:
+            #send instructions to player
+            message = f":>>MSG:{SYSUSER}:You are in the room chat."
+            self.send(sender, message)
 
-        #[PROTOCOL 2] receive list of mods
-        if tag == "MODS" and sender.client.auth and sender.client.joined and sender.client.room_name in self.rooms:
-            mods = tag_value.split(";") #list of modname&modverion
-            r = self.rooms[sender.client.room_name]
+        #verify version and send warning
+        host_sender = r.host
+        if sender.client.vcmiversion != host_sender.client.vcmiversion:
+            message = f":>>MSG:{SYSUSER}:Your VCMI version {sender.client.vcmiversion} differs from host version {host_sender.client.vcmiversion}, which may cause problems"
+            self.send(sender, message)
 
-            if r.host == sender:
-                #set mods
-                for m in mods:
-                    mp = m.partition("&")
-                    r.mods[mp[0]] = mp[2]
-            
-            #send mods
-            message = f":>>MODS:{r.modsString()}"
+    #set amount of players to the new room
+    def commandCount(self, sender: Sender, tag_value: str):
+        if not sender.client.joined:
+            return
+
+        r = self.rooms[sender.client.room_name]
+        if r.host != sender:
+            return
+
+        if r.total != 1:
+            #refuse changing amount of players
+            message = f":>>ERROR:Changing amount of players is not possible for existing session"
             self.send(sender, message)
+            return False
 
-            #[PROTOCOL 3] send mods to the server
-            mods_string = ':'.join(mods).replace("&", ":")
-            message = f":>>MODSOTHER:{sender.client.username}:{len(mods)}:{mods_string}"
-            if len(mods) > 0 and r.host.client.protocolVersion >= 3:
-                try:
-                    self.send(r.host, message)
-                except Exception as e:
-                    logging.error(f"[!] Cannot send message to room {sender.client.room_name} host")
+        if int(tag_value) < 2 or int(tag_value) > 8:
+            #refuse and cleanup room
+            self.deleteRoom(r)
+            message = f":>>ERROR:Cannot create room with invalid amount of players"
+            self.send(sender, message)
+            return False
+
+        r.total = int(tag_value)
+        message = f":>>CREATED:{r.name}"
+        self.send(sender, message)
+        #now room is ready to be broadcasted
+        message = f":>>JOIN:{r.name}:{sender.client.username}"
+        self.send(sender, message)
+        self.updateStatus(r)
+        self.updateRooms()
+        #send instructions to player
+        message = f":>>MSG:{SYSUSER}:You are in the room chat."
+        self.send(sender, message)
+
+    #join session
+    def commandJoin(self, sender: Sender, tag_value: str):
+        if sender.client.joined:
+            return
 
-        #leaving session
-        if tag == "LEAVE" and sender.client.auth and sender.client.joined and sender.client.room_name == tag_value:
-            r = self.rooms[sender.client.room_name]
-            if r.host == sender:
-                #destroy the session, sending messages inside the function
-                self.deleteRoom(r)
-            else:
-                message = f":>>KICK:{r.name}:{sender.client.username}"
-                self.broadcast(r.players, message)
-                r.leave(sender)
-                r.resetPlayersReady()
-                sender.client.joined = False
-                logging.info(f"[R {r.name}] {sender.client.username} left")
-                self.updateStatus(r)
-            self.updateRooms()
+        if tag_value not in self.rooms and self.cluster and self.cluster.roomOwner(tag_value):
+            message = f":>>ERROR:Room {tag_value} is hosted by server {self.cluster.roomOwner(tag_value)}, connect to it to join"
+            self.send(sender, message)
+            return False
 
-        #[PROTOCOL 3]
-        if tag == "KICK" and sender.client.auth and sender.client.joined:
-            r = self.rooms[sender.client.room_name]
-            #checks for permissions
-            if r.host != sender:
-                message = ":>>ERROR:Insuficcient permissions"
-                self.send(sender, message)
-                return
-            
-            for pl in r.players:
-                if pl == r.host:
-                    continue
+        if tag_value not in self.rooms:
+            message = f":>>ERROR:Room with name {tag_value} doesn't exist"
+            self.send(sender, message)
+            return False
 
-                if pl.client.username == tag_value:
-                    message = f":>>KICK:{r.name}:{pl.client.username}"
-                    self.broadcast(r.players, message)
-                    r.leave(pl)
-                    pl.client.joined = False
-                    logging.info(f"[R {r.name}] {pl.client.username} was kicked")
-                    self.updateStatus(r)
-                    self.startRoomIfReady(r)
-                    self.updateRooms() 
-                    break
+        if self.rooms[tag_value].joined >= self.rooms[tag_value].total:
+            message = f":>>ERROR:Room {tag_value} is full"
+            self.send(sender, message)
+            return False
 
-        if tag == "READY" and sender.client.auth and sender.client.joined and sender.client.room_name == tag_value:
-            sender.client.ready = not sender.client.ready
-            r = self.rooms[sender.client.room_name]
+        if self.rooms[tag_value].started:
+            message = f":>>ERROR:Session {tag_value} is started"
+            self.send(sender, message)
+            return False
+
+        sender.client.joined = True
+        sender.client.ready = False
+        sender.client.room_name = tag_value
+
+    #[PROTOCOL 4] set game mode
+    def commandHostmode(self, sender: Sender, tag_value: str):
+        if not sender.client.joined:
+            return
+
+        r = self.rooms[sender.client.room_name]
+        #checks for permissions
+        if r.host != sender:
+            message = ":>>ERROR:Insuficcient permissions"
+            self.send(sender, message)
+            return False
+
+        #update game mode for everybody
+        r.gamemode = int(tag_value)
+        message = f":>>GAMEMODE:{r.gamemode}"
+        self.broadcast(r.players, message)
+
+    #[PROTOCOL 2] receive list of mods
+    def commandMods(self, sender: Sender, tag_value: str):
+        if not sender.client.joined or sender.client.room_name not in self.rooms:
+            return
+
+        mods = tag_value.split(";") #list of modname&modverion
+        r = self.rooms[sender.client.room_name]
+
+        if r.host == sender:
+            #set mods
+            for m in mods:
+                mp = m.partition("&")
+                r.mods[mp[0]] = mp[2]
+
+        #send mods
+        message = f":>>MODS:{r.modsString()}"
+        self.send(sender, message)
+
+        #[PROTOCOL 3] send mods to the server
+        mods_string = ':'.join(mods).replace("&", ":")
+        message = f":>>MODSOTHER:{sender.client.username}:{len(mods)}:{mods_string}"
+        if len(mods) > 0 and r.host.client.protocolVersion >= 3:
+            try:
+                self.send(r.host, message)
+            except Exception as e:
+                logging.error(f"[!] Cannot send message to room {sender.client.room_name} host")
+
+    #leaving session
+    def commandLeave(self, sender: Sender, tag_value: str):
+        if not sender.client.joined or sender.client.room_name != tag_value:
+            return
+
+        r = self.rooms[sender.client.room_name]
+        if r.host == sender:
+            #destroy the session, sending messages inside the function
+            self.deleteRoom(r)
+        else:
+            message = f":>>KICK:{r.name}:{sender.client.username}"
+            self.broadcast(r.players, message)
+            r.leave(sender)
+            r.resetPlayersReady()
+            sender.client.joined = False
+            logging.info(f"[R {r.name}] {sender.client.username} left")
             self.updateStatus(r)
+        self.updateRooms()
+
+    #[PROTOCOL 3]
+    def commandKick(self, sender: Sender, tag_value: str):
+        if not sender.client.joined:
+            return
+
+        r = self.rooms[sender.client.room_name]
+        #checks for permissions
+        if r.host != sender:
+            message = ":>>ERROR:Insuficcient permissions"
+            self.send(sender, message)
+            return False
 
-            #for old versions of protocol we can start game by host ready
-            if sender.client.protocolVersion < 3 and r.host == sender:
-                self.startRoom(r)
+        for pl in r.players:
+            if pl == r.host:
+                continue
+
+            if pl.client.username == tag_value:
+                message = f":>>KICK:{r.name}:{pl.client.username}"
+                self.broadcast(r.players, message)
+                r.leave(pl)
+                pl.client.joined = False
+                logging.info(f"[R {r.name}] {pl.client.username} was kicked")
+                self.updateStatus(r)
+                self.startRoomIfReady(r)
                 self.updateRooms()
-            else:
-                if self.startRoomIfReady(r):
-                    self.updateRooms()
+                break
 
-        #[PROTOCOL 3]
-        if tag == "FORCESTART" and sender.client.auth and sender.client.joined and sender.client.room_name == tag_value:
-            r = self.rooms[sender.client.room_name]
-            if r.host != sender:
-                message = ":>>ERROR:Insuficcient permissions"
-                self.send(sender, message)
-                return
-            
+    def commandReady(self, sender: Sender, tag_value: str):
+        if not sender.client.joined or sender.client.room_name != tag_value:
+            return
+
+        sender.client.ready = not sender.client.ready
+        r = self.rooms[sender.client.room_name]
+        self.updateStatus(r)
+
+        #for old versions of protocol we can start game by host ready
+        if sender.client.protocolVersion < 3 and r.host == sender:
             self.startRoom(r)
             self.updateRooms()
-            STATS["sessions"] += 1
-
-        #manual system command
-        if tag == "ROOT" and sender.client.auth:
-            logging.warning(f"[!] ROOT from {sender.address} {sender.client.username}: {tag_value}")
-            if tag_value in STATS.keys():
-                message = f":>>ERROR:Uknown command"
-                if isinstance(STATS[tag_value], set):
-                    message = f":>>MSG:{SYSUSER}:{len(STATS[tag_value])}"
-                else:
-                    message = f":>>MSG:{SYSUSER}:{STATS[tag_value]}"
-                self.send(sender, message)
-
-        #manual user command
-        if tag == "HERE" and sender.client.auth:
-            logging.info(f"[*] HERE from {sender.address} {sender.client.username}: {tag_value}")
-            if sender.client.protocolVersion >= 4:
-                self.sendUsers(sender)
+        else:
+            if self.startRoomIfReady(r):
+                self.updateRooms()
+
+    #[PROTOCOL 3]
+    def commandForcestart(self, sender: Sender, tag_value: str):
+        if not sender.client.joined or sender.client.room_name != tag_value:
+            return
+
+        r = self.rooms[sender.client.room_name]
+        if r.host != sender:
+            message = ":>>ERROR:Insuficcient permissions"
+            self.send(sender, message)
+            return False
+
+        self.startRoom(r)
+        self.updateRooms()
+        STATS["sessions"] += 1
+
+    #manual system command
+    def commandRoot(self, sender: Sender, tag_value: str):
+        logging.warning(f"[!] ROOT from {sender.address} {sender.client.username}: {tag_value}")
+        if tag_value in STATS.keys():
+            message = f":>>ERROR:Uknown command"
+            if isinstance(STATS[tag_value], set):
+                message = f":>>MSG:{SYSUSER}:{len(STATS[tag_value])}"
             else:
-                targetClients = [i for i in self.channels[sender.client.channel] if i.isLobby()]
-                message = f":>>MSG:{SYSUSER}:People in lobby"
-            
-                for cl in targetClients:
-                    message += f"\n{cl.client.username}"
-                    if cl.client.joined:
-                        message += f"[room {cl.client.room_name}]"
-                self.send(sender, message)
-
-        #[PROTOCOL 4, DEPRECATED] healthcheck
-        if tag == "ALIVE" and sender.client.auth:
-            pass
+                message = f":>>MSG:{SYSUSER}:{STATS[tag_value]}"
+            self.send(sender, message)
+
+        if tag_value == "trace":
+            message = f":>>MSG:{SYSUSER}:Relay tracing is disabled"
+            if tracing.ENABLED:
+                message = f":>>MSG:{SYSUSER}:Relay tracing of {len(self.sessions)} sessions"
+                for session in self.sessions:
+                    message += f"\n[S {session.name}]"
+                    for line in session.traceSummary():
+                        message += f"\n{line}"
+            self.send(sender, message)
+
+        if tag_value == "bandwidth":
+            message = f":>>MSG:{SYSUSER}:Bandwidth shaping is disabled"
+            if SHAPER.enabled:
+                message = f":>>MSG:{SYSUSER}:Bandwidth of {len(self.sessions)} sessions"
+                for session in self.sessions:
+                    message += f"\n[S {session.name}]"
+                    for line in SHAPER.summary(session):
+                        message += f"\n{line}"
+            self.send(sender, message)
+
+        if tag_value == "memory":
+            message = f":>>MSG:{SYSUSER}:Resident memory {resident_memory() // 1024} KB"
+            for kind, count, size in memory_report(self):
+                message += f"\n{kind}: {count} objects, {size // 1024} KB"
+            self.send(sender, message)
+
+    #manual user command
+    def commandHere(self, sender: Sender, tag_value: str):
+        logging.info(f"[*] HERE from {sender.address} {sender.client.username}: {tag_value}")
+        if sender.client.protocolVersion >= 4:
+            self.sendUsers(sender)
+        else:
+            targetClients = [i for i in self.channels[sender.client.channel] if i.isLobby()]
+            message = f":>>MSG:{SYSUSER}:People in lobby"
+
+            for cl in targetClients:
+                message += f"\n{cl.client.username}"
+                if cl.client.joined:
+                    message += f"[room {cl.client.room_name}]"
+            self.send(sender, message)
 
-        arr = (_nextTag[1] + _nextTag[2]).encode()
-        if arr and len(arr) > 0:
-            self.dispatch(sender, arr)
\ No newline at end of file
+    #[PROTOCOL 4] answer to health request, activity time is updated by connection itself
+    def commandAlive(self, sender: Sender, tag_value: str):
+        pass
@@ -0,0 +1,181 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import time
+from datetime import datetime
+from metrics import METRICS
+
+FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%d-%b-%y %H:%M:%S'
+ROTATE_UNITS = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024} # size suffixes of rotation argument
+ROTATE_INTERVALS = ["s", "m", "h", "d", "midnight"] # time suffixes of rotation argument
+
+# sender whose connection is being served, attached to structured records
+CONTEXT = contextvars.ContextVar("sender", default=None)
+
+handler = None # QueueHandler of the root logger
+handlers = [] # handlers writing files, used by background writers
+processRecords = None # queue shared with worker processes, None if there are no workers
+listeners = [] # background writers of queued records
+owner = None # process which started the writers
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies connection details of the current sender into the record,
+    while it's still known in the logging thread
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        sender = CONTEXT.get()
+        client = sender and sender.client
+        record.address = sender and sender.address
+        record.username = getattr(client, "username", None)
+        record.room = getattr(client, "room_name", None) or None
+        session = getattr(client, "session", None)
+        record.session = session and session.name
+        return True
+
+
+class RateFilter(logging.Filter):
+    """
+    Token bucket per place of logging call, so storm of the same message doesn't flood the log.
+    Amount of dropped records is added to the next passed one.
+    Buckets are updated without locking: rare miscount is cheaper than lock on every record
+    """
+    rate: float # records per second from single call
+    buckets: dict # (file, line) -> [tokens, last update time, dropped records]
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+        self.buckets = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.CRITICAL:
+            return True
+
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        bucket = self.buckets.get(key)
+        if not bucket:
+            bucket = self.buckets[key] = [self.rate, now, 0]
+
+        bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            METRICS.count("log_dropped", record.levelname)
+            return False
+
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = f"{record.getMessage()} ({bucket[2]} similar records dropped)"
+            record.args = None
+            bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per line with connection details of the record
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for field in ("address", "username", "room", "session"):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def file_handler(path: str, rotate: str, backups: int) -> logging.Handler:
+    """
+    Handler writing to file, rotated by size (`10M`), by time (`12h`, `midnight`) or never (empty value)
+    """
+    if not rotate or rotate == "0":
+        return logging.FileHandler(path)
+
+    if rotate == "midnight":
+        return logging.handlers.TimedRotatingFileHandler(path, when="midnight", backupCount=backups)
+
+    amount, unit = rotate[:-1], rotate[-1]
+    # suffixes are case sensitive: `m` is minutes, `M` is megabytes
+    if unit in ROTATE_UNITS:
+        return logging.handlers.RotatingFileHandler(path, maxBytes=int(amount) * ROTATE_UNITS[unit], backupCount=backups)
+    if unit in ROTATE_INTERVALS:
+        return logging.handlers.TimedRotatingFileHandler(path, when=unit.upper(), interval=int(amount), backupCount=backups)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=int(rotate), backupCount=backups)
+
+
+def setup(level: int, structured: bool = False, rotate: str = "", backups: int = 5, rate: float = 0, processes: bool = False):
+    """
+    Routes records of all threads through the queue to background writer, so slow disk doesn't stall serving.
+    If `processes` is set, worker processes forked afterwards pass their records to the writer of this process.
+    Records are queued until `start` is called, so no thread is running before workers are forked
+    """
+    global handler, handlers, processRecords
+
+    highlevel = file_handler('proxyServer.log', rotate, backups)
+    highlevel.setLevel(logging.INFO)
+    handlers = [highlevel]
+    if level == logging.DEBUG:
+        lowlevel = file_handler('proxyServer_debug.log', rotate, backups)
+        lowlevel.setLevel(logging.DEBUG)
+        handlers.append(lowlevel)
+
+    formatter = JsonFormatter() if structured else logging.Formatter(FORMAT, DATE_FORMAT)
+    for h in handlers:
+        h.setFormatter(formatter)
+
+    handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    handler.setFormatter(logging.Formatter("%(message)s")) # records are formatted by writer
+    if rate:
+        handler.addFilter(RateFilter(rate))
+    if structured:
+        handler.addFilter(ContextFilter())
+    # feeder thread of this queue is started by the first record put, that happens in workers only
+    processRecords = multiprocessing.Queue() if processes else None
+
+    logging.basicConfig(handlers=[handler], level=level)
+
+
+def start():
+    """
+    Starts background writers of this process and of worker processes
+    """
+    global owner
+    for records in (handler.queue, processRecords):
+        if records != None:
+            listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+            listener.start()
+            listeners.append(listener)
+    owner = os.getpid()
+    atexit.register(shutdown)
+
+
+def redirect():
+    """
+    Called by worker process: records are passed to the writer of the main process
+    """
+    handler.queue = processRecords
+
+
+def shutdown():
+    """
+    Writes queued records and closes log files
+    """
+    if owner == os.getpid():
+        while listeners:
+            listeners.pop().stop()
+    logging.shutdown()
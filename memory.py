@@ -0,0 +1,50 @@
+import os
+import sys
+from buffers import POOL
+
+def size(*objects) -> int:
+    return sum(sys.getsizeof(o) for o in objects if o is not None)
+
+def sender_size(sender) -> int:
+    result = size(sender, sender.client)
+    if sender.frames:
+        result += size(sender.frames.buffer)
+    if sender.pipeReader:
+        result += size(sender.pipeReader.buffer)
+    if sender.outbox:
+        result += size(sender.outbox) + sender.outbox.size
+    if sender.isPipe():
+        result += size(sender.client.prevmessages, *sender.client.prevmessages)
+    return result
+
+def session_size(session) -> int:
+    result = size(session, session.connections, session.pipes, session.servers, session.clients_uuid)
+    for gc in session.connections:
+        result += size(gc, gc.serverMessages, gc.clientMessages)
+        result += gc.serverMessages.memory + gc.clientMessages.memory
+    return result
+
+def resident_memory() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def memory_report(lobby) -> list:
+    """
+    Current memory taken by connection objects and their buffers, grouped by type.
+    Returns list of (type, amount of objects, bytes)
+    """
+    lobbies = [s for s in lobby.senders if s.isLobby()]
+    pipes = [s for s in lobby.senders if s.isPipe()]
+    other = [s for s in lobby.senders if not s.isLobby() and not s.isPipe()]
+    pooled = [b for buffers in list(POOL.free.values()) for b in buffers]
+    return [
+        ("lobby connections", len(lobbies), sum(sender_size(s) for s in lobbies)),
+        ("game connections", len(pipes), sum(sender_size(s) for s in pipes)),
+        ("handshaking connections", len(other), sum(sender_size(s) for s in other)),
+        ("rooms", len(lobby.rooms), sum(size(r, r.players, r.mods) for r in list(lobby.rooms.values()))),
+        ("sessions", len(lobby.sessions), sum(session_size(s) for s in lobby.sessions)),
+        ("pooled buffers", len(pooled), sum(len(b) for b in pooled)),
+    ]
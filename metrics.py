@@ -0,0 +1,160 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from stats import STATS
+
+PREFIX = "vcmiproxy_"
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0) # seconds
+
+# name -> (type, label name, description)
+DESCRIPTIONS = {
+    "relay_bytes": ("counter", "direction", "Bytes relayed between game connections"),
+    "lobby_messages": ("counter", "tag", "Lobby messages dispatched"),
+    "errors": ("counter", "kind", "Errors occurred while serving connections"),
+    "rejections": ("counter", "reason", "Connections rejected by admission control"),
+    "relay_throttle_seconds": ("counter", "direction", "Time relay waited for bandwidth"),
+    "log_dropped": ("counter", "level", "Log records dropped by rate limit"),
+    "dispatch_seconds": ("histogram", None, "Time spent dispatching lobby message"),
+    "pipe_attach_seconds": ("histogram", None, "Time spent attaching game connection to its session"),
+}
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets
+    """
+    buckets: tuple # upper bounds
+    counts: list # observations per bucket, last one is +Inf
+    sum: float
+    count: int
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Counters and histograms updated by serving code.
+    Updates are plain increments without locking: rare lost update is cheaper than lock on every relayed chunk
+    """
+    counters: dict # (name, label value) -> value
+    histograms: dict # name -> Histogram
+    gauges: object # function returning list of (name, labels, value, description), evaluated on scrape
+
+    def __init__(self) -> None:
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = None
+
+    def count(self, name: str, label: str, value: int = 1):
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float):
+        histogram = self.histograms.get(name)
+        if not histogram:
+            histogram = self.histograms.setdefault(name, Histogram())
+        histogram.observe(value)
+
+    def render(self) -> str:
+        """
+        Text exposition format of prometheus
+        """
+        lines = []
+        if self.gauges:
+            described = set()
+            for name, labels, value, description in self.gauges():
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {PREFIX}{name} {description}")
+                    lines.append(f"# TYPE {PREFIX}{name} gauge")
+                lines.append(f"{PREFIX}{name}{labels} {value}")
+
+        for name, (kind, labelName, description) in DESCRIPTIONS.items():
+            if kind == "counter":
+                lines.append(f"# HELP {PREFIX}{name}_total {description}")
+                lines.append(f"# TYPE {PREFIX}{name}_total counter")
+                for (counter, label), value in list(self.counters.items()):
+                    if counter == name:
+                        lines.append(f'{PREFIX}{name}_total{{{labelName}="{label}"}} {value}')
+
+            if kind == "histogram" and name in self.histograms:
+                histogram = self.histograms[name]
+                lines.append(f"# HELP {PREFIX}{name} {description}")
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                total = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    total += count
+                    lines.append(f'{PREFIX}{name}_bucket{{le="{bound}"}} {total}')
+                lines.append(f"{PREFIX}{name}_sum {histogram.sum}")
+                lines.append(f"{PREFIX}{name}_count {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+
+def lobby_gauges(lobby) -> list:
+    """
+    Current state of the lobby, read without locking since it's only a snapshot
+    """
+    paired = 0
+    unpaired = 0
+    for session in list(lobby.sessions):
+        for gc in list(session.connections):
+            if gc.serverInit and gc.clientInit:
+                paired += 1
+            else:
+                unpaired += 1
+
+    return [
+        ("senders", "", len(lobby.senders), "Connected sockets"),
+        ("users", "", len(lobby.usernames), "Authorized lobby users"),
+        ("rooms", "", len(lobby.rooms), "Rooms in the lobby"),
+        ("sessions", "", len(lobby.sessions), "Started sessions"),
+        ("pipes", '{state="paired"}', paired, "Game connections"),
+        ("pipes", '{state="unpaired"}', unpaired, "Game connections"),
+        ("pending_bytes", '{storage="memory"}', STATS["pending_memory"], "Pipe data waiting for opposite client"),
+        ("pending_bytes", '{storage="disk"}', STATS["pending_disk"], "Pipe data waiting for opposite client"),
+        ("actor_queue", "", STATS["actor_queue"], "Lobby commands waiting to be executed"),
+        ("threads", "", threading.active_count(), "Threads of the process"),
+    ]
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"[*] Metrics request from {self.client_address}: {format % args}")
+
+
+def start_metrics(host: str, port: int, lobby):
+    """
+    Serves `/metrics` on separate port in background thread
+    """
+    METRICS.gauges = lambda: lobby_gauges(lobby)
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    t = threading.Thread(target=httpd.serve_forever)
+    t.daemon = True
+    t.start()
+    return httpd
@@ -0,0 +1,181 @@
+import logging
+import selectors
+import socket
+from collections import deque
+from threading import Lock, Thread
+
+HIGH_WATER_MARK = 512 * 1024 # bytes queued for single client before it's treated as too slow
+SEND_FLAGS = getattr(socket, "MSG_DONTWAIT", 0) # non-blocking send without changing socket mode
+
+class Outbox:
+    """
+    Outgoing lobby messages of one client.
+    Messages are written immediately if socket accepts them,
+    the rest stays queued and is written by `Flusher` when socket becomes writable
+    """
+    __slots__ = ("sock", "flusher", "queue", "size", "watched", "closing", "closed", "lock")
+    sock: socket
+    flusher: object
+    queue: deque # bytes or memoryview, may be shared with other outboxes
+    size: int # bytes queued
+    watched: bool # if flusher waits for socket to become writable
+    closing: bool # close socket when everything is sent
+    closed: bool
+    lock: Lock
+
+    def __init__(self, sock: socket, flusher) -> None:
+        self.sock = sock
+        self.flusher = flusher
+        self.queue = deque()
+        self.size = 0
+        self.watched = False
+        self.closing = False
+        self.closed = False
+        self.lock = Lock()
+
+    def put(self, data: bytes) -> bool:
+        """
+        Queues message. Returns False if client exceeded high water mark
+        """
+        with self.lock:
+            if self.closed or self.closing:
+                return True
+            if self.size + self.backlog() + len(data) > HIGH_WATER_MARK:
+                return False
+
+            self.queue.append(data)
+            self.size += len(data)
+            if not self.watched:
+                self.write()
+                if self.queue:
+                    self.watched = True
+                    self.flusher.watch(self)
+        return True
+
+    def backlog(self) -> int:
+        # bytes accepted by socket object, but not written yet
+        return 0
+
+    def write(self):
+        # writes as much as possible without blocking, lock must be held
+        while self.queue:
+            data = self.queue[0]
+            try:
+                sent = self.sock.send(data, SEND_FLAGS)
+            except BlockingIOError:
+                return
+            self.size -= sent
+            if sent < len(data):
+                self.queue[0] = memoryview(data)[sent:]
+                return
+            self.queue.popleft()
+
+    def flush(self) -> bool:
+        """
+        Called by flusher when socket is writable. Returns True if nothing is left to write
+        """
+        with self.lock:
+            if self.closed:
+                return True
+            self.write()
+            if self.queue:
+                return False
+
+            self.watched = False
+            if self.closing:
+                self.closed = True
+                self.sock.close()
+            return True
+
+    def closeAfterFlush(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closing = True
+            if not self.queue:
+                self.closed = True
+                self.sock.close()
+
+    def discard(self):
+        with self.lock:
+            self.closed = True
+            self.queue.clear()
+            self.size = 0
+            if self.watched:
+                self.watched = False
+                self.flusher.forget(self)
+
+
+class Flusher:
+    """
+    Single thread writing queued messages of all slow clients
+    """
+    selector: selectors.BaseSelector
+    commands: deque # (register, outbox) pairs to be applied by flusher thread
+    thread: Thread
+    lock: Lock
+
+    def __init__(self) -> None:
+        self.selector = None
+        self.commands = deque()
+        self.thread = None
+        self.lock = Lock()
+
+    def start(self):
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def command(self, register: bool, outbox: Outbox):
+        with self.lock:
+            if not self.thread:
+                self.start()
+        self.commands.append((register, outbox))
+        self.wakeup_w.send(b'\0')
+
+    def watch(self, outbox: Outbox):
+        self.command(True, outbox)
+
+    def forget(self, outbox: Outbox):
+        self.command(False, outbox)
+
+    def apply(self):
+        while self.commands:
+            register, outbox = self.commands.popleft()
+            try:
+                if register:
+                    self.selector.register(outbox.sock, selectors.EVENT_WRITE, outbox)
+                else:
+                    self.selector.unregister(outbox.sock)
+            except (KeyError, ValueError, OSError):
+                pass # already registered or socket is closed
+
+    def run(self):
+        while True:
+            for key, _events in self.selector.select():
+                if key.data == None:
+                    try:
+                        while self.wakeup_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                outbox = key.data
+                try:
+                    done = outbox.flush()
+                except Exception as e:
+                    logging.warning(f"[*] Can't flush lobby messages: {e}")
+                    outbox.discard()
+                    done = True
+                if done:
+                    try:
+                        self.selector.unregister(key.fileobj)
+                    except (KeyError, ValueError):
+                        pass
+
+            self.apply()
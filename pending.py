@@ -0,0 +1,116 @@
+import mmap
+import socket
+import tempfile
+from threading import Lock
+from stats import STATS
+
+MEMORY_LIMIT = 1024 * 1024 # bytes kept in memory per buffer, the rest goes to temporary file
+DRAIN_CHUNK_SIZE = 1024 * 1024 # how many bytes are sent by single write while draining
+
+class PendingBuffer:
+    """
+    Data received from pipe while opposite client is not connected yet.
+    First `MEMORY_LIMIT` bytes are kept in memory, everything above is spilled to temporary file.
+    Appended and drained by pipe threads: once drained or cleared, buffer refuses new data,
+    so it's sent directly only after everything stored before
+    """
+    __slots__ = ("chunks", "memory", "file", "disk", "closed", "lock")
+    chunks: list # data stored in memory
+    memory: int # size of data stored in memory
+    file: object # temporary file for spilled data
+    disk: int # size of spilled data
+    closed: bool # data is delivered or dropped, buffer isn't used anymore
+    lock: Lock
+
+    def __init__(self, chunks: list = None) -> None:
+        self.chunks = []
+        self.memory = 0
+        self.file = None
+        self.disk = 0
+        self.closed = False
+        self.lock = Lock()
+        for chunk in chunks or []:
+            self.append(chunk)
+
+    def __len__(self) -> int:
+        return self.memory + self.disk
+
+    def append(self, data: bytes) -> bool:
+        """
+        Stores data, returns False if buffer is closed already
+        """
+        with self.lock:
+            if self.closed:
+                return False
+
+            if self.file == None and self.memory + len(data) <= MEMORY_LIMIT:
+                self.chunks.append(bytes(data))
+                self.memory += len(data)
+                STATS["pending_memory"] += len(data)
+                return True
+
+            # order must be preserved - once spilled, all following data goes to the file
+            if self.file == None:
+                self.file = tempfile.TemporaryFile(prefix="vcmiproxy")
+            self.file.write(data)
+            self.disk += len(data)
+            STATS["pending_disk"] += len(data)
+            return True
+
+    def prepend(self, chunks: list) -> bool:
+        """
+        Stores data before everything appended so far, returns False if buffer is closed already.
+        Used for small handshake frames, so they are kept in memory regardless of the limit
+        """
+        with self.lock:
+            if self.closed:
+                return False
+
+            size = sum(len(chunk) for chunk in chunks)
+            self.chunks[:0] = [bytes(chunk) for chunk in chunks]
+            self.memory += size
+            STATS["pending_memory"] += size
+            return True
+
+    def iterate(self):
+        """
+        Yields stored data chunk by chunk, in order of receiving
+        """
+        yield from self.chunks
+
+        if self.file != None:
+            self.file.flush()
+            with mmap.mmap(self.file.fileno(), self.disk, access=mmap.ACCESS_READ) as mm:
+                for pos in range(0, self.disk, DRAIN_CHUNK_SIZE):
+                    yield mm[pos:pos + DRAIN_CHUNK_SIZE]
+
+    def drain(self, sock: socket):
+        """
+        Sends all pending data to socket chunk by chunk and closes the buffer.
+        Appending waits until it is finished and is refused then, so following data is sent after it
+        """
+        with self.lock:
+            try:
+                for chunk in self.iterate():
+                    sock.sendall(chunk)
+            finally:
+                self.release()
+
+    def clear(self):
+        """
+        Drops pending data and closes the buffer
+        """
+        with self.lock:
+            self.release()
+
+    def release(self):
+        # lock must be held
+        self.closed = True
+        STATS["pending_memory"] -= self.memory
+        STATS["pending_disk"] -= self.disk
+        self.chunks = []
+        self.memory = 0
+        if self.file != None:
+            self.file.close()
+        self.file = None
+        self.disk = 0
@@ -0,0 +1,88 @@
+import fcntl
+import os
+import socket
+import time
+from session import Session
+from shaping import SHAPER
+
+# os.splice is available on Linux starting from python 3.10
+SPLICE_SUPPORTED = hasattr(os, "splice")
+
+SPLICE_CHUNK_SIZE = 1024 * 1024 # how many bytes can be moved by single splice call
+SPLICE_PIPE_SIZE = 1024 * 1024 # requested capacity of the kernel pipe
+
+class SpliceRelay:
+    """
+    Relay engine which moves data from pipe socket to the opposite socket
+    through the kernel pipe, so data never gets copied into python objects.
+    One relay serves one direction of one game connection
+    """
+    pipe_r: int # read end of the kernel pipe
+    pipe_w: int # write end of the kernel pipe
+
+    def __init__(self) -> None:
+        self.pipe_r, self.pipe_w = os.pipe()
+        try:
+            fcntl.fcntl(self.pipe_w, fcntl.F_SETPIPE_SZ, SPLICE_PIPE_SIZE)
+        except (AttributeError, OSError):
+            pass # default pipe capacity is fine, just more syscalls
+
+    def forward(self, session: Session, sock: socket) -> int:
+        """
+        Moves next portion of data from `sock` to its pair in the `session`.
+        Blocks until data is available. Returns amount of bytes moved, 0 means EOF
+        """
+        size = os.splice(sock.fileno(), self.pipe_w, SPLICE_CHUNK_SIZE, flags=os.SPLICE_F_MOVE)
+        if size == 0:
+            return 0
+
+        if not session.validPipe(sock):
+            # opposite client disconnected while we were waiting - keep data as pending
+            session.pipeMessages(sock).append(self.read(size))
+            return size
+
+        if session.flows != None:
+            SHAPER.acquire(session, session.direction(sock), size)
+        sending = time.perf_counter() if session.traces != None else None
+        left = self.send(session, sock, size)
+        if left > 0:
+            # opposite client disconnected while data was moved
+            session.pipeMessages(sock).append(self.read(left))
+        elif sending:
+            # data is received by the kernel pipe right before sending is started
+            session.record(sock, sending, sending, size)
+        return size
+
+    def send(self, session: Session, sock: socket, size: int) -> int:
+        """
+        Moves `size` bytes from the kernel pipe to the opposite socket. Returns amount of bytes left
+        in the kernel pipe if opposite socket is disconnected.
+        Descriptor is used under the guard of the socket, so lobby actor can't close it and let
+        a new connection reuse the number while data is moved
+        """
+        opposite = session.pipes.get(sock)
+        guard = session.guards.get(opposite)
+        if guard == None:
+            return size
+
+        with guard:
+            fd = opposite.fileno()
+            if fd == -1:
+                return size
+            try:
+                while size > 0:
+                    size -= os.splice(self.pipe_r, fd, size, flags=os.SPLICE_F_MOVE)
+            except OSError:
+                if session.pipes.get(sock) is opposite:
+                    raise
+        return size
+
+    def read(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            data.extend(os.read(self.pipe_r, size - len(data)))
+        return bytes(data)
+
+    def close(self):
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
@@ -5,24 +5,29 @@ NEW_GAME = 0
 LOAD_GAME = 1
 
 class Room:
-    total = 1 # total amount of players
-    joined = 0 # amount of players joined to the session
-    password = "" # password to connect
-    protected = False # if True, password is required to join to the session
+    __slots__ = ("total", "joined", "password", "protected", "name", "host", "players", "mods", "gamemode", "started")
+    total: int # total amount of players
+    joined: int # amount of players joined to the session
+    password: str # password to connect
+    protected: bool # if True, password is required to join to the session
     name: str # name of room
     host: Sender # player socket who created the room
-    players = [] # list of clients of players, joined to the session
-    mods = {} # modname - version pairs of enabled by host mods
-    gamemode = NEW_GAME # game
-    started = False
+    players: list # list of clients of players, joined to the session
+    mods: dict # modname - version pairs of enabled by host mods
+    gamemode: int # game
+    started: bool
 
     def __init__(self, host: Sender, name: str) -> None:
+        self.total = 1
+        self.joined = 1
+        self.password = ""
+        self.protected = False
         self.name = name
         self.host = host
         self.players = [host]
-        self.joined = 1
-        self.gamemode = NEW_GAME
         self.mods = {}
+        self.gamemode = NEW_GAME
+        self.started = False
 
     def isJoined(self, player: Sender) -> bool:
         return player in self.players
@@ -0,0 +1,83 @@
+import logging
+import time
+from threading import Lock, Thread
+from stats import STATS
+
+TICK = 0.1 # seconds per wheel slot
+WHEEL_SIZE = 1024 # amount of slots, deadlines further than one turn wait for several turns
+
+class Scheduler:
+    """
+    Hashed timer wheel. Single thread serves all deadlines of the server,
+    scheduling, rescheduling and cancelling are O(1).
+    Each deadline is identified by key, scheduling with existing key reschedules it
+    """
+    slots: list # slot -> {key: (tick, callback, args)}
+    deadlines: dict # key -> slot index
+    tick: int # current tick
+    lock: Lock
+    executor: object # function used to run expired callbacks, runs them in scheduler thread by default
+
+    def __init__(self) -> None:
+        self.slots = [{} for _ in range(WHEEL_SIZE)]
+        self.deadlines = {}
+        self.tick = 0
+        self.lock = Lock()
+        self.executor = None
+
+    def start(self):
+        t = Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def schedule(self, key, delay: float, callback, *args):
+        with self.lock:
+            self.remove(key)
+            target = self.tick + max(1, round(delay / TICK))
+            slot = target % WHEEL_SIZE
+            self.slots[slot][key] = (target, callback, args)
+            self.deadlines[key] = slot
+            STATS["deadlines"] = len(self.deadlines)
+
+    def cancel(self, key):
+        with self.lock:
+            self.remove(key)
+            STATS["deadlines"] = len(self.deadlines)
+
+    def remove(self, key):
+        slot = self.deadlines.pop(key, None)
+        if slot != None:
+            self.slots[slot].pop(key, None)
+
+    def pending(self) -> int:
+        return len(self.deadlines)
+
+    def advance(self) -> list:
+        with self.lock:
+            self.tick += 1
+            slot = self.slots[self.tick % WHEEL_SIZE]
+            expired = [key for key, entry in slot.items() if entry[0] <= self.tick]
+            callbacks = []
+            for key in expired:
+                callbacks.append(slot.pop(key))
+                self.deadlines.pop(key, None)
+            if expired:
+                STATS["deadlines"] = len(self.deadlines)
+            return callbacks
+
+    def run(self):
+        next_tick = time.monotonic() + TICK
+        while True:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_tick += TICK
+
+            for _target, callback, args in self.advance():
+                try:
+                    if self.executor:
+                        self.executor(callback, *args)
+                    else:
+                        callback(*args)
+                except Exception as e:
+                    logging.error(f"[!] Scheduled callback failed: {e}")
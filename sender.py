@@ -1,17 +1,38 @@
+import re
 import socket
-import struct
+import time
 from client import Client, ClientLobby, ClientPipe
+from relay import SpliceRelay
+from buffers import PipeReader, FrameReader
+from outbox import Outbox
 
 BUFFER_SIZE = 4096
+PIPE_PATTERN = re.compile(rb"Aiya!") # game connection marker in the first message
 
 class Sender:
+    __slots__ = ("address", "client", "sock", "relay", "pipeReader", "frames", "outbox", "admitted", "lastSeen", "postponed")
     address: str #full client address
     client: Client
     sock: socket
+    relay: SpliceRelay #kernel relay engine for established pipe, if enabled
+    pipeReader: PipeReader #reusable buffer for established pipe
+    frames: FrameReader #buffered reader of lobby and handshake messages
+    outbox: Outbox #queue of outgoing lobby messages
+    admitted: str #connection type counted by admission control
+    lastSeen: float #time of the last received lobby message
+    postponed: list #lobby messages received while command waits for the cluster, None otherwise
 
     def __init__(self, client_socket: socket) -> None:
+        self.address = None
         self.client = None
         self.sock = client_socket
+        self.relay = None
+        self.pipeReader = None
+        self.frames = None
+        self.outbox = None
+        self.admitted = None
+        self.lastSeen = time.monotonic()
+        self.postponed = None
         pass
 
     def isLobby(self) -> bool:
@@ -22,33 +43,52 @@ class Sender:
     
     def receive_all(self, n):
         # Helper function to recv n bytes or return None if EOF is hit
-        data = bytearray()
-        while len(data) < n:
-            packet = self.sock.recv(n - len(data))
-            if not packet:
-                return None
-            data.extend(packet)
-        return data
+        if not self.frames:
+            self.frames = FrameReader()
+        return self.frames.read(self.sock, n)
     
     def receive_pack(self):
-        # Read message length and unpack it into an integer
-        raw_msglen = self.receive_all(4)
-        if not raw_msglen:
-            return None
-        msglen = struct.unpack('<I', raw_msglen)[0]
-        # Read the message data
-        return self.receive_all(msglen)
+        if not self.frames:
+            self.frames = FrameReader()
+        return self.frames.next(self.sock)
+
+    def feed(self, data: bytes):
+        # data received by another process, will be read before socket
+        if not self.frames:
+            self.frames = FrameReader()
+        self.frames.feed(data)
+
+    def takeLeftover(self) -> bytes:
+        # data received together with handshake, belongs to established pipe
+        if not self.frames:
+            return b''
+        data = self.frames.leftover()
+        self.frames = None
+        return data
     
     def receive_data(self):
         if self.isPipe() and self.client.auth:
-            return self.sock.recv(BUFFER_SIZE)
+            if self.frames and self.frames.pending():
+                return self.takeLeftover()
+            self.frames = None
+            if not self.pipeReader:
+                self.pipeReader = PipeReader()
+            return self.pipeReader.receive(self.sock)
         return self.receive_pack()
     
+    def release(self):
+        if self.relay:
+            self.relay.close()
+        if self.pipeReader:
+            self.pipeReader.release()
+        if self.outbox:
+            self.outbox.discard()
+        self.relay = None
+        self.pipeReader = None
+
     def handshake(self, data):
         if not self.client:
-            msg = str(data)
-            exchangeMessageFlag = False #flag to identify if message exchange was started
-            if msg.find("Aiya!") != -1:
+            if PIPE_PATTERN.search(data):
                 self.client = ClientPipe()
             else:
                 self.client = ClientLobby()
@@ -1,10 +1,28 @@
 import logging
+import os
 import socket
+import struct
 import sys
-from multiprocessing import Process
-from threading import Thread, Timer
+import time
+import pending
+import tracing
+import capture
+import logs
+import multiprocessing
+from threading import Thread
 from sender import Sender
-from lobby import Lobby, STATS
+from lobby import Lobby, openPipe
+from aioserver import AsyncServer
+from relay import SpliceRelay, SPLICE_SUPPORTED
+from client import ClientPipe
+from session import Session
+from workers import MasterRouter, WorkerRouter, unpack_frames, FDS_SUPPORTED
+from metrics import METRICS, start_metrics
+from admission import ADMISSION
+from upgrade import Handover, receive_message, send_message
+from journal import Journal
+from cluster import Cluster, LocalBackend, RemoteBackend, HubServer, forward_pipe
+from shaping import SHAPER
 
 # Major version: increase if backword compatibility with old protocols is not supported
 # Minor version: increase if new functional changes appeared, more functionality in the protocol
@@ -19,6 +37,11 @@ LOG_LEVELS = {
     "error": logging.ERROR,
     "critical": logging.CRITICAL
 }
+LOG_FORMAT = "text" # `text` or `json` with connection details of every record
+LOG_FORMATS = ["text", "json"]
+LOG_ROTATE = "" # size (`10M`) or time (`1d`, `midnight`) when log file is rotated, empty means never
+LOG_BACKUPS = 5 # rotated log files kept
+LOG_RATE = 0 # records per second allowed from single logging call, 0 means unlimited
 
 # server's IP address
 SERVER_HOST = "0.0.0.0"
@@ -26,6 +49,55 @@ SERVER_PORT = 5002 # port we want to use
 
 MAX_CONNECTIONS = 50
 
+# connections handling mode: thread per connection or single asyncio event loop
+SERVER_MODE = "threads"
+SERVER_MODES = ["threads", "asyncio"]
+
+# relay engine for established pipes: user-space copy or kernel splice (Linux, threads mode only)
+RELAY_ENGINE = "copy"
+RELAY_ENGINES = ["copy", "splice"]
+
+# kilobytes of pending pipe data kept in memory per game connection, the rest is spilled to disk
+PENDING_LIMIT = 1024
+
+# amount of worker processes relaying pipes, 0 means everything is served by single process
+WORKERS = 0
+
+# port of HTTP metrics listener, 0 means metrics are not served
+METRICS_PORT = 0
+
+# record relay timings of every session
+TRACE = False
+
+# directory where relayed pipe data is captured, None means capturing is disabled
+CAPTURE_DIR = None
+
+# seconds to finish handshake and between health checks of lobby clients, 0 disables them
+HEALTHCHECK = 30
+
+# file where started sessions are journaled and restored from after restart, None means journal is disabled
+JOURNAL_PATH = None
+
+# state backend shared by cluster nodes: `local` or address of the hub, None means cluster is disabled
+CLUSTER = None
+CLUSTER_HUB_PORT = 0 # port where this node serves its local backend to other nodes, 0 means hub is not served
+CLUSTER_NODE = None # address of this node for other nodes, host name and port by default
+
+# unix socket where running server passes its work to the new process, None means live upgrade is disabled
+UPGRADE_PATH = None
+
+# bandwidth shaping of relayed game connections, 0 means unlimited
+EGRESS_RATE = 0 # kilobytes per second relayed by the process
+SESSION_RATE = 0 # kilobytes per second relayed in each direction of session
+INTERACTIVE_SIZE = 1024 # chunks up to this amount of bytes are sent without delay
+
+# admission control, 0 means unlimited
+MAX_LOBBIES = 0 # concurrent lobby connections
+MAX_PIPES = 0 # concurrent game connections
+MAX_PER_IP = 0 # concurrent connections from single IP address
+IP_RATE = 0 # new connections per second from single IP address
+IP_BURST = 0 # new connections from single IP address allowed at once, equals to rate by default
+
 # command line arcgunents parsing and support
 for arg in sys.argv[1:]:
     element = arg.partition("=")
@@ -36,6 +108,21 @@ for arg in sys.argv[1:]:
     if element[0] == "logging":
         LOG_LEVEL = LOG_LEVELS[element[2]]
 
+    if element[0] == "logformat":
+        if element[2] not in LOG_FORMATS:
+            print(f"Unknown log format {element[2]}, continue with default {LOG_FORMAT}")
+            continue
+        LOG_FORMAT = element[2]
+
+    if element[0] == "logrotate":
+        LOG_ROTATE = element[2]
+
+    if element[0] == "logbackups":
+        LOG_BACKUPS = int(element[2])
+
+    if element[0] == "lograte":
+        LOG_RATE = float(element[2])
+
     if element[0] == "port":
         num = int(element[2])
         if num == 0:
@@ -50,72 +137,171 @@ for arg in sys.argv[1:]:
             continue
         MAX_CONNECTIONS = num
 
+    if element[0] == "healthcheck":
+        HEALTHCHECK = int(element[2])
+
+    if element[0] == "mode":
+        if element[2] not in SERVER_MODES:
+            print(f"Unknown server mode {element[2]}, continue with default {SERVER_MODE}")
+            continue
+        SERVER_MODE = element[2]
 
-#logging
-logHandlerHighlevel = logging.FileHandler('proxyServer.log')
-logHandlerHighlevel.setLevel(logging.INFO)
+    if element[0] == "relay":
+        if element[2] not in RELAY_ENGINES:
+            print(f"Unknown relay engine {element[2]}, continue with default {RELAY_ENGINE}")
+            continue
+        RELAY_ENGINE = element[2]
 
-logHandlerLowlevel = logging.FileHandler('proxyServer_debug.log')
-logHandlerLowlevel.setLevel(logging.DEBUG)
+    if element[0] == "pending":
+        PENDING_LIMIT = int(element[2])
 
-handlers = [logHandlerHighlevel]
-if LOG_LEVEL == logging.DEBUG:
-    handlers.append(logHandlerLowlevel)
+    if element[0] == "workers":
+        WORKERS = int(element[2])
 
-logging.basicConfig(handlers=handlers, level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
+    if element[0] == "metrics":
+        METRICS_PORT = int(element[2])
 
+    if element[0] == "trace":
+        TRACE = element[2] not in ["0", "off"]
 
+    if element[0] == "capture":
+        CAPTURE_DIR = element[2]
 
-# create a TCP socket
-s = socket.socket()
-# make the port as reusable port
-s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-# bind the socket to the address we specified
-s.bind((SERVER_HOST, SERVER_PORT))
-# listen for upcoming connections
-s.listen(MAX_CONNECTIONS)
-logging.info("=============================================")
-logging.info(f"[!] ProxyServer version {PROXYSERVER_VERSION}")
-logging.info(f"[!] Listening as {SERVER_HOST}:{SERVER_PORT}")
+    if element[0] == "journal":
+        JOURNAL_PATH = element[2] or None
 
-lobby = Lobby()
+    if element[0] == "cluster":
+        CLUSTER = element[2] or None
+
+    if element[0] == "hub":
+        CLUSTER_HUB_PORT = int(element[2])
+
+    if element[0] == "node":
+        CLUSTER_NODE = element[2]
+
+    if element[0] == "upgrade":
+        UPGRADE_PATH = element[2] or None
+
+    if element[0] == "egress":
+        EGRESS_RATE = float(element[2])
+
+    if element[0] == "sessionrate":
+        SESSION_RATE = float(element[2])
+
+    if element[0] == "interactive":
+        INTERACTIVE_SIZE = int(element[2])
+
+    if element[0] == "maxlobbies":
+        MAX_LOBBIES = int(element[2])
+
+    if element[0] == "maxpipes":
+        MAX_PIPES = int(element[2])
+
+    if element[0] == "maxperip":
+        MAX_PER_IP = int(element[2])
+
+    if element[0] == "iprate":
+        IP_RATE = float(element[2])
+
+    if element[0] == "ipburst":
+        IP_BURST = float(element[2])
+
+pending.MEMORY_LIMIT = PENDING_LIMIT * 1024
+tracing.ENABLED = TRACE
+
+if (EGRESS_RATE or SESSION_RATE) and SERVER_MODE != "threads":
+    print(f"Bandwidth shaping is supported only in threads mode, continue without shaping")
+    EGRESS_RATE = SESSION_RATE = 0
+
+SHAPER.rate = EGRESS_RATE * 1024
+SHAPER.sessionRate = SESSION_RATE * 1024
+SHAPER.interactive = INTERACTIVE_SIZE
+
+ADMISSION.maxLobbies = MAX_LOBBIES
+ADMISSION.maxPipes = MAX_PIPES
+ADMISSION.maxPerAddress = MAX_PER_IP
+ADMISSION.rate = IP_RATE
+ADMISSION.burst = max(1, IP_BURST or IP_RATE)
+
+if CAPTURE_DIR:
+    os.makedirs(CAPTURE_DIR, exist_ok=True)
+    capture.DIRECTORY = CAPTURE_DIR
+
+if WORKERS > 0 and SERVER_MODE != "threads":
+    print(f"Worker processes are supported only in threads mode, continue without workers")
+    WORKERS = 0
+
+if WORKERS > 0 and not FDS_SUPPORTED:
+    print(f"Passing connections between processes requires python 3.9, continue without workers")
+    WORKERS = 0
+
+if RELAY_ENGINE == "splice" and (not SPLICE_SUPPORTED or SERVER_MODE != "threads"):
+    print(f"Splice relay is not supported in this environment, continue with copy relay")
+    RELAY_ENGINE = "copy"
+
+if UPGRADE_PATH and (WORKERS > 0 or SERVER_MODE != "threads"):
+    print(f"Live upgrade is supported only in threads mode without workers, continue without upgrade")
+    UPGRADE_PATH = None
+
+if UPGRADE_PATH and not FDS_SUPPORTED:
+    print(f"Passing connections between processes requires python 3.9, continue without upgrade")
+    UPGRADE_PATH = None
+
+if CLUSTER and (WORKERS > 0 or SERVER_MODE != "threads"):
+    print(f"Cluster is supported only in threads mode without workers, continue as single node")
+    CLUSTER = None
+
+if CLUSTER_HUB_PORT and CLUSTER != "local":
+    print(f"Only node with local cluster backend can serve the hub, continue without hub")
+    CLUSTER_HUB_PORT = 0
+
+if RELAY_ENGINE == "splice" and CAPTURE_DIR:
+    print(f"Relayed data can't be captured by splice relay, continue with copy relay")
+    RELAY_ENGINE = "copy"
+
+#logging, records of worker processes are written by main process
+logs.setup(LOG_LEVEL, LOG_FORMAT == "json", LOG_ROTATE, LOG_BACKUPS, LOG_RATE, WORKERS > 0)
 
-def removeSession(session):
-    session.timer = None
-    if len(session.connections) == 0:
-        lobby.sessions.remove(session)
+handover = None # passes work to the new process on live upgrade, if enabled
+takeover_channel = None # connection to the running server which work is taken over
+router = None # passes connections between master and worker processes, if workers are enabled
 
-def handle_disconnection(sender: Sender):
+
+
+def create_listen_socket() -> socket:
+    # create a TCP socket
+    s = socket.socket()
+    # make the port as reusable port
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if WORKERS > 0:
+        # all processes listen the same port, kernel balances connections between them
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # bind the socket to the address we specified
+    s.bind((SERVER_HOST, SERVER_PORT))
+    # listen for upcoming connections
+    s.listen(MAX_CONNECTIONS)
+    return s
+
+def setup_pipe(sender: Sender):
+    # search for session and register connection, pending data is sent by this thread
+    openPipe(sender, lobby.actor.call(lobby.attachPipe, sender))
+
+    if RELAY_ENGINE == "splice" and sender.client.session:
+        sender.relay = SpliceRelay()
+
+
+def store_pipe(sender: Sender, data: bytes) -> bool:
     """
-    Handles disconnnection of socket in current thread.
-    Called in case of any socket method throws
+    Keeps data until opposite pipe is connected and data stored before is delivered,
+    returns False if data can be sent directly. Stored data is spilled to disk by this thread, not by lobby actor
     """
-    try:
-        if sender.isLobby():
-            lobby.disconnect(sender)
-        if sender.isPipe():
-            if sender.client.session:
-                sender.client.session.removeConnection(sender.sock)
-                try:
-                    if len(sender.client.session.connections) == 0:
-                        if sender.client.session.timer != None:
-                            sender.client.session.timer.cancel()
-                        sender.client.session.timer = Timer(1800, removeSession, args = [sender.client.session])
-                        sender.client.session.timer.start()
-                        
-                    lobby.senders.remove(sender)
-                except ValueError as e:
-                    logging.warning(f"[*] Exception during disconnecion: {e}")
-
-    except Exception as e:
-        logging.critical(f"[!] Unhandled execption: {e}")
-    
-    try:
-        sender.sock.close()
-        if sender in lobby.senders:
-            lobby.senders.remove(sender)
-    except Exception as e:
-        logging.critical(f"[!] Cannot close socket: {e}")
+    while True:
+        pending = lobby.actor.call(lobby.pendingBuffer, sender)
+        if pending == None:
+            return False
+        if pending.append(data):
+            return True
+        # buffer was drained or replaced meanwhile
 
 
 def listen_for_client(sender: Sender):
@@ -123,10 +309,29 @@ def listen_for_client(sender: Sender):
     This function keep listening for a message from `cs` socket
     Whenever a message is received, broadcast it to all other connected clients
     """
+    logs.CONTEXT.set(sender)
+    waiting = True # pipe data goes through pending buffer until it's delivered
     try:
+        poller = handover.poller(sender.sock) if handover else None
         while True:
+            relaying = poller and sender.isPipe() and sender.client.auth
+            if relaying:
+                # data is awaited with timeout, so relay stops reading when upgrade is started
+                handover.waitReadable(sender, poller)
+
+            if sender.relay and not sender.frames and not waiting and sender.client.session.validPipe(sender.sock):
+                # established pipe - move data in kernel without receiving it
+                size = sender.relay.forward(sender.client.session, sender.sock)
+                if size == 0:
+                    break # EOF - TCP connection is stopped
+                METRICS.count("relay_bytes", sender.client.session.direction(sender.sock), size)
+                continue
+
             # keep listening for a message from `cs` socket
             msg = sender.receive_data()
+            received = time.perf_counter() if TRACE else None
+            if relaying and handover.frozen:
+                handover.park(sender, bytes(msg or b''))
 
             if msg == None or msg == b'':
                 break # receiving empty message means that TCP connection is stopped
@@ -134,41 +339,38 @@ def listen_for_client(sender: Sender):
             if not sender.client or not sender.client.auth:
                 # client isn't identified yet
                 if sender.handshake(msg) == False:
+                    METRICS.count("errors", "handshake")
                     if sender.client: # partially authorized client - we can send an error message
                         logging.error(f"[!] {sender.client.status}")
                         if sender.isLobby():
-                            lobby.send(sender, f":>>ERROR:{sender.client.status}")
+                            lobby.actor.submit(lobby.send, sender, f":>>ERROR:{sender.client.status}")
                     break # handle disconnection if handshakign is unsuccessfull
 
                 # this codeblock if needed to properly support game connection after handshaking
                 # need to do this only once, which is ensured by setting `auth`` to true
                 if sender.isPipe() and sender.client.auth:
                     #read missing byte
-                    sender.client.prevmessages.append(sender.sock.recv(1))
+                    sender.client.prevmessages.append(sender.receive_all(1) or b'')
+
+                if router and router.handoff(sender, msg):
+                    sender.client = None # connection is served by another process, nothing to cleanup
+                    break
+
+                if not ADMISSION.classify(sender):
+                    if sender.isLobby():
+                        lobby.actor.submit(lobby.send, sender, f":>>ERROR:Server is full, try again later")
+                    break
+
+                owner = sender.isPipe() and sender.client.auth and lobby.actor.call(lobby.remoteOwner, sender)
+                if owner:
+                    # session lives on another cluster node
+                    logging.info(f"[*] Game connection {sender.address} is forwarded to {owner}")
+                    forward_pipe(sender, owner)
+                    break
+
+                if sender.isPipe() and sender.client.auth:
                     msg = b'' #reset message to prevent its duplicating
-                    
-                    # search for session and register connection
-                    for session in lobby.sessions:
-                        if sender.client.testForSession(session):
-                            sender.client.session = session
-                            session.addConnection(sender.sock, sender.client.isServer(), sender.client.prevmessages)
-                            break
-
-                    if sender.client.session and sender.client.session.validPipe(sender.sock):
-                        # session has been found, send all pending data to connected client
-                        if len(sender.client.session.pipeMessages(sender.sock)):
-                            sender.client.session.forward_data(sender.sock, b''.join(sender.client.session.pipeMessages(sender.sock)))
-                        
-                        # send all received data to opposite client
-                        # after this step data exchange is finally started
-                        opposite = sender.client.session.getPipe(sender.sock)
-                        if len(sender.client.session.pipeMessages(opposite)):
-                            sender.client.session.forward_data(opposite, b''.join(sender.client.session.pipeMessages(opposite)))
-                    
-                    BUFFER_SIZE = 1024 * 1024  # Example buffer size of 1MB
-                    sender.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUFFER_SIZE)
-                    sender.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_SIZE)
-                    sender.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    setup_pipe(sender)
 
             
             if sender.isPipe():
@@ -178,43 +380,264 @@ def listen_for_client(sender: Sender):
                 if not sender.client.session:
                     break #cannot connect player - break connection
 
-                if not sender.client.session.validPipe(sender.sock):
+                if waiting or not sender.client.session.validPipe(sender.sock):
                     # opposite client still not connected - wait for them and store all pending messages
-                    if msg != b'':
-                        sender.client.session.pipeMessages(sender.sock).append(msg)
-                    continue
+                    waiting = msg == b'' or store_pipe(sender, msg)
+                    if waiting:
+                        continue
 
                 # connection established - just forward data
-                sender.client.session.forward_data(sender.sock, msg)
+                sender.client.session.forward_data(sender.sock, msg, received)
 
 
             if sender.isLobby():
                 # for lobby connection dispatch lobby message
-                lobby.dispatch(sender, msg)
+                sender.lastSeen = time.monotonic()
+                if not sender.client.auth:
+                    # wait for greetings result, next message is either lobby command or new handshake
+                    settled = lobby.actor.call(lobby.dispatch, sender, msg)
+                    if settled:
+                        settled.result() # name is claimed in the cluster, actor keeps serving others meanwhile
+                else:
+                    # message is copied, because receiving buffer is reused
+                    lobby.actor.submit(lobby.dispatch, sender, bytes(msg))
 
     except Exception as e:
         # client no longer connected
         logging.error(f"[!] Error: {e}")
-        print(f"[!] Error: {e}")
+        METRICS.count("errors", "connection")
         
     finally:
-        handle_disconnection(sender)
+        lobby.actor.submit(lobby.closeConnection, sender)
+
 
+def accept_connections():
+    """
+    Legacy threaded mode: accepts connections and starts thread for each of them
+    """
+    while True:
+        # we keep listening for new connections all the time
+        if handover:
+            client_socket, client_address = handover.accept(s)
+            if not client_socket:
+                continue
+        else:
+            client_socket, client_address = s.accept()
+        if not ADMISSION.admit(client_address):
+            client_socket.close() # rejected before any work is spent on connection
+            continue
 
-while True:
-    # we keep listening for new connections all the time
-    client_socket, client_address = s.accept()
-    logging.info(f"[+] {client_address} connected.")
-    STATS["uniques"].add(client_address[0])
-    STATS["logins"] += 1
-    # add the new connected client to connected sockets
-    sender = Sender(client_socket)
-    sender.address = client_address
-    lobby.senders.append(sender)
+        logging.info(f"[+] {client_address} connected.")
+        # add the new connected client to connected sockets
+        sender = Sender(client_socket)
+        sender.address = client_address
+        start_listening(sender)
+
+
+def start_listening(sender: Sender):
+    lobby.actor.submit(lobby.connect, sender)
 
     # start a new thread that listens for each client's messages
     t = Thread(target=listen_for_client, args=(sender,))
     # make the thread daemon so it ends whenever the main thread ends
     t.daemon = True
     # start the thread
-    t.start()
\ No newline at end of file
+    t.start()
+
+
+def accept_lobby_handoff(sock: socket, address: tuple, msg: bytes, leftover: bytes):
+    """
+    Master process: continue lobby connection accepted by worker
+    """
+    if not ADMISSION.admit(address, False):
+        sock.close()
+        return
+
+    logging.info(f"[+] {address} connected via worker.")
+    sender = Sender(sock)
+    sender.address = address
+    # first message is processed from the beginning, as if it was received by this process
+    sender.feed(struct.pack('<I', len(msg)) + msg + leftover)
+    start_listening(sender)
+
+
+def add_routed_session(description: dict):
+    # executed by lobby actor, session may be already known because of its other pipes
+    if not lobby.findSession(description["host_uuid"], True):
+        session = Session()
+        session.name = description["name"]
+        session.host_uuid = description["host_uuid"]
+        session.clients_uuid = description["clients_uuid"]
+        lobby.addSession(session)
+
+
+def accept_pipe_handoff(sock: socket, header: dict):
+    """
+    Worker process: continue authorized pipe routed by master
+    """
+    address = tuple(header["address"])
+    if not ADMISSION.admit(address, False):
+        sock.close()
+        return
+
+    lobby.actor.call(add_routed_session, header["session"])
+
+    sender = Sender(sock)
+    sender.address = address
+    sender.client = ClientPipe()
+    sender.client.apptype = header["apptype"]
+    sender.client.uuid = header["uuid"]
+    sender.client.prevmessages = unpack_frames(header["frames"])
+    sender.client.auth = True
+    if not ADMISSION.classify(sender):
+        ADMISSION.release(sender)
+        sock.close()
+        return
+
+    sender.feed(unpack_frames([header["leftover"]])[0])
+    setup_pipe(sender)
+    start_listening(sender)
+
+
+def take_over(channel: socket):
+    """
+    New process on live upgrade: restores sessions and game connections of the running server
+    """
+    pipes = []
+    while True:
+        header, socks = receive_message(channel)
+        if not header:
+            raise ConnectionError(f"Running server closed upgrade channel")
+
+        if header["type"] == "session":
+            lobby.actor.call(add_routed_session, header)
+
+        if header["type"] == "pipe":
+            address = tuple(header["address"])
+            if not ADMISSION.admit(address, False):
+                socks[0].close()
+                continue
+
+            sender = Sender(socks[0])
+            sender.address = address
+            sender.client = ClientPipe()
+            sender.client.apptype = header["apptype"]
+            sender.client.uuid = header["uuid"]
+            sender.client.auth = True
+            if not ADMISSION.classify(sender):
+                ADMISSION.release(sender)
+                socks[0].close()
+                continue
+
+            lobby.actor.call(lobby.restorePipe, sender, header["connection"])
+            pipes.append(sender)
+
+        if header["type"] == "data":
+            data = unpack_frames([header["data"]])[0]
+            lobby.actor.call(lobby.restorePending, header["session"], header["connection"], header["server"], data)
+
+        if header["type"] == "accepted":
+            address = tuple(header["address"])
+            if not ADMISSION.admit(address):
+                socks[0].close()
+                continue
+
+            sender = Sender(socks[0])
+            sender.address = address
+            start_listening(sender)
+
+        if header["type"] == "done":
+            break
+
+    for sender in pipes:
+        session = sender.client.session
+        if session and session.validPipe(sender.sock):
+            # data received by previous process, but not delivered yet
+            lobby.actor.call(session.pipeMessages, sender.sock).drain(session.getPipe(sender.sock))
+        if RELAY_ENGINE == "splice" and session:
+            sender.relay = SpliceRelay()
+        start_listening(sender)
+
+    send_message(channel, {"type": "ready"})
+    channel.close()
+    logging.info(f"[!] Taken over {len(lobby.sessions)} sessions and {len(pipes)} game connections")
+
+
+def run_worker(index: int, channel: socket):
+    """
+    Worker process entry point. Worker accepts connections on the shared port
+    and relays pipes of sessions assigned to it by master
+    """
+    global s, lobby, router
+    logs.redirect()
+    s = create_listen_socket()
+    lobby = Lobby()
+    lobby.startHealthcheck(HEALTHCHECK)
+    router = WorkerRouter(channel, accept_pipe_handoff)
+    router.start()
+    lobby.master = router
+    logging.info(f"[!] Worker {index} started")
+    accept_connections()
+
+
+def start_workers() -> list:
+    """
+    Forks worker processes, returns channels to them. Called while main process has no other threads,
+    so workers don't inherit locks held by threads which don't exist in the child
+    """
+    channels = []
+    context = multiprocessing.get_context("fork") # workers continue with state of this module
+    for index in range(WORKERS):
+        master_channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        p = context.Process(target=run_worker, args=(index, worker_channel), daemon=True)
+        p.start()
+        worker_channel.close()
+        channels.append(master_channel)
+    return channels
+
+
+worker_channels = start_workers() if SERVER_MODE == "threads" and WORKERS > 0 else []
+logs.start()
+
+if UPGRADE_PATH:
+    handover = Handover(UPGRADE_PATH)
+    takeover_channel = handover.connect()
+
+s = handover.receiveListener(takeover_channel) if takeover_channel else create_listen_socket()
+logging.info("=============================================")
+logging.info(f"[!] ProxyServer version {PROXYSERVER_VERSION}")
+logging.info(f"[!] Listening as {SERVER_HOST}:{SERVER_PORT}{' (taken over from running server)' if takeover_channel else ''}")
+logging.info(f"[!] Server mode: {SERVER_MODE}, relay engine: {RELAY_ENGINE}, workers: {WORKERS}")
+
+lobby = Lobby()
+lobby.startHealthcheck(HEALTHCHECK)
+if JOURNAL_PATH:
+    journal = Journal(JOURNAL_PATH)
+    for session in journal.load():
+        lobby.addSession(session)
+    lobby.journal = journal
+    logging.info(f"[!] Restored {len(lobby.sessions)} sessions from journal {JOURNAL_PATH}")
+if CLUSTER:
+    backend = LocalBackend() if CLUSTER == "local" else RemoteBackend(CLUSTER, lobby.scheduler)
+    if CLUSTER_HUB_PORT:
+        HubServer(backend).start(SERVER_HOST, CLUSTER_HUB_PORT)
+    lobby.joinCluster(Cluster(CLUSTER_NODE or f"{socket.gethostname()}:{SERVER_PORT}", backend))
+    logging.info(f"[!] Cluster node {lobby.cluster.node}, backend {CLUSTER}{f', hub port {CLUSTER_HUB_PORT}' if CLUSTER_HUB_PORT else ''}")
+if worker_channels:
+    router = MasterRouter(lobby, worker_channels, accept_lobby_handoff)
+    router.start()
+
+if handover:
+    if takeover_channel:
+        take_over(takeover_channel)
+    handover.start(lobby, s)
+
+if METRICS_PORT > 0:
+    # started after workers are forked, so they don't inherit metrics listener
+    start_metrics(SERVER_HOST, METRICS_PORT, lobby)
+    logging.info(f"[!] Metrics are served at {SERVER_HOST}:{METRICS_PORT}/metrics")
+
+if SERVER_MODE == "asyncio":
+    AsyncServer(lobby).run(s)
+else:
+    accept_connections()
@@ -1,32 +1,44 @@
 import socket
-from threading import Timer
+import time
+from threading import Lock
+import tracing
+from pending import PendingBuffer
+from metrics import METRICS
+from shaping import SHAPER
 
 class GameConnection:
+    __slots__ = ("server", "client", "serverInit", "clientInit", "serverMessages", "clientMessages")
     server: socket # socket to vcmiserver
     client: socket # socket to vcmiclient
-    serverInit = False # if vcmiserver already connected
-    clientInit = False # if vcmiclient already connected
-    serverMessages: list
-    clientMessages: list
+    serverInit: bool # if vcmiserver already connected
+    clientInit: bool # if vcmiclient already connected
+    serverMessages: PendingBuffer
+    clientMessages: PendingBuffer
 
     def __init__(self) -> None:
         self.server = None
         self.client = None
         self.serverInit = False
         self.clientInit = False
-        self.serverMessages = []
-        self.clientMessages = []
+        self.serverMessages = PendingBuffer()
+        self.clientMessages = PendingBuffer()
         pass
 
 
 class Session:
+    __slots__ = ("name", "host_uuid", "clients_uuid", "connections", "pipes", "servers", "traces", "flows", "capture", "worker", "guards")
     name: str # name of session
     host_uuid: str # uuid of vcmiserver for hosting player
     clients_uuid: list # list of vcmiclients uuid
     players: list # list of sockets of players, joined to the session
     connections: list # list of GameConnections for vcmiclient/vcmiserver (game mode)
     pipes: dict #dictionary of pipes for speed up
-    timer: Timer # timers to verify if session is alive
+    servers: set # sockets of vcmiserver pipes, to distinguish relay direction
+    traces: dict # source socket -> RelayTrace of connected pipes, None if tracing is disabled
+    flows: dict # direction -> Flow of bandwidth shaper, None if shaping is disabled
+    capture: object # Capture of relayed data, None if capturing is disabled
+    worker: int # index of worker process relaying this session, if workers are enabled
+    guards: dict # socket -> Lock held while raw descriptor of the socket is written outside of lobby actor
 
     def __init__(self) -> None:
         self.name = ""
@@ -34,23 +46,36 @@ class Session:
         self.clients_uuid = []
         self.connections = []
         self.pipes = {}
-        self.timer = None
+        self.servers = set()
+        self.traces = {} if tracing.ENABLED else None
+        self.flows = {} if SHAPER.enabled else None
+        self.capture = None
+        self.worker = None
+        self.guards = {}
         pass
 
     def addConnection(self, conn: socket, isServer: bool, prevMessages: list):
+        if isServer:
+            self.servers.add(conn)
+        self.guards[conn] = Lock()
+
         #find uninitialized server connection
         for gc in self.connections:
             if isServer and not gc.serverInit:
                 gc.server = conn
                 gc.serverInit = True
-                gc.serverMessages = prevMessages
+                # handshake of attaching pipe goes before data stored by waiting one
+                if not gc.serverMessages.prepend(prevMessages):
+                    gc.serverMessages = PendingBuffer(prevMessages)
                 self.pipes[conn] = gc.client
                 self.pipes[gc.client] = conn
                 return
             if not isServer and not gc.clientInit:
                 gc.client = conn
                 gc.clientInit = True
-                gc.clientMessages = prevMessages
+                # handshake of attaching pipe goes before data stored by waiting one
+                if not gc.clientMessages.prepend(prevMessages):
+                    gc.clientMessages = PendingBuffer(prevMessages)
                 self.pipes[conn] = gc.server
                 self.pipes[gc.server] = conn
                 return
@@ -60,30 +85,63 @@ class Session:
         if isServer:
             gc.server = conn
             gc.serverInit = True
-            gc.serverMessages = prevMessages
+            gc.serverMessages = PendingBuffer(prevMessages)
         else:
             gc.client = conn
             gc.clientInit = True
-            gc.clientMessages = prevMessages
+            gc.clientMessages = PendingBuffer(prevMessages)
         self.connections.append(gc)
 
+    def restoreConnection(self, index: int, conn: socket, isServer: bool):
+        # game connection passed by previous process keeps its position and pairing
+        while len(self.connections) <= index:
+            self.connections.append(GameConnection())
+        gc = self.connections[index]
+        self.guards[conn] = Lock()
+        if isServer:
+            self.servers.add(conn)
+            gc.server = conn
+            gc.serverInit = True
+        else:
+            gc.client = conn
+            gc.clientInit = True
+
+        if gc.serverInit and gc.clientInit:
+            self.pipes[gc.server] = gc.client
+            self.pipes[gc.client] = gc.server
+
     def removeConnection(self, conn: socket):
         if self.validPipe(conn):
             opposite = self.getPipe(conn)
             self.pipes.pop(self.getPipe(conn), None)
             self.pipes.pop(conn, None)
+        self.servers.discard(conn)
+        self.guards.pop(conn, None)
+        if self.traces:
+            self.traces.pop(conn, None)
 
         newConnections = []
         for c in self.connections:
             if c.server == conn:
                 c.server = None
                 c.serverInit = False
+                c.serverMessages.clear()
+                c.serverMessages = PendingBuffer() # data of remaining client waits for the next server
             if c.client == conn:
                 c.client = None
                 c.clientInit = False
+                c.clientMessages.clear()
+                c.clientMessages = PendingBuffer()
             if c.server != None or c.client != None:
                 newConnections.append(c)
+            else:
+                c.serverMessages.clear()
+                c.clientMessages.clear()
+                if self.capture:
+                    self.capture.forget(c)
         self.connections = newConnections
+        if self.capture:
+            self.capture.flush()
 
     def validPipe(self, conn) -> bool:
         return conn in self.pipes.keys()
@@ -91,12 +149,42 @@ class Session:
     def getPipe(self, conn) -> socket:
         return self.pipes[conn]
     
-    def pipeMessages(self, conn: socket):
+    def pipeMessages(self, conn: socket) -> PendingBuffer:
         for c in self.connections:
             if c.client == conn:
                 return c.serverMessages
             if c.server == conn:
                 return c.clientMessages
 
-    def forward_data(self, src_socket, data):
-        self.pipes[src_socket].sendall(data)
\ No newline at end of file
+    def forward_data(self, src_socket, data, received: float = None):
+        if self.flows != None:
+            SHAPER.acquire(self, self.direction(src_socket), len(data))
+        if self.traces == None:
+            self.pipes[src_socket].sendall(data)
+        else:
+            sending = time.perf_counter()
+            self.pipes[src_socket].sendall(data)
+            self.record(src_socket, received or sending, sending, len(data))
+        METRICS.count("relay_bytes", self.direction(src_socket), len(data))
+        if self.capture:
+            self.capture.write(self.gameConnection(src_socket), src_socket in self.servers, data)
+
+    def gameConnection(self, conn: socket) -> GameConnection:
+        for c in self.connections:
+            if c.server == conn or c.client == conn:
+                return c
+
+    def record(self, src_socket, received: float, sending: float, size: int):
+        trace = self.traces.get(src_socket)
+        if not trace:
+            trace = tracing.RelayTrace(f"pipe {len(self.traces) + 1} {self.direction(src_socket)}")
+            self.traces[src_socket] = trace
+        trace.record(received, sending, time.perf_counter(), size)
+
+    def traceSummary(self) -> list:
+        if self.traces == None:
+            return []
+        return [trace.summary() for trace in list(self.traces.values())]
+
+    def direction(self, src_socket) -> str:
+        return "from_server" if src_socket in self.servers else "from_client"
\ No newline at end of file
@@ -0,0 +1,150 @@
+import heapq
+import time
+from threading import Condition
+from metrics import METRICS
+
+BURST = 0.1 # seconds of rate which can be sent at once after idle period
+
+class Flow:
+    """
+    One direction of one session: its token bucket, fair queuing tag and throttling counters
+    """
+    __slots__ = ("direction", "tokens", "updated", "finish", "bytes", "throttled", "delayed")
+    direction: str
+    tokens: float # bytes allowed by session rate, negative when sent ahead
+    updated: float # last refill time
+    finish: float # virtual time when data of this direction allowed so far is sent
+    bytes: int # bytes sent
+    throttled: float # seconds waited for bandwidth
+    delayed: int # chunks which had to wait
+
+    def __init__(self, direction: str, tokens: float) -> None:
+        self.direction = direction
+        self.tokens = tokens
+        self.updated = time.monotonic()
+        self.finish = 0
+        self.bytes = 0
+        self.throttled = 0.0
+        self.delayed = 0
+
+
+class Shaper:
+    """
+    Shares relay bandwidth between sessions. Relay threads ask for permission before sending a chunk
+    and are blocked while their direction is above its rate, so TCP pushes back on the sending client.
+
+    Every session direction has its own token bucket. With egress cap, chunks waiting for it are served
+    by start-time fair queuing: every chunk is tagged with virtual time when its direction would start sending it
+    if the cap was shared equally, and the smallest tag goes first. Unlike round robin over directions, it stays
+    fair when relay thread has only one chunk in flight, so directions sending small chunks get the same
+    amount of bytes as directions sending large ones. Chunks up to `interactive` bytes
+    are game commands rather than bulk data: they are sent immediately and charged afterwards,
+    so bulk chunks of the same and other sessions wait longer instead. Zero rate means unlimited
+    """
+    rate: float # egress cap of the process, bytes per second
+    sessionRate: float # bytes per second of each session direction
+    interactive: int # chunks of this size or less are never delayed
+    tokens: float # bytes allowed by egress cap, negative when sent ahead
+    updated: float # last refill time
+    virtual: float # tag of the last chunk allowed by egress cap
+    waiting: list # heap of (tag, sequence) of chunks waiting for egress cap
+    sequence: int
+    condition: Condition
+
+    def __init__(self) -> None:
+        self.rate = 0
+        self.sessionRate = 0
+        self.interactive = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.virtual = 0
+        self.waiting = []
+        self.sequence = 0
+        self.condition = Condition()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rate or self.sessionRate)
+
+    def flow(self, session, direction: str) -> Flow:
+        flow = session.flows.get(direction)
+        if not flow:
+            flow = session.flows.setdefault(direction, Flow(direction, self.sessionRate * BURST))
+        return flow
+
+    def acquire(self, session, direction: str, size: int):
+        """
+        Blocks until `size` bytes of the session direction can be sent
+        """
+        flow = self.flow(session, direction)
+        started = time.monotonic()
+        if size <= self.interactive:
+            with self.condition:
+                self.charge(flow, size)
+                self.refill(started)
+                self.tokens -= size
+                flow.finish = max(flow.finish, self.virtual) + size
+            flow.bytes += size
+            return
+
+        with self.condition:
+            wait = self.charge(flow, size)
+        if wait > 0:
+            time.sleep(wait)
+
+        if self.rate:
+            self.schedule(flow, size)
+
+        waited = time.monotonic() - started
+        flow.bytes += size
+        if waited > 0.001:
+            flow.throttled += waited
+            flow.delayed += 1
+            METRICS.count("relay_throttle_seconds", direction, waited)
+
+    def charge(self, flow: Flow, size: int) -> float:
+        # takes bytes from session bucket, returns seconds to wait until the debt is paid; lock must be held
+        if not self.sessionRate:
+            return 0
+        now = time.monotonic()
+        flow.tokens = min(self.sessionRate * BURST, flow.tokens + (now - flow.updated) * self.sessionRate)
+        flow.updated = now
+        flow.tokens -= size
+        return -flow.tokens / self.sessionRate if flow.tokens < 0 else 0
+
+    def refill(self, now: float):
+        # lock must be held
+        self.tokens = min(self.rate * BURST, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def schedule(self, flow: Flow, size: int):
+        # start-time fair queuing of chunks waiting for egress cap
+        with self.condition:
+            tag = max(flow.finish, self.virtual)
+            flow.finish = tag + size
+            self.sequence += 1
+            entry = (tag, self.sequence)
+            heapq.heappush(self.waiting, entry)
+
+            while True:
+                self.refill(time.monotonic())
+                if self.waiting[0] != entry:
+                    self.condition.wait()
+                elif self.tokens < 0:
+                    self.condition.wait(-self.tokens / self.rate)
+                else:
+                    break
+
+            heapq.heappop(self.waiting)
+            self.virtual = tag
+            self.tokens -= size
+            self.condition.notify_all()
+
+    def summary(self, session) -> list:
+        """
+        Lines with sent bytes and throttling of each direction of the session
+        """
+        return [f"{flow.direction}: {flow.bytes // 1024} KB, throttled {flow.throttled:.1f} s in {flow.delayed} chunks"
+            for flow in list(session.flows.values())]
+
+SHAPER = Shaper()
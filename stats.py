@@ -0,0 +1,19 @@
+STATS = {
+    "uniques" : set(), #address
+    "users" : set(), #usernames
+    "logins" : 0, #sockets
+    "clients" : 0, #vcmi clients
+    "rooms" : 0, #created rooms
+    "sessions" : 0, #started sessions
+    "connections" : 0, #successful connections
+    "pending_memory" : 0, #bytes waiting for opposite pipe in memory
+    "pending_disk" : 0, #bytes waiting for opposite pipe in temporary files
+    "deadlines" : 0, #scheduled session deadlines
+    "slow_clients" : 0, #lobby clients disconnected because of not reading messages
+    "actor_queue" : 0, #lobby commands waiting to be executed
+    "actor_commands" : 0, #executed lobby commands
+    "actor_latency" : 0.0, #average milliseconds lobby command waits in the queue
+    "actor_latency_max" : 0.0, #maximal milliseconds lobby command waited in the queue
+    "rejected" : 0, #connections rejected by admission control
+    "reaped" : 0 #connections closed by health check or handshake timeout
+}
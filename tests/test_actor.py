@@ -0,0 +1,29 @@
+import threading
+import unittest
+from actor import Actor
+
+
+class ActorTest(unittest.TestCase):
+    def test_commands_run_in_order_on_one_thread(self):
+        actor = Actor()
+        executed = []
+        futures = [actor.submit(lambda i=i: executed.append((i, threading.get_ident()))) for i in range(100)]
+        for future in futures:
+            future.result(5)
+        self.assertEqual([i for i, _ in executed], list(range(100)))
+        self.assertEqual({thread for _, thread in executed}, {actor.thread.ident})
+
+    def test_call_returns_result_and_raises_error(self):
+        actor = Actor()
+        self.assertEqual(actor.call(lambda x: x * 2, 21), 42)
+        with self.assertRaises(ValueError):
+            actor.call(int, "not a number")
+        self.assertEqual(actor.call(lambda: "still running"), "still running")
+
+    def test_nested_call_runs_immediately(self):
+        actor = Actor()
+        self.assertEqual(actor.call(lambda: actor.call(lambda: "inner")), "inner")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import socket
+import struct
+import unittest
+import buffers
+from buffers import BufferPool, FrameReader, PipeReader
+
+
+class BufferPoolTest(unittest.TestCase):
+    def test_released_buffer_is_reused(self):
+        pool = BufferPool()
+        buffer = pool.acquire(1024)
+        pool.release(buffer)
+        self.assertIs(pool.acquire(1024), buffer)
+        self.assertIsNot(pool.acquire(1024), buffer)
+
+    def test_buffers_are_grouped_by_size(self):
+        pool = BufferPool()
+        pool.release(bytearray(1024))
+        self.assertEqual(len(pool.acquire(2048)), 2048)
+        self.assertEqual(len(pool.free[1024]), 1)
+
+    def test_free_buffers_are_capped(self):
+        pool = BufferPool(limit=4096)
+        for _ in range(10):
+            pool.release(bytearray(1024))
+        pool.release(bytearray(8192))
+        self.assertEqual(len(pool.free[1024]), 4)
+        self.assertEqual(len(pool.free[8192]), 0)
+
+
+class PipeReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_full_reads_grow_chunk(self):
+        reader = PipeReader()
+        while len(reader.buffer) < buffers.MAX_CHUNK_SIZE:
+            size = len(reader.buffer)
+            reader.adapt(size)
+            self.assertEqual(reader.nextSize, size * 2)
+            reader.resize(reader.nextSize)
+        reader.adapt(buffers.MAX_CHUNK_SIZE)
+        self.assertEqual(reader.nextSize, buffers.MAX_CHUNK_SIZE)
+        reader.release()
+
+    def test_small_reads_shrink_chunk(self):
+        reader = PipeReader()
+        reader.resize(buffers.MAX_CHUNK_SIZE)
+        reader.nextSize = buffers.MAX_CHUNK_SIZE
+        for _ in range(buffers.SHRINK_AFTER - 1):
+            reader.adapt(10)
+        self.assertEqual(reader.nextSize, buffers.MAX_CHUNK_SIZE)
+        reader.adapt(10)
+        self.assertEqual(reader.nextSize, buffers.MAX_CHUNK_SIZE // 2)
+        reader.release()
+
+    def test_receive_returns_received_data(self):
+        reader = PipeReader()
+        self.a.sendall(b"hello")
+        self.assertEqual(bytes(reader.receive(self.b)), b"hello")
+        self.a.close()
+        self.assertEqual(len(reader.receive(self.b)), 0)
+        reader.release()
+
+
+def frame(data: bytes) -> bytes:
+    return struct.pack('<I', len(data)) + data
+
+
+class FrameReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_many_frames_from_one_read(self):
+        reader = FrameReader()
+        self.a.sendall(frame(b"one") + frame(b"") + frame(b"three"))
+        self.assertEqual(bytes(reader.next(self.b)), b"one")
+        self.assertEqual(bytes(reader.next(self.b)), b"")
+        self.assertEqual(bytes(reader.next(self.b)), b"three")
+        self.assertEqual(reader.pending(), 0)
+
+    def test_frame_bigger_than_buffer(self):
+        reader = FrameReader()
+        data = bytes(range(256)) * 40
+        self.a.sendall(frame(data) + frame(b"next"))
+        self.assertEqual(bytes(reader.next(self.b)), data)
+        self.assertEqual(bytes(reader.next(self.b)), b"next")
+
+    def test_incomplete_tail_is_kept(self):
+        reader = FrameReader()
+        message = frame(b"x" * (buffers.FRAME_BUFFER_SIZE - 10)) + frame(b"tail data")
+        split = buffers.FRAME_BUFFER_SIZE - 2
+        self.a.sendall(message[:split])
+        reader.fill(self.b, split)
+        self.assertEqual(len(reader.next(self.b)), buffers.FRAME_BUFFER_SIZE - 10)
+        self.a.sendall(message[split:])
+        self.assertEqual(bytes(reader.next(self.b)), b"tail data")
+
+    def test_eof_and_oversized_frame(self):
+        reader = FrameReader()
+        self.a.sendall(struct.pack('<I', buffers.MAX_FRAME_SIZE + 1))
+        self.assertIsNone(reader.next(self.b))
+        self.a.close()
+        self.assertIsNone(FrameReader().next(self.b))
+
+    def test_fed_data_and_leftover(self):
+        reader = FrameReader()
+        reader.feed(frame(b"fed") + b"raw")
+        self.assertEqual(bytes(reader.next(self.b)), b"fed")
+        self.assertEqual(reader.leftover(), b"raw")
+        self.assertEqual(reader.pending(), 0)
+
+    def test_read_exact_size(self):
+        reader = FrameReader()
+        self.a.sendall(b"abcdef")
+        self.assertEqual(reader.read(self.b, 4), b"abcd")
+        self.assertEqual(reader.read(self.b, 2), b"ef")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import json
+import socket
+import threading
+import unittest
+from concurrent.futures import Future, wait
+import cluster
+from cluster import Cluster, LocalBackend, RemoteBackend
+from lobby import Lobby
+from test_lobby import RecordingOutbox, connect, received
+
+
+class DelayedBackend(LocalBackend):
+    # claims are answered by the test
+    def __init__(self) -> None:
+        super().__init__()
+        self.claims = []
+
+    def claim(self, table: str, key: str, value) -> Future:
+        future = Future()
+        self.claims.append(future)
+        return future
+
+
+class LocalBackendTest(unittest.TestCase):
+    def test_claim_and_events(self):
+        backend = LocalBackend()
+        events = []
+        backend.subscribe(events.append)
+        self.assertTrue(backend.claim("users", "alice", {"node": "a"}).result())
+        self.assertFalse(backend.claim("users", "alice", {"node": "b"}).result())
+        backend.delete("users", "alice")
+        backend.delete("users", "alice")
+        self.assertEqual([event["op"] for event in events], ["set", "delete"])
+        self.assertEqual(backend.items("users"), {})
+
+
+class RemoteBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.timeout = cluster.REQUEST_TIMEOUT
+        cluster.REQUEST_TIMEOUT = 0.3
+        self.hub = socket.create_server(("127.0.0.1", 0))
+        self.connections = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def tearDown(self):
+        cluster.REQUEST_TIMEOUT = self.timeout
+        self.hub.close()
+        for conn in self.connections:
+            conn.close()
+
+    def serve(self):
+        # hub sends its state and never answers requests
+        conn, _ = self.hub.accept()
+        self.connections.append(conn)
+        conn.sendall((json.dumps({"event": {"op": "snapshot", "tables": {}}}) + "\n").encode())
+
+    def test_unanswered_request_fails(self):
+        backend = RemoteBackend(f"127.0.0.1:{self.hub.getsockname()[1]}")
+        claim = backend.claim("users", "alice", {"node": "a"})
+        wait([claim], 2)
+        self.assertTrue(claim.done())
+        self.assertIsInstance(claim.exception(), TimeoutError)
+        self.assertEqual(backend.pending, {})
+        self.assertEqual(backend.scheduler.pending(), 0)
+
+
+class ClusterTest(unittest.TestCase):
+    def test_rooms_are_synchronized(self):
+        backend = LocalBackend()
+        first = Cluster("a:1", backend)
+        second = Cluster("b:1", backend)
+        self.assertTrue(first.claimRoom("room1").result())
+        first.roomCreated("room1")
+        self.assertFalse(second.claimRoom("room1").result())
+        self.assertEqual(second.roomOwner("room1"), "a:1")
+
+        self.assertEqual(first.syncRooms({"room1": "1:2:False"}), {"room1": "1:2:False"})
+        self.assertEqual(second.syncRooms({"room2": "1:4:True"}), {"room1": "1:2:False", "room2": "1:4:True"})
+        self.assertEqual(first.syncRooms({}), {"room2": "1:4:True"})
+        self.assertIsNone(second.roomOwner("room1"))
+
+    def test_entries_are_restored(self):
+        backend = LocalBackend()
+        cluster = Cluster("a:1", backend)
+        cluster.syncRooms({"room1": "1:2:False"})
+        backend.tables = {}
+        cluster.restore(["alice"], [])
+        self.assertEqual(cluster.users(), ["alice"])
+        self.assertEqual(cluster.syncRooms({"room1": "1:2:False"}), {"room1": "1:2:False"})
+
+
+class PostponedCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.lobby = Lobby()
+        self.lobby.outboxType = RecordingOutbox
+        self.backend = DelayedBackend()
+        self.lobby.joinCluster(Cluster("a:1", self.backend))
+        self.sender = connect(self.lobby, "alice", 5)
+
+    def dispatch(self, message: bytes) -> Future:
+        return self.lobby.actor.call(self.lobby.dispatch, self.sender, message)
+
+    def test_messages_wait_for_cluster_answer(self):
+        settled = self.dispatch(b"<NEW>room1<COUNT>3")
+        self.assertIsNone(self.dispatch(b"<PSWD>secret"))
+        self.assertEqual(self.lobby.actor.call(lambda: dict(self.lobby.rooms)), {})
+
+        self.backend.claims[0].set_result(True)
+        settled.result(5)
+        room = self.lobby.actor.call(lambda: self.lobby.rooms["room1"])
+        self.assertEqual(room.total, 3)
+        self.assertTrue(room.protected)
+
+    def test_refused_claim(self):
+        settled = self.dispatch(b"<NEW>room1<COUNT>3")
+        self.backend.claims[0].set_result(False)
+        settled.result(5)
+        self.assertEqual(self.lobby.rooms, {})
+        self.assertEqual(received(self.sender), [":>>ERROR:Cannot create session with name room1, session with this name already exists"])
+
+    def test_failed_cluster_request(self):
+        settled = self.dispatch(b"<NEW>room1")
+        self.backend.claims[0].set_exception(ConnectionError("Cluster hub is not connected"))
+        settled.result(5)
+        self.assertEqual(self.lobby.rooms, {})
+        self.assertEqual(received(self.sender), [":>>ERROR:Server is temporarily unavailable, try again later"])
+        self.assertIsNone(self.sender.postponed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+import journal
+from journal import Journal
+from session import Session
+
+
+def make_session(number: int) -> Session:
+    session = Session()
+    session.name = f"room{number}"
+    session.host_uuid = f"host-{number}"
+    session.clients_uuid = [f"client-{number}"]
+    return session
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "sessions.journal")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def lines(self) -> int:
+        with open(self.path) as f:
+            return len(f.readlines())
+
+    def test_live_sessions_are_restored(self):
+        first = Journal(self.path)
+        self.assertEqual(first.load(), [])
+        for number in range(3):
+            first.add(make_session(number))
+        first.remove(make_session(1))
+        first.file.close()
+
+        restored = Journal(self.path).load()
+        self.assertEqual([s.host_uuid for s in restored], ["host-0", "host-2"])
+        self.assertEqual(restored[1].name, "room2")
+        self.assertEqual(restored[1].clients_uuid, ["client-2"])
+
+    def test_interrupted_record_is_skipped(self):
+        first = Journal(self.path)
+        first.load()
+        first.add(make_session(0))
+        first.file.write('{"op": "add", "name": "bro')
+        first.file.close()
+
+        self.assertEqual([s.host_uuid for s in Journal(self.path).load()], ["host-0"])
+
+    def test_load_compacts_file(self):
+        first = Journal(self.path)
+        first.load()
+        first.add(make_session(0))
+        first.add(make_session(1))
+        first.remove(make_session(0))
+        first.file.close()
+        self.assertEqual(self.lines(), 3)
+
+        second = Journal(self.path)
+        second.load()
+        second.file.close()
+        self.assertEqual(self.lines(), 1)
+
+    def test_removed_sessions_trigger_compaction(self):
+        minimum = journal.COMPACT_MIN
+        journal.COMPACT_MIN = 10
+        try:
+            log = Journal(self.path)
+            log.load()
+            log.add(make_session(0))
+            for number in range(1, 8):
+                log.add(make_session(number))
+                log.remove(make_session(number))
+            self.assertLessEqual(log.records, journal.COMPACT_MIN)
+            self.assertEqual(self.lines(), log.records)
+            log.file.close()
+        finally:
+            journal.COMPACT_MIN = minimum
+        self.assertEqual([s.host_uuid for s in Journal(self.path).load()], ["host-0"])
+
+    def test_removing_unknown_session_writes_nothing(self):
+        log = Journal(self.path)
+        log.load()
+        log.remove(make_session(0))
+        log.file.close()
+        self.assertEqual(self.lines(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
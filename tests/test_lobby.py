@@ -0,0 +1,145 @@
+import socket
+import unittest
+from client import ClientLobby
+from lobby import Lobby, tokenize
+from room import Room
+from sender import Sender
+
+
+class RecordingOutbox:
+    # outbox of lobby client which keeps messages instead of writing them
+    def __init__(self, sock: socket, flusher) -> None:
+        self.messages = []
+
+    def put(self, data: bytes) -> bool:
+        self.messages.append(data.decode())
+        return True
+
+
+def connect(lobby: Lobby, username: str, protocol: int, sock: socket = None) -> Sender:
+    sender = Sender(sock)
+    sender.address = ("127.0.0.1", len(lobby.senders))
+    sender.client = ClientLobby()
+    sender.client.protocolVersion = protocol
+    sender.client.username = username
+    sender.client.auth = True
+    lobby.senders[sender] = None
+    lobby.usernames[username] = sender
+    lobby.channels[sender.client.channel].append(sender)
+    return sender
+
+
+def received(sender: Sender) -> list:
+    messages = sender.outbox.messages if sender.outbox else []
+    sender.outbox = None
+    return messages
+
+
+class RoomDeltasTest(unittest.TestCase):
+    def setUp(self):
+        self.lobby = Lobby()
+        self.lobby.outboxType = RecordingOutbox
+        self.old = connect(self.lobby, "old", 5)
+        self.new = connect(self.lobby, "new", 6)
+
+    def test_new_room_is_added(self):
+        self.lobby.rooms["room1"] = Room(self.old, "room1")
+        self.lobby.flushRooms()
+        self.assertEqual(received(self.old), [":>>SESSIONS:1:room1:1:1:False"])
+        self.assertEqual(received(self.new), [":>>ROOMADD:room1:1:1:False"])
+
+    def test_changes_are_sent_as_updates_and_removals(self):
+        self.lobby.rooms["room1"] = Room(self.old, "room1")
+        self.lobby.rooms["room2"] = Room(self.new, "room2")
+        self.lobby.flushRooms()
+        received(self.old)
+        received(self.new)
+
+        self.lobby.rooms["room1"].total = 4
+        self.lobby.rooms.pop("room2")
+        self.lobby.flushRooms()
+        self.assertEqual(received(self.old), [":>>SESSIONS:1:room1:1:4:False"])
+        self.assertEqual(received(self.new), [":>>ROOMUPDATE:room1:1:4:False:>>ROOMREMOVE:room2"])
+
+    def test_nothing_is_sent_without_changes(self):
+        self.lobby.rooms["room1"] = Room(self.old, "room1")
+        self.lobby.flushRooms()
+        received(self.old)
+        received(self.new)
+        self.lobby.flushRooms()
+        self.assertEqual(received(self.old), [])
+        self.assertEqual(received(self.new), [])
+
+    def test_started_room_is_removed(self):
+        self.lobby.rooms["room1"] = Room(self.old, "room1")
+        self.lobby.flushRooms()
+        received(self.new)
+        self.lobby.rooms["room1"].started = True
+        self.lobby.flushRooms()
+        self.assertEqual(received(self.new), [":>>ROOMREMOVE:room1"])
+
+    def test_new_client_receives_last_full_list(self):
+        self.lobby.rooms["room1"] = Room(self.old, "room1")
+        self.lobby.flushRooms()
+        late = connect(self.lobby, "late", 6)
+        self.lobby.sendRooms(late)
+        self.assertEqual(received(late), [":>>SESSIONS:1:room1:1:1:False"])
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_tags_and_values(self):
+        self.assertEqual(tokenize("<NEW>room1<COUNT>2"), [("NEW", "room1"), ("COUNT", "2")])
+        self.assertEqual(tokenize("<READY>"), [("READY", "")])
+
+    def test_text_before_first_tag_is_ignored(self):
+        self.assertEqual(tokenize("garbage<MSG>hi"), [("MSG", "hi")])
+
+    def test_malformed_message(self):
+        self.assertEqual(tokenize("no tags"), [(None, "no tags")])
+        self.assertEqual(tokenize("<MSG>hi<BROKEN"), [("MSG", "hi"), (None, "<BROKEN")])
+        self.assertEqual(tokenize("<MSG>a<>b<C>d"), [("MSG", "a"), (None, "<>b<C>d")])
+
+
+class DispatchTest(unittest.TestCase):
+    def setUp(self):
+        self.lobby = Lobby()
+        self.lobby.outboxType = RecordingOutbox
+        self.sock, self.peer = socket.socketpair()
+        self.sender = connect(self.lobby, "alice", 5, self.sock)
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def test_commands_of_message_are_executed_in_order(self):
+        self.lobby.dispatch(self.sender, b"<NEW>room1<COUNT>3<PSWD>secret")
+        room = self.lobby.rooms["room1"]
+        self.assertEqual(room.total, 3)
+        self.assertTrue(room.protected)
+
+    def test_refused_command_skips_rest_of_message(self):
+        self.lobby.dispatch(self.sender, b"<NEW>ab<COUNT>3")
+        self.assertEqual(self.lobby.rooms, {})
+        self.assertEqual(received(self.sender), [":>>ERROR:Cannot create session with invalid name ab"])
+
+    def test_unknown_tags_are_skipped(self):
+        self.lobby.dispatch(self.sender, b"<UNKNOWN>x<NEW>room1")
+        self.assertIn("room1", self.lobby.rooms)
+
+    def test_protocol_and_authorization_are_checked(self):
+        self.sender.client.protocolVersion = 4
+        self.lobby.dispatch(self.sender, b"<CHANNEL>room")
+        self.assertEqual(self.sender.client.channel, "global")
+
+        self.sender.client.auth = False
+        self.lobby.dispatch(self.sender, b"<NEW>room1")
+        self.assertEqual(self.lobby.rooms, {})
+
+    def test_failed_command_closes_connection(self):
+        self.lobby.dispatch(self.sender, b"<NEW>room1<COUNT>many")
+        self.peer.settimeout(1)
+        self.assertEqual(self.peer.recv(1), b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
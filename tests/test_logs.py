@@ -0,0 +1,49 @@
+import logging
+import os
+import tempfile
+import unittest
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+from logs import file_handler
+
+
+class FileHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "proxy.log")
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            handler.close()
+        self.directory.cleanup()
+
+    def handler(self, rotate: str) -> logging.Handler:
+        handler = file_handler(self.path, rotate, 3)
+        self.handlers.append(handler)
+        return handler
+
+    def test_size_suffixes(self):
+        self.assertEqual(self.handler("10K").maxBytes, 10 * 1024)
+        self.assertEqual(self.handler("30M").maxBytes, 30 * 1024 * 1024)
+        self.assertEqual(self.handler("1G").maxBytes, 1024 * 1024 * 1024)
+        self.assertEqual(self.handler("1000").maxBytes, 1000)
+        self.assertEqual(self.handler("10K").backupCount, 3)
+
+    def test_time_suffixes(self):
+        handler = self.handler("30m")
+        self.assertIsInstance(handler, TimedRotatingFileHandler)
+        self.assertEqual(handler.when, "M")
+        self.assertEqual(handler.interval, 30 * 60)
+        self.assertEqual(self.handler("12h").interval, 12 * 60 * 60)
+        self.assertEqual(self.handler("2d").interval, 2 * 24 * 60 * 60)
+        self.assertEqual(self.handler("midnight").when, "MIDNIGHT")
+
+    def test_rotation_is_disabled(self):
+        for rotate in ["", "0", None]:
+            handler = self.handler(rotate)
+            self.assertNotIsInstance(handler, (RotatingFileHandler, TimedRotatingFileHandler))
+            self.assertIsInstance(handler, logging.FileHandler)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import socket
+import unittest
+import outbox
+from outbox import Outbox
+
+
+class RecordingFlusher:
+    # stands for flusher thread, remembers watched outboxes
+    def __init__(self) -> None:
+        self.watched = []
+
+    def watch(self, box: Outbox):
+        self.watched.append(box)
+
+    def forget(self, box: Outbox):
+        self.watched.remove(box)
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+        self.a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        self.b.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.flusher = RecordingFlusher()
+        self.box = Outbox(self.a, self.flusher)
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def fill(self) -> int:
+        # puts messages until socket stops accepting them, returns amount of bytes put
+        total = 0
+        while not self.box.queue:
+            self.assertTrue(self.box.put(b"x" * 1024))
+            total += 1024
+        return total
+
+    def receive(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            data += self.b.recv(size - len(data))
+        return data
+
+    def test_message_is_written_immediately(self):
+        self.assertTrue(self.box.put(b"hello"))
+        self.assertEqual(self.box.size, 0)
+        self.assertEqual(self.flusher.watched, [])
+        self.assertEqual(self.receive(5), b"hello")
+
+    def test_rest_is_queued_for_flusher(self):
+        total = self.fill()
+        self.assertGreater(self.box.size, 0)
+        self.assertEqual(self.flusher.watched, [self.box])
+
+        received = self.receive(total - self.box.size)
+        while not self.box.flush():
+            received += self.b.recv(65536)
+        received += self.receive(total - len(received))
+        self.assertEqual(received, b"x" * total)
+        self.assertFalse(self.box.watched)
+
+    def test_high_water_mark(self):
+        self.fill()
+        left = outbox.HIGH_WATER_MARK - self.box.size
+        self.assertTrue(self.box.put(b"y" * left))
+        self.assertFalse(self.box.put(b"z"))
+
+    def test_close_after_flush(self):
+        self.fill()
+        self.box.closeAfterFlush()
+        self.assertFalse(self.box.closed)
+        self.assertTrue(self.box.put(b"ignored"))
+        self.box.discard()
+        self.assertTrue(self.box.closed)
+        self.assertEqual(self.box.size, 0)
+        self.assertEqual(self.flusher.watched, [])
+
+    def test_close_when_empty(self):
+        self.box.closeAfterFlush()
+        self.assertTrue(self.box.closed)
+        self.assertEqual(self.a.fileno(), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import socket
+import unittest
+import pending
+from pending import PendingBuffer
+from stats import STATS
+
+
+def receive(sock: socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        data += sock.recv(size - len(data))
+    return data
+
+
+class PendingBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.limit = pending.MEMORY_LIMIT
+        pending.MEMORY_LIMIT = 16
+        self.memory = STATS["pending_memory"]
+        self.disk = STATS["pending_disk"]
+
+    def tearDown(self):
+        pending.MEMORY_LIMIT = self.limit
+
+    def test_small_data_stays_in_memory(self):
+        buffer = PendingBuffer([b"abc", b"def"])
+        self.assertEqual(len(buffer), 6)
+        self.assertEqual(buffer.memory, 6)
+        self.assertIsNone(buffer.file)
+        self.assertEqual(STATS["pending_memory"] - self.memory, 6)
+        buffer.clear()
+
+    def test_spilled_data_keeps_order(self):
+        buffer = PendingBuffer()
+        chunks = [b"0123456789", b"abcdefghij", b"small", b"ABCDEFGHIJKLMNOP"]
+        for chunk in chunks:
+            self.assertTrue(buffer.append(chunk))
+        self.assertEqual(buffer.memory, 10)
+        self.assertEqual(buffer.disk, 31)
+        self.assertEqual(STATS["pending_disk"] - self.disk, 31)
+        self.assertEqual(b"".join(buffer.iterate()), b"".join(chunks))
+        buffer.clear()
+
+    def test_drain_sends_everything_and_closes(self):
+        buffer = PendingBuffer([b"x" * 10, b"y" * 20])
+        a, b = socket.socketpair()
+        try:
+            buffer.drain(a)
+            self.assertEqual(receive(b, 30), b"x" * 10 + b"y" * 20)
+        finally:
+            a.close()
+            b.close()
+        self.assertTrue(buffer.closed)
+        self.assertEqual(len(buffer), 0)
+        self.assertFalse(buffer.append(b"late"))
+
+    def test_clear_releases_statistics(self):
+        buffer = PendingBuffer([b"x" * 10, b"y" * 20])
+        buffer.clear()
+        self.assertEqual(STATS["pending_memory"], self.memory)
+        self.assertEqual(STATS["pending_disk"], self.disk)
+        self.assertFalse(buffer.append(b"late"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import socket
+import threading
+import time
+import unittest
+from relay import SpliceRelay, SPLICE_SUPPORTED
+from session import Session
+
+
+@unittest.skipUnless(SPLICE_SUPPORTED, "os.splice is not available")
+class SpliceRelayTest(unittest.TestCase):
+    def setUp(self):
+        self.server, self.serverPeer = socket.socketpair()
+        self.client, self.clientPeer = socket.socketpair()
+        self.session = Session()
+        self.session.addConnection(self.server, True, [])
+        self.session.addConnection(self.client, False, [])
+        self.relay = SpliceRelay()
+
+    def tearDown(self):
+        self.relay.close()
+        for sock in [self.server, self.serverPeer, self.client, self.clientPeer]:
+            sock.close()
+
+    def test_data_is_moved_to_opposite_socket(self):
+        self.serverPeer.sendall(b"turn data")
+        self.assertEqual(self.relay.forward(self.session, self.server), 9)
+        self.clientPeer.settimeout(1)
+        self.assertEqual(self.clientPeer.recv(100), b"turn data")
+
+    def test_data_is_kept_when_opposite_is_removed(self):
+        self.serverPeer.sendall(b"turn data")
+        self.session.removeConnection(self.client)
+        self.client.close()
+        self.assertEqual(self.relay.forward(self.session, self.server), 9)
+        self.assertEqual(b"".join(self.session.pipeMessages(self.server).iterate()), b"turn data")
+
+    def test_closed_descriptor_is_not_reused_by_relay(self):
+        self.serverPeer.sendall(b"turn data")
+        os.splice(self.server.fileno(), self.relay.pipe_w, 9)
+        guard = self.session.guards[self.client]
+        results = []
+        with guard:
+            # relay waits for the guard while lobby actor closes opposite connection
+            thread = threading.Thread(target=lambda: results.append(self.relay.send(self.session, self.server, 9)))
+            thread.start()
+            time.sleep(0.1)
+            self.session.removeConnection(self.client)
+            self.client.close()
+            reused, peer = socket.socketpair()
+        thread.join(5)
+        try:
+            self.assertEqual(results, [9])
+            peer.setblocking(False)
+            self.assertRaises(BlockingIOError, peer.recv, 100)
+        finally:
+            reused.close()
+            peer.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import scheduler
+from scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def advance(self, wheel: Scheduler, ticks: int) -> list:
+        # ticks the wheel without its thread, returns keys of expired deadlines
+        expired = []
+        for _ in range(ticks):
+            for _target, callback, args in wheel.advance():
+                expired.append(callback(*args))
+        return expired
+
+    def test_deadline_expires_in_time(self):
+        wheel = Scheduler()
+        wheel.schedule("a", 0.5, lambda: "a")
+        self.assertEqual(self.advance(wheel, 4), [])
+        self.assertEqual(self.advance(wheel, 1), ["a"])
+        self.assertEqual(wheel.pending(), 0)
+
+    def test_short_delay_waits_one_tick(self):
+        wheel = Scheduler()
+        wheel.schedule("a", 0, lambda: "a")
+        self.assertEqual(self.advance(wheel, 1), ["a"])
+
+    def test_reschedule_replaces_deadline(self):
+        wheel = Scheduler()
+        wheel.schedule("a", 0.2, lambda: "first")
+        wheel.schedule("a", 0.5, lambda: "second")
+        self.assertEqual(wheel.pending(), 1)
+        self.assertEqual(self.advance(wheel, 5), ["second"])
+
+    def test_cancel(self):
+        wheel = Scheduler()
+        wheel.schedule("a", 0.2, lambda: "a")
+        wheel.cancel("a")
+        wheel.cancel("unknown")
+        self.assertEqual(wheel.pending(), 0)
+        self.assertEqual(self.advance(wheel, 3), [])
+
+    def test_deadline_beyond_one_turn(self):
+        wheel = Scheduler()
+        ticks = scheduler.WHEEL_SIZE + 3
+        wheel.schedule("a", ticks * scheduler.TICK, lambda: "a")
+        self.assertEqual(self.advance(wheel, ticks - 1), [])
+        self.assertEqual(self.advance(wheel, 1), ["a"])
+
+    def test_arguments_are_passed(self):
+        wheel = Scheduler()
+        wheel.schedule(("session", 1), 0.1, lambda x, y: x + y, 2, 3)
+        self.assertEqual(self.advance(wheel, 1), [5])
+
+
+if __name__ == "__main__":
+    unittest.main()
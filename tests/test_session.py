@@ -0,0 +1,59 @@
+import socket
+import unittest
+import pending
+from session import Session
+from test_pending import receive
+
+
+class SessionPendingTest(unittest.TestCase):
+    def setUp(self):
+        self.limit = pending.MEMORY_LIMIT
+        pending.MEMORY_LIMIT = 16
+        self.session = Session()
+        self.sockets = []
+
+    def tearDown(self):
+        pending.MEMORY_LIMIT = self.limit
+        for sock in self.sockets:
+            sock.close()
+
+    def pipe(self) -> tuple:
+        sock, peer = socket.socketpair()
+        peer.settimeout(1)
+        self.sockets += [sock, peer]
+        return sock, peer
+
+    def waitForPeer(self, sock: socket, isServer: bool, data: list):
+        # pipe is connected, data is stored until opposite one is connected
+        self.session.addConnection(sock, isServer, [b"<" + str(isServer).encode() + b">"])
+        for chunk in data:
+            self.assertTrue(self.session.pipeMessages(sock).append(chunk))
+
+    def test_spilled_data_of_waiting_server_is_delivered(self):
+        server, _ = self.pipe()
+        client, clientPeer = self.pipe()
+        data = [bytes([i]) * 10 for i in range(5)]
+        self.waitForPeer(server, True, data)
+        self.assertIsNotNone(self.session.pipeMessages(server).file)
+
+        self.session.addConnection(client, False, [b"hello", b"!"])
+        self.session.pipeMessages(server).drain(client)
+        self.assertEqual(receive(clientPeer, 56), b"hello!" + b"".join(data))
+
+    def test_data_of_waiting_client_is_delivered_to_next_server(self):
+        server, serverPeer = self.pipe()
+        client, _ = self.pipe()
+        self.session.addConnection(server, True, [])
+        self.session.addConnection(client, False, [])
+        self.session.removeConnection(server)
+        data = [bytes([i]) * 10 for i in range(5)]
+        for chunk in data:
+            self.assertTrue(self.session.pipeMessages(client).append(chunk))
+
+        self.session.addConnection(server, True, [b"hello"])
+        self.session.pipeMessages(client).drain(server)
+        self.assertEqual(receive(serverPeer, 55), b"hello" + b"".join(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import threading
+import time
+import unittest
+import shaping
+from shaping import Shaper
+
+
+class FakeSession:
+    # only flows of session are used by the shaper
+    def __init__(self) -> None:
+        self.flows = {}
+
+
+class ShaperTest(unittest.TestCase):
+    def test_disabled_shaper_only_counts(self):
+        shaper = Shaper()
+        self.assertFalse(shaper.enabled)
+        session = FakeSession()
+        started = time.monotonic()
+        shaper.acquire(session, "from_server", 10 * 1024 * 1024)
+        self.assertLess(time.monotonic() - started, 0.05)
+        self.assertEqual(session.flows["from_server"].bytes, 10 * 1024 * 1024)
+
+    def test_session_rate_delays_sender(self):
+        shaper = Shaper()
+        shaper.sessionRate = 100 * 1024
+        session = FakeSession()
+        started = time.monotonic()
+        shaper.acquire(session, "from_server", int(shaper.sessionRate * shaping.BURST) + 20 * 1024)
+        waited = time.monotonic() - started
+        self.assertGreater(waited, 0.15)
+        self.assertLess(waited, 0.5)
+        flow = session.flows["from_server"]
+        self.assertEqual(flow.delayed, 1)
+        self.assertIn("from_server: 30 KB, throttled 0.2 s in 1 chunks", shaper.summary(session))
+
+    def test_interactive_chunks_are_not_delayed(self):
+        shaper = Shaper()
+        shaper.sessionRate = 10 * 1024
+        shaper.rate = 10 * 1024
+        shaper.interactive = 1024
+        session = FakeSession()
+        started = time.monotonic()
+        for _ in range(20):
+            shaper.acquire(session, "from_client", 1000)
+        self.assertLess(time.monotonic() - started, 0.05)
+        # debt is paid by the next bulk chunk
+        self.assertLess(session.flows["from_client"].tokens, 0)
+
+    def test_egress_is_shared_equally_by_bytes(self):
+        shaper = Shaper()
+        shaper.rate = 4 * 1024 * 1024
+        sessions = [FakeSession(), FakeSession()]
+        deadline = time.monotonic() + 1
+
+        def send(session: FakeSession, size: int):
+            while time.monotonic() < deadline:
+                shaper.acquire(session, "from_server", size)
+
+        threads = [threading.Thread(target=send, args=(session, size)) for session, size in zip(sessions, [4 * 1024, 64 * 1024])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        small, large = [session.flows["from_server"].bytes for session in sessions]
+        self.assertLess(small + large, shaper.rate * 1.5)
+        self.assertGreater(small / large, 0.6)
+        self.assertLess(small / large, 1.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+from collections import deque
+
+ENABLED = False # set by server arguments, sessions created afterwards are traced
+SAMPLES = 1024 # recent chunks kept per relay direction for percentiles
+STALL_THRESHOLD = 0.1 # seconds, sending blocked longer than this is counted as stall
+
+def percentiles(values: list, quantiles: tuple) -> list:
+    if not values:
+        return [0] * len(quantiles)
+    values = sorted(values)
+    return [values[int(q * (len(values) - 1))] for q in quantiles]
+
+
+class RelayTrace:
+    """
+    Timings of one direction of game connection.
+    Totals are kept for the whole session, percentiles are calculated for recent chunks only
+    """
+    direction: str
+    samples: deque # (sent time, latency, sending time, size) of recent chunks
+    bytes: int
+    chunks: int
+    stalls: int # amount of chunks which sending took longer than STALL_THRESHOLD
+    stalled: float # seconds spent in stalled sending
+    started: float # time of the first chunk
+
+    def __init__(self, direction: str) -> None:
+        self.direction = direction
+        self.samples = deque(maxlen=SAMPLES)
+        self.bytes = 0
+        self.chunks = 0
+        self.stalls = 0
+        self.stalled = 0.0
+        self.started = None
+
+    def record(self, received: float, sending: float, sent: float, size: int):
+        """
+        `received` - when data was received, `sending` - when sending was started, `sent` - when it was completed
+        """
+        if self.started == None:
+            self.started = received
+        blocked = sent - sending
+        self.samples.append((sent, sent - received, blocked, size))
+        self.bytes += size
+        self.chunks += 1
+        if blocked > STALL_THRESHOLD:
+            self.stalls += 1
+            self.stalled += blocked
+
+    def rate(self) -> float:
+        # bytes per second for recent chunks
+        if len(self.samples) < 2:
+            return 0.0
+        span = self.samples[-1][0] - self.samples[0][0]
+        if span <= 0:
+            return 0.0
+        return sum(s[3] for s in list(self.samples)[1:]) / span
+
+    def summary(self) -> str:
+        samples = list(self.samples)
+        latency = percentiles([s[1] * 1000 for s in samples], (0.5, 0.95, 0.99))
+        sending = percentiles([s[2] * 1000 for s in samples], (0.5, 0.95, 0.99))
+        sizes = percentiles([s[3] for s in samples], (0.5, 0.95))
+        return (f"{self.direction}: {self.bytes} bytes in {self.chunks} chunks, {self.rate() / 1024:.1f} KB/s, "
+                f"latency p50/p95/p99 {latency[0]:.2f}/{latency[1]:.2f}/{latency[2]:.2f} ms, "
+                f"sending p50/p95/p99 {sending[0]:.2f}/{sending[1]:.2f}/{sending[2]:.2f} ms, "
+                f"chunk p50/p95 {sizes[0]}/{sizes[1]} bytes, stalls {self.stalls} ({self.stalled:.2f} s)")
@@ -0,0 +1,197 @@
+import json
+import logging
+import logs
+import os
+import select
+import socket
+from threading import Condition, Event, Thread
+from workers import MAX_MESSAGE_SIZE, pack_frames, session_header
+
+POLL_INTERVAL = 0.5 # seconds relay threads wait for data before checking if upgrade is started
+PARK_TIMEOUT = 10 # seconds to wait for relay threads to stop, otherwise upgrade is cancelled
+DATA_CHUNK_SIZE = 64 * 1024 # pending data is passed by parts, so every part fits into single message
+MAX_FDS = 16 # sockets passed by single message
+
+def send_message(channel: socket, header: dict, socks: list = []):
+    socket.send_fds(channel, [json.dumps(header).encode()], [s.fileno() for s in socks])
+
+def receive_message(channel: socket):
+    """
+    Returns (header, sockets) of the next message, (None, []) if channel is closed
+    """
+    data, fds, _flags, _addr = socket.recv_fds(channel, MAX_MESSAGE_SIZE, MAX_FDS)
+    if not data:
+        return None, []
+    return json.loads(data.decode()), [socket.socket(fileno=fd) for fd in fds]
+
+
+class Handover:
+    """
+    Live upgrade. Running server listens unix socket, new process connects to it and receives
+    listening socket, sessions and game connections, so games continue without reconnecting.
+    Lobby connections are closed together with old process.
+
+    Relay threads wait for data with timeout to notice upgrade and park before reading socket again.
+    Data received by parked thread is passed to new process together with pending data.
+    If new process doesn't confirm takeover, parked threads continue relaying
+    """
+    path: str # unix socket for upgrade requests
+    frozen: bool # upgrade is started, relay threads must stop reading
+    parked: dict # sender or "accept" -> data received by parked thread and not forwarded yet
+    condition: Condition
+    resumed: Event # parked threads are released if upgrade is cancelled
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.frozen = False
+        self.parked = {}
+        self.condition = Condition()
+        self.resumed = Event()
+
+    def connect(self) -> socket:
+        """
+        Connects to the running server to take its work over. Returns None if there is no running server
+        """
+        channel = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            channel.connect(self.path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            channel.close()
+            return None
+        return channel
+
+    def receiveListener(self, channel: socket) -> socket:
+        header, socks = receive_message(channel)
+        if not header or header["type"] != "listen":
+            raise ConnectionError(f"Running server didn't pass listening socket")
+        return socks[0]
+
+    def start(self, lobby, listener: socket):
+        # listening socket is polled by accepting thread, so it notices upgrade
+        listener.settimeout(POLL_INTERVAL)
+        control = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        if os.path.exists(self.path):
+            os.unlink(self.path) # left by previous process
+        control.bind(self.path)
+        control.listen(1)
+        t = Thread(target=self.serve, args=(control, lobby, listener))
+        t.daemon = True
+        t.start()
+
+    def serve(self, control: socket, lobby, listener: socket):
+        while True:
+            channel, _ = control.accept()
+            try:
+                self.handover(channel, lobby, listener)
+            except Exception as e:
+                logging.error(f"[!] Upgrade is cancelled, continue serving: {e}")
+            self.resume()
+            channel.close()
+
+    def poller(self, sock: socket):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return poller
+
+    def waitReadable(self, sender, poller):
+        # blocks until pipe has data to read, parks if upgrade is started
+        while not (sender.frames and sender.frames.pending()):
+            if self.frozen:
+                self.park(sender, b'')
+            if poller.poll(POLL_INTERVAL * 1000):
+                return
+
+    def accept(self, listener: socket):
+        """
+        Accepts next connection. Returns (None, None) if nothing is accepted in time
+        """
+        try:
+            result = listener.accept()
+        except socket.timeout: # not a subclass of TimeoutError before python 3.10
+            result = (None, None)
+        if self.frozen:
+            self.park("accept", result)
+        return result
+
+    def park(self, key, data):
+        """
+        Stops calling thread until process exits. Returns if upgrade is cancelled
+        """
+        with self.condition:
+            if not self.frozen:
+                return
+            self.parked[key] = data
+            self.condition.notify_all()
+        self.resumed.wait()
+
+    def resume(self):
+        with self.condition:
+            self.frozen = False
+            self.parked.clear()
+            self.resumed.set()
+
+    def handover(self, channel: socket, lobby, listener: socket):
+        logging.warning(f"[!] Upgrade is requested, stopping relays")
+        with self.condition:
+            self.resumed.clear()
+            self.frozen = True
+
+        expected = set(lobby.actor.call(relayed_pipes, lobby))
+        expected.add("accept")
+        with self.condition:
+            if not self.condition.wait_for(lambda: expected.issubset(self.parked.keys()), PARK_TIMEOUT):
+                raise TimeoutError(f"{len(expected - self.parked.keys())} relay threads are busy")
+
+        lobby.actor.call(self.export, channel, lobby, listener)
+        header, _ = receive_message(channel)
+        if not header or header["type"] != "ready":
+            raise ConnectionError(f"New process didn't confirm takeover")
+
+        logging.warning(f"[!] Upgrade is finished, work is taken over by new process")
+        for session in lobby.sessions:
+            if session.capture:
+                session.capture.close()
+        logs.shutdown()
+        os._exit(0)
+
+    def export(self, channel: socket, lobby, listener: socket):
+        # executed by lobby actor, so sessions don't change while being sent
+        send_message(channel, {"type": "listen"}, [listener])
+        client_socket, client_address = self.parked["accept"]
+        if client_socket:
+            send_message(channel, {"type": "accepted", "address": client_address}, [client_socket])
+
+        senders = {sender.sock: sender for sender in self.parked if sender != "accept"}
+        for session in lobby.sessions:
+            send_message(channel, {"type": "session", **session_header(session)})
+            index = 0
+            for gc in session.connections:
+                if gc.server not in senders and gc.client not in senders:
+                    continue
+
+                for conn, isServer in ((gc.server, True), (gc.client, False)):
+                    if conn in senders:
+                        sender = senders[conn]
+                        header = {"type": "pipe", "connection": index, "address": sender.address, "apptype": sender.client.apptype, "uuid": sender.client.uuid}
+                        send_message(channel, header, [conn])
+
+                # data waiting for each side, then data received by parked thread of opposite side
+                for toServer, messages, source in ((True, gc.serverMessages, gc.client), (False, gc.clientMessages, gc.server)):
+                    header = {"type": "data", "session": session.host_uuid, "connection": index, "server": toServer}
+                    for chunk in messages.iterate():
+                        self.sendData(channel, header, chunk)
+                    if source in senders:
+                        self.sendData(channel, header, self.parked[senders[source]])
+                index += 1
+
+        send_message(channel, {"type": "done"})
+
+    def sendData(self, channel: socket, header: dict, data: bytes):
+        for pos in range(0, len(data), DATA_CHUNK_SIZE):
+            header["data"] = pack_frames([data[pos:pos + DATA_CHUNK_SIZE]])[0]
+            send_message(channel, header)
+
+
+def relayed_pipes(lobby) -> list:
+    # executed by lobby actor, senders relaying game connections
+    return [s for s in lobby.senders if s.isPipe() and s.client.auth and s.client.session]
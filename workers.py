@@ -0,0 +1,206 @@
+import base64
+import json
+import logging
+import socket
+from threading import Lock, Thread
+from sender import Sender
+from session import Session
+from lobby import SESSION_EXPIRE
+
+# socket.send_fds and socket.recv_fds are available starting from python 3.9
+FDS_SUPPORTED = hasattr(socket, "send_fds")
+
+MAX_MESSAGE_SIZE = 256 * 1024 # handshake frames are small, session description as well
+
+def send_connection(channel: socket, lock: Lock, sock: socket, header: dict):
+    """
+    Passes connected socket with its description to another process.
+    Local copy of socket is closed, it's owned by receiver from now
+    """
+    data = json.dumps(header).encode()
+    with lock:
+        socket.send_fds(channel, [data], [sock.fileno()])
+    sock.close()
+
+def send_status(channel: socket, lock: Lock, header: dict):
+    """
+    Passes message without socket to another process
+    """
+    with lock:
+        channel.sendall(json.dumps(header).encode())
+
+def receive_connection(channel: socket):
+    """
+    Receives connected socket with its description from another process.
+    Socket is None for messages without it. Returns (None, None) if channel is closed
+    """
+    data, fds, _flags, _addr = socket.recv_fds(channel, MAX_MESSAGE_SIZE, 1)
+    if not data:
+        return None, None
+    sock = socket.socket(fileno=fds[0]) if fds else None
+    return sock, json.loads(data.decode())
+
+def pack_frames(frames: list) -> list:
+    return [base64.b64encode(f).decode() for f in frames]
+
+def unpack_frames(frames: list) -> list:
+    return [base64.b64decode(f) for f in frames]
+
+def session_header(session: Session) -> dict:
+    return {"name": session.name, "host_uuid": session.host_uuid, "clients_uuid": session.clients_uuid}
+
+def pipe_header(sender: Sender) -> dict:
+    return {
+        "type": "pipe",
+        "address": sender.address,
+        "apptype": sender.client.apptype,
+        "uuid": sender.client.uuid,
+        "frames": pack_frames(sender.client.prevmessages),
+        "leftover": pack_frames([sender.takeLeftover()])[0]
+    }
+
+
+class MasterRouter:
+    """
+    Lives in the process owning the lobby.
+    Receives lobby connections accepted by workers and routes
+    authorized pipes to the worker which owns their session
+    """
+    channels: list # unix sockets to the workers
+    locks: list # one lock per channel to keep messages consistent
+    lobby: object
+    next_worker: int # round robin counter for sessions assignment
+    relayed: set # host uuids of sessions which game connections are relayed by workers right now
+
+    def __init__(self, lobby, channels: list, on_lobby) -> None:
+        self.lobby = lobby
+        self.channels = channels
+        self.locks = [Lock() for _ in channels]
+        self.next_worker = 0
+        self.relayed = set()
+        self.on_lobby = on_lobby
+
+    def start(self):
+        for index in range(len(self.channels)):
+            t = Thread(target=self.listen_for_worker, args=(index,))
+            t.daemon = True
+            t.start()
+
+    def listen_for_worker(self, index: int):
+        while True:
+            try:
+                sock, header = receive_connection(self.channels[index])
+                if not header:
+                    logging.critical(f"[!] Worker {index} channel is closed")
+                    return
+
+                if header["type"] == "connections":
+                    self.lobby.actor.submit(self.track, header)
+                    continue
+
+                address = tuple(header["address"])
+                if header["type"] == "lobby":
+                    frames = unpack_frames([header["frames"][0], header["leftover"]])
+                    self.on_lobby(sock, address, frames[0], frames[1])
+                if header["type"] == "pipe":
+                    self.route(sock, header)
+
+            except Exception as e:
+                logging.error(f"[!] Cannot receive connection from worker {index}: {e}")
+
+    def route(self, sock: socket, header: dict):
+        worker = self.lobby.actor.call(self.assign, header)
+        if worker == None:
+            logging.warning(f"[!] No session for pipe {header['address']} {header['uuid']}")
+            sock.close()
+            return
+
+        send_connection(self.channels[worker], self.locks[worker], sock, header)
+
+    def assign(self, header: dict) -> int:
+        # executed by lobby actor, returns worker relaying session of the pipe
+        session = self.lobby.findSession(header["uuid"], header["apptype"] == "server")
+        if not session:
+            return None
+
+        #session is relayed by worker, keep it alive in the lobby while pipes are coming
+        if session.host_uuid not in self.relayed:
+            self.lobby.scheduler.schedule(session, SESSION_EXPIRE, self.lobby.removeSession, session)
+
+        if session.worker == None:
+            session.worker = self.next_worker
+            self.next_worker = (self.next_worker + 1) % len(self.channels)
+            logging.info(f"[S {session.name}] Relayed by worker {session.worker}")
+
+        header["session"] = session_header(session)
+        return session.worker
+
+    def track(self, header: dict):
+        # executed by lobby actor, session expires only after worker has no connections of it
+        session = self.lobby.findSession(header["host_uuid"], True)
+        if not session:
+            return
+
+        if header["connections"] > 0:
+            self.relayed.add(session.host_uuid)
+            self.lobby.scheduler.cancel(session)
+        else:
+            self.relayed.discard(session.host_uuid)
+            self.lobby.scheduler.schedule(session, SESSION_EXPIRE, self.lobby.removeSession, session)
+
+    def handoff(self, sender: Sender, msg: bytes) -> bool:
+        if not sender.isPipe() or not sender.client.auth:
+            return False
+
+        header = pipe_header(sender)
+        self.route(sender.sock, header)
+        return True
+
+
+class WorkerRouter:
+    """
+    Lives in the worker process.
+    Lobby connections and authorized pipes accepted by worker are passed to the master,
+    pipes of sessions owned by worker come back from the master
+    """
+    channel: socket
+    lock: Lock
+
+    def __init__(self, channel: socket, on_pipe) -> None:
+        self.channel = channel
+        self.lock = Lock()
+        self.on_pipe = on_pipe
+
+    def start(self):
+        t = Thread(target=self.listen_for_master)
+        t.daemon = True
+        t.start()
+
+    def listen_for_master(self):
+        while True:
+            try:
+                sock, header = receive_connection(self.channel)
+                if not header:
+                    logging.critical(f"[!] Master channel is closed")
+                    return
+
+                self.on_pipe(sock, header)
+
+            except Exception as e:
+                logging.error(f"[!] Cannot receive connection from master: {e}")
+
+    def handoff(self, sender: Sender, msg: bytes) -> bool:
+        if sender.isLobby():
+            header = {"type": "lobby", "address": sender.address, "frames": pack_frames([msg]), "leftover": pack_frames([sender.takeLeftover()])[0]}
+            send_connection(self.channel, self.lock, sender.sock, header)
+            return True
+
+        if sender.isPipe() and sender.client.auth:
+            send_connection(self.channel, self.lock, sender.sock, pipe_header(sender))
+            return True
+
+        return False
+
+    def report(self, session: Session):
+        # master keeps session alive while this worker relays its game connections
+        send_status(self.channel, self.lock, {"type": "connections", "host_uuid": session.host_uuid, "connections": len(session.connections)})